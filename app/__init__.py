@@ -1,4 +1,5 @@
-from flask import Flask, flash
+from functools import cached_property
+from flask import Flask
 from config import Config
 from flask_pymongo import PyMongo
 from flask_login import LoginManager
@@ -6,9 +7,6 @@ from logging.handlers import RotatingFileHandler
 import logging
 import base64
 import os
-from cryptography.fernet import Fernet
-from argon2 import PasswordHasher
-import ngrok
 
 db_client = PyMongo()
 login = LoginManager()
@@ -16,30 +14,100 @@ login = LoginManager()
 login.login_view = "auth.login"
 login.login_message = "Please login to view this page"
 login.login_message_category = "warning"
+# API requests get a 401 instead of a redirect to the login page
+login.blueprint_login_views = {"api": None}
 
+# What a process built by create_app does. web serves requests, worker runs Celery tasks and
+# cli runs flask commands
+ROLES = ("web", "worker", "cli")
 
-def create_app(config_class=Config):
-    app = Flask(__name__)
+
+class CommutrFlask(Flask):
+    """Flask app that builds its password hasher and token encryptor on first use"""
+
+    @cached_property
+    def PH(self):
+        from app.passwords import build_password_hasher
+
+        return build_password_hasher(self.config)
+
+    @cached_property
+    def ENCRYPTOR(self):
+        from cryptography.fernet import Fernet
+
+        return Fernet(base64.b64decode(self.config.get("SECRET_KEY")))
+
+
+def open_tunnel(app):
+    """Opens an ngrok tunnel to the dev server and returns its public URL"""
+    import ngrok
+
+    listener = ngrok.werkzeug_develop()
+    url = listener.url()
+    app.logger.warning(
+        f"Application running at {url}. Set the authorization callback domain at "
+        f"https://www.strava.com/settings/api to {url.replace('https://', '')}"
+    )
+    return url
+
+
+def create_app(config_class=Config, role=None):
+    """Builds the app for one role
+
+    Every role gets Mongo and the caches. Only web registers the blueprints and password
+    checks, web and worker set up Celery, and web and cli register the flask commands. Nothing
+    prompts, and the ngrok tunnel is only opened when NGROK_TUNNEL is set.
+
+    Args:
+        config_class (class, optional): Config to load. Defaults to Config.
+        role (str, optional): web, worker or cli. Defaults to the APP_ROLE setting.
+
+    Returns:
+        Flask: The app
+    """
+    app = CommutrFlask(__name__)
     app.config.from_object(config_class)
-    db_client.init_app(app)
-    login.init_app(app)
-    from app.errors import bp as errors_bp
+    role = role or app.config.get("APP_ROLE") or "web"
+    if role not in ROLES:
+        raise ValueError(f"Unknown app role {role}. Use one of {', '.join(ROLES)}")
+    app.config["APP_ROLE"] = role
+    if app.config.get("METRICS_ENABLED"):
+        from app import metrics
+        from app.metrics import MongoCommandMetrics
 
-    app.register_blueprint(errors_bp)
+        db_client.init_app(app, event_listeners=[MongoCommandMetrics()])
+        metrics.init_app(app)
+    else:
+        db_client.init_app(app)
+    if app.config.get("MONGO_ENSURE_INDEXES"):
+        from app.db_queries.indexes import ensure_indexes
 
-    from app.auth import bp as auth_bp
+        with app.app_context():
+            ensure_indexes()
+    from app.db_queries.last_seen import last_seen_buffer
 
-    app.register_blueprint(auth_bp, url_prefix="/auth")
+    last_seen_buffer.init_app(app)
+    from app.db_queries.user_cache import user_cache
 
-    from app.strava import bp as strava_bp
+    user_cache.init_app(app)
+    from app.activity_store import activity_store
 
-    app.register_blueprint(strava_bp, url_prefix="/strava")
+    activity_store.init_app(app)
+    from app.db_queries.leaderboard import leaderboard
 
-    from app.main import bp as main_bp
+    leaderboard.init_app(app)
+    if role == "web":
+        register_web(app)
+    if role in ("web", "worker"):
+        from app.celery_tasks import celery_init_app
 
-    app.register_blueprint(main_bp)
-    app.PH = PasswordHasher()
-    app.ENCRYPTOR = Fernet(base64.b64decode(app.config.get("SECRET_KEY")))
+        celery_init_app(app)
+        # Registers the login user loader, and loads what tasks need before Celery forks
+        from app import models  # noqa: F401
+    if role in ("web", "cli"):
+        from app.commands import register_commands
+
+        register_commands(app)
     if not app.debug:
         if not os.path.exists("logs"):
             os.mkdir("logs")
@@ -55,27 +123,41 @@ def create_app(config_class=Config):
         app.logger.addHandler(file_handler)
 
         app.logger.setLevel(logging.INFO)
-        app.logger.info("CyberBike startup")
-        listener = ngrok.werkzeug_develop()
-        app.host_url = listener.url()
-        print(f"Application running at {app.host_url}")
-        print(
-            f"Update the authorization domain at https://www.strava.com/settings/api to \n {app.host_url.replace('https://', '')}"
-        )
-        updated = input(
-            "Have you updated the authorization callback domain at https://www.strava.com/settings/api (Y/N) "
-        )
-        if updated.lower() != "y":
-            print("You have to update the authorization domain for this to work")
-            return (
-                "You have to update the authorization domain for this to work",
-                400,
-            )
-
-    if app.debug:
-        app.host_url = "127.0.0.1:8080"
+        app.logger.info(f"CyberBike startup ({role})")
+    if role == "web" and app.config.get("NGROK_TUNNEL"):
+        app.host_url = open_tunnel(app)
+    else:
+        app.host_url = app.config.get("FLASK_DOMAIN") or "127.0.0.1:8080"
 
     return app
 
 
-from app import models
+def register_web(app):
+    """Sets up everything only needed to serve requests"""
+    login.init_app(app)
+    from app.main.profile import profile_cache
+
+    profile_cache.init_app(app)
+    from app.passwords import password_verifier
+
+    password_verifier.init_app(app)
+    from app.errors import bp as errors_bp
+
+    app.register_blueprint(errors_bp)
+
+    from app.auth import bp as auth_bp
+
+    app.register_blueprint(auth_bp, url_prefix="/auth")
+
+    from app.strava import bp as strava_bp
+
+    app.register_blueprint(strava_bp, url_prefix="/strava")
+
+    from app.main import bp as main_bp
+
+    app.register_blueprint(main_bp)
+
+    from app.api import bp as api_bp
+
+    app.register_blueprint(api_bp, url_prefix="/api")
+
@@ -0,0 +1,286 @@
+from contextlib import contextmanager
+import fcntl
+import json
+import logging
+import os
+import shutil
+from app.db_queries.dates import normalize_activity_dates
+
+logger = logging.getLogger(__name__)
+
+# Bump when the file layout changes. Stores written with another version, or another
+# analytics.ACTIVITY_TYPES, are rebuilt from Mongo on their next read
+STORE_VERSION = 1
+# Column name to numpy dtype. start is epoch seconds. numpy and analytics are imported when a
+# store is first read or written, not when the app starts
+COLUMNS = {
+    "ids": "int64",
+    "start": "int64",
+    "distance": "float64",
+    "moving_time": "int64",
+    "elevation": "float64",
+    "commute": "bool",
+    "type_code": "int16",
+}
+
+
+def _to_rows(columns):
+    rows = {name: getattr(columns, name) for name in COLUMNS}
+    rows["start"] = columns.start.astype("datetime64[s]").astype(COLUMNS["start"])
+    return rows
+
+
+def _to_columns(rows):
+    from app.analytics import ActivityColumns
+
+    return ActivityColumns(
+        **{name: rows[name] for name in COLUMNS if name != "start"},
+        start=rows["start"].astype("datetime64[s]"),
+    )
+
+
+class ActivityStore:
+    """Per athlete activity columns in memory-mapped .npy files, so stats skip Mongo
+
+    Each athlete has a directory holding one fixed-width file per column in COLUMNS, with room to
+    append, and meta.json with the row count. Activity writes in Mongo are mirrored with record
+    and forget, which patch rows in place or append them. An athlete without a store, or with
+    one from another STORE_VERSION, is rebuilt from Mongo on the next read.
+
+    A flock per athlete serializes writers across processes. Every process writing activities
+    has to share the directory, otherwise its writes are missing from the store.
+
+    Args:
+        directory (str, optional): Where stores are kept. Defaults to None, set by init_app.
+        initial_capacity (int, optional): Rows a new store has room for. Defaults to 256.
+    """
+
+    def __init__(self, directory=None, initial_capacity=256):
+        self.directory = directory
+        self.initial_capacity = initial_capacity
+        self.enabled = directory is not None
+
+    def init_app(self, app):
+        self.enabled = app.config.get("ACTIVITY_STORE_ENABLED", True)
+        self.directory = app.config.get("ACTIVITY_STORE_DIR") or os.path.join(
+            app.instance_path, "activity_store"
+        )
+
+    def _path(self, athlete_id, name=""):
+        return os.path.join(self.directory, str(athlete_id), name)
+
+    @contextmanager
+    def _locked(self, athlete_id, exclusive=True):
+        os.makedirs(self._path(athlete_id), exist_ok=True)
+        with open(self._path(athlete_id, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _meta(self, athlete_id):
+        """The store's meta.json, or None if it's missing or from another version"""
+        from app.analytics import ACTIVITY_TYPES
+
+        try:
+            with open(self._path(athlete_id, "meta.json"), encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != STORE_VERSION or meta.get("types") != list(ACTIVITY_TYPES):
+            return None
+        return meta
+
+    def _write_meta(self, athlete_id, count, capacity):
+        from app.analytics import ACTIVITY_TYPES
+
+        path = self._path(athlete_id, "meta.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as meta_file:
+            json.dump(
+                {
+                    "version": STORE_VERSION,
+                    "types": list(ACTIVITY_TYPES),
+                    "count": count,
+                    "capacity": capacity,
+                },
+                meta_file,
+            )
+        os.replace(f"{path}.tmp", path)
+
+    def _open(self, athlete_id, mode="r"):
+        import numpy as np
+
+        return {
+            name: np.load(self._path(athlete_id, f"{name}.npy"), mmap_mode=mode)
+            for name in COLUMNS
+        }
+
+    def _write(self, athlete_id, rows, capacity):
+        """Writes rows to new column files with room for capacity rows"""
+        import numpy as np
+
+        count = len(rows["ids"])
+        for name, dtype in COLUMNS.items():
+            path = self._path(athlete_id, f"{name}.npy")
+            column = np.lib.format.open_memmap(
+                f"{path}.tmp", mode="w+", dtype=dtype, shape=(capacity,)
+            )
+            column[:count] = rows[name]
+            column.flush()
+            del column
+            os.replace(f"{path}.tmp", path)
+        self._write_meta(athlete_id, count, capacity)
+
+    def _rebuild(self, athlete_id):
+        from app.analytics import load_activity_columns
+
+        rows = _to_rows(load_activity_columns(athlete_id))
+        count = len(rows["ids"])
+        capacity = max(self.initial_capacity, 2 * count)
+        self._write(athlete_id, rows, capacity)
+        logger.info(f"Rebuilt the activity store for athlete {athlete_id} with {count} rows")
+        return self._meta(athlete_id)
+
+    def columns(self, athlete_id):
+        """An athlete's activities, rebuilding the store from Mongo if needed
+
+        Args:
+            athlete_id (int): Strava athlete id
+
+        Returns:
+            ActivityColumns: Every stored activity, sorted by start date
+        """
+        with self._locked(athlete_id, exclusive=False):
+            meta = self._meta(athlete_id)
+            if meta is not None:
+                return self._read(athlete_id, meta["count"])
+        with self._locked(athlete_id):
+            meta = self._meta(athlete_id) or self._rebuild(athlete_id)
+            return self._read(athlete_id, meta["count"])
+
+    def _read(self, athlete_id, count):
+        arrays = self._open(athlete_id)
+        # Sorting copies the rows out of the maps, so nothing is read after the lock is released
+        return _to_columns({name: arrays[name][:count] for name in COLUMNS}).sorted()
+
+    def _upsert(self, athlete_id, activities):
+        import numpy as np
+        from app.analytics import ActivityColumns
+
+        meta = self._meta(athlete_id)
+        if meta is None:
+            # Nothing to patch. The next read builds the store from Mongo, with these activities
+            return
+        rows = _to_rows(ActivityColumns.from_activities(activities))
+        count, capacity = meta["count"], meta["capacity"]
+        arrays = self._open(athlete_id, mode="r+")
+        stored_ids = arrays["ids"][:count]
+        found = np.zeros(len(rows["ids"]), dtype=bool)
+        if count:
+            # Row of each activity, by binary search over the stored ids
+            order = np.argsort(stored_ids, kind="stable")
+            position = np.searchsorted(stored_ids, rows["ids"], sorter=order)
+            index = order[np.minimum(position, count - 1)]
+            found = stored_ids[index] == rows["ids"]
+            for name in COLUMNS:
+                arrays[name][index[found]] = rows[name][found]
+        new = ~found
+        # Duplicates in the same call are only appended once
+        _, first = np.unique(rows["ids"][new], return_index=True)
+        added = {name: rows[name][new][np.sort(first)] for name in COLUMNS}
+        added_count = len(added["ids"])
+        if count + added_count > capacity:
+            current = {name: arrays[name][:count] for name in COLUMNS}
+            del arrays
+            capacity = max(2 * capacity, count + added_count)
+            self._write(
+                athlete_id,
+                {name: np.concatenate((current[name], added[name])) for name in COLUMNS},
+                capacity,
+            )
+            return
+        for name in COLUMNS:
+            arrays[name][count : count + added_count] = added[name]
+            arrays[name].flush()
+        self._write_meta(athlete_id, count + added_count, capacity)
+
+    def _remove(self, athlete_id, activity_ids):
+        import numpy as np
+
+        meta = self._meta(athlete_id)
+        if meta is None:
+            return
+        count = meta["count"]
+        arrays = self._open(athlete_id, mode="r+")
+        keep = ~np.isin(arrays["ids"][:count], activity_ids)
+        kept = int(keep.sum())
+        if kept == count:
+            return
+        for name in COLUMNS:
+            arrays[name][:kept] = arrays[name][:count][keep]
+            arrays[name].flush()
+        self._write_meta(athlete_id, kept, meta["capacity"])
+
+    def _safely(self, athlete_id, write, *args):
+        """Runs a write. A store that can't be updated is dropped so it's rebuilt, not stale"""
+        try:
+            with self._locked(athlete_id):
+                write(athlete_id, *args)
+        except (OSError, ValueError) as e:
+            logger.error(f"Couldn't update the activity store for athlete {athlete_id}. {e}")
+            self.drop(athlete_id)
+
+    def record(self, activities):
+        """Adds or replaces activities after they're written to Mongo
+
+        Args:
+            activities (list(dict)): Strava activities, from any athletes
+        """
+        if not self.enabled:
+            return
+        by_athlete = {}
+        for activity in activities:
+            athlete_id = (activity.get("athlete") or {}).get("id")
+            if athlete_id is not None and activity.get("start_date"):
+                by_athlete.setdefault(athlete_id, []).append(normalize_activity_dates(activity))
+        for athlete_id, athlete_activities in by_athlete.items():
+            self._safely(athlete_id, self._upsert, athlete_activities)
+
+    def patch(self, athlete_id, activity_id, values):
+        """Changes columns of one stored activity
+
+        Args:
+            athlete_id (int): Strava athlete id
+            activity_id (int): Activity id
+            values (dict): Column name to value. Ex: {"type_code": 0}
+        """
+        if not self.enabled:
+            return
+
+        def write(athlete_id):
+            import numpy as np
+
+            meta = self._meta(athlete_id)
+            if meta is None:
+                return
+            arrays = self._open(athlete_id, mode="r+")
+            index = np.flatnonzero(arrays["ids"][: meta["count"]] == activity_id)
+            for name, value in values.items():
+                arrays[name][index] = value
+                arrays[name].flush()
+
+        self._safely(athlete_id, write)
+
+    def forget(self, athlete_id, activity_ids):
+        """Removes deleted activities"""
+        if not self.enabled:
+            return
+        self._safely(athlete_id, self._remove, list(activity_ids))
+
+    def drop(self, athlete_id):
+        """Deletes an athlete's store. The next read rebuilds it"""
+        shutil.rmtree(self._path(athlete_id), ignore_errors=True)
+
+
+activity_store = ActivityStore()
@@ -0,0 +1,340 @@
+from dataclasses import dataclass, fields
+from datetime import datetime
+import numpy as np
+from app import db_client
+
+# Meters per unit of distance, and the matching unit for elevation in meters
+DISTANCE_UNITS = {
+    "miles": (1609.34, 0.3048),
+    "mi": (1609.34, 0.3048),
+    "km": (1000.0, 1.0),
+    "kilometers": (1000.0, 1.0),
+    "m": (1.0, 1.0),
+    "meters": (1.0, 1.0),
+}
+PERIODS = ("day", "week", "month", "year")
+# Average new car in the EU, kg of CO2 per km driven instead of ridden
+CO2_KG_PER_KM = 0.17
+
+# Activity types stored as their index in type_code. Append only, codes are persisted by
+# the activity store. Any other type is -1
+ACTIVITY_TYPES = (
+    "Ride",
+    "EBikeRide",
+    "VirtualRide",
+    "Run",
+    "VirtualRun",
+    "Walk",
+    "Hike",
+    "Swim",
+    "InlineSkate",
+    "Skateboard",
+    "Kayaking",
+    "Rowing",
+    "NordicSki",
+    "Workout",
+)
+_TYPE_CODES = {name: code for code, name in enumerate(ACTIVITY_TYPES)}
+
+# Fields load_activity_columns reads from each activity
+ANALYTICS_FIELDS = {
+    "_id": 0,
+    "id": 1,
+    "type": 1,
+    "start_date": 1,
+    "distance": 1,
+    "moving_time": 1,
+    "total_elevation_gain": 1,
+    "commute": 1,
+}
+
+
+def type_code(activity_type):
+    """Code of an activity type in ACTIVITY_TYPES, -1 if it isn't listed"""
+    return _TYPE_CODES.get(activity_type, -1)
+
+
+def unit_scales(units):
+    """Meters per distance unit and per elevation unit
+
+    Args:
+        units (str): A key of DISTANCE_UNITS. Ex: miles, km
+
+    Returns:
+        tuple(float): (distance_scale, elevation_scale)
+    """
+    try:
+        return DISTANCE_UNITS[units]
+    except KeyError:
+        choices = ", ".join(DISTANCE_UNITS)
+        raise ValueError(f"Unknown units {units}. Use one of {choices}") from None
+
+
+def period_start(dates, period):
+    """Start of the day, ISO week, month or year containing each date
+
+    Args:
+        dates (np.ndarray): datetime64 values
+        period (str): day, week, month or year
+
+    Returns:
+        np.ndarray: datetime64[D] period starts
+    """
+    days = dates.astype("datetime64[D]")
+    if period == "day":
+        return days
+    if period == "week":
+        # 1970-01-01 was a Thursday, so day 0 is 3 days after a monday
+        return days - (days.astype(np.int64) + 3) % 7
+    if period == "month":
+        return days.astype("datetime64[M]").astype("datetime64[D]")
+    if period == "year":
+        return days.astype("datetime64[Y]").astype("datetime64[D]")
+    raise ValueError(f"Unknown period {period}. Use one of {', '.join(PERIODS)}")
+
+
+def last_periods(period, count, end=None):
+    """Starts of the last count periods, oldest first, ending with the period containing end
+
+    Args:
+        period (str): day, week, month or year
+        count (int): Number of periods
+        end (datetime, optional): Defaults to now in UTC, like stored start dates.
+
+    Returns:
+        np.ndarray: datetime64[D] period starts
+    """
+    end = np.datetime64(end or datetime.utcnow(), "D")
+    steps = np.arange(count - 1, -1, -1)
+    if period in ("day", "week"):
+        step = 7 if period == "week" else 1
+        return period_start(np.array([end]), period)[0] - steps * step
+    unit = "M" if period == "month" else "Y"
+    return (end.astype(f"datetime64[{unit}]") - steps).astype("datetime64[D]")
+
+
+def period_range(period, start, end):
+    """Starts of every period from the one containing start to the one containing end
+
+    Args:
+        period (str): day, week, month or year
+        start (date): First day of the range
+        end (date): Last day of the range
+
+    Returns:
+        np.ndarray: datetime64[D] period starts, oldest first. Empty if end is before start
+    """
+    first, last = period_start(
+        np.array([np.datetime64(start, "D"), np.datetime64(end, "D")]), period
+    )
+    if period in ("day", "week"):
+        step = 7 if period == "week" else 1
+        return np.arange(first, last + 1, step)
+    unit = "M" if period == "month" else "Y"
+    first, last = first.astype(f"datetime64[{unit}]"), last.astype(f"datetime64[{unit}]")
+    return np.arange(first, last + 1).astype("datetime64[D]")
+
+
+@dataclass
+class ActivityColumns:
+    """An athlete's activities as parallel arrays, one entry per activity, oldest first"""
+
+    ids: np.ndarray  # int64
+    start: np.ndarray  # datetime64[s], UTC
+    distance: np.ndarray  # float64, meters
+    moving_time: np.ndarray  # int64, seconds
+    elevation: np.ndarray  # float64, meters
+    commute: np.ndarray  # bool
+    type_code: np.ndarray  # int16, see ACTIVITY_TYPES
+
+    @classmethod
+    def from_activities(cls, activities):
+        """Builds the columns from activity documents with BSON start dates
+
+        Args:
+            activities (list(dict)): Activities with the fields in ANALYTICS_FIELDS
+
+        Returns:
+            ActivityColumns: Columns sorted by start date
+        """
+        columns = cls(
+            ids=np.array([a.get("id") or 0 for a in activities], dtype=np.int64),
+            start=np.array([a["start_date"] for a in activities], dtype="datetime64[s]"),
+            distance=np.array([a.get("distance") or 0 for a in activities], dtype=np.float64),
+            moving_time=np.array(
+                [a.get("moving_time") or 0 for a in activities], dtype=np.int64
+            ),
+            elevation=np.array(
+                [a.get("total_elevation_gain") or 0 for a in activities], dtype=np.float64
+            ),
+            commute=np.array([bool(a.get("commute")) for a in activities], dtype=bool),
+            type_code=np.array([type_code(a.get("type")) for a in activities], dtype=np.int16),
+        )
+        return columns.sorted()
+
+    def sorted(self):
+        order = np.argsort(self.start, kind="stable")
+        return ActivityColumns(**{f.name: getattr(self, f.name)[order] for f in fields(self)})
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def activity_columns_query(strava_id, since=None):
+    """Filter for the activities load_activity_columns reads"""
+    if since is None:
+        return {"athlete.id": strava_id, "start_date": {"$type": "date"}}
+    return {"athlete.id": strava_id, "start_date": {"$gte": since}}
+
+
+def load_activity_columns(strava_id, since=None):
+    """Loads an athlete's activities from Mongo in one query
+
+    Args:
+        strava_id (int): Strava athlete id
+        since (datetime, optional): Only activities that started on or after this. Defaults to
+            all activities.
+
+    Returns:
+        ActivityColumns: The activities
+    """
+    query = activity_columns_query(strava_id, since)
+    return ActivityColumns.from_activities(
+        list(db_client.db.activities.find(query, ANALYTICS_FIELDS))
+    )
+
+
+@dataclass
+class PeriodTotals:
+    """Totals per period, one entry per period, oldest first. Distances are in units"""
+
+    period: str
+    units: str
+    starts: np.ndarray  # datetime64[D] period starts
+    distance: np.ndarray
+    commute_distance: np.ndarray
+    moving_time: np.ndarray  # seconds
+    elevation: np.ndarray  # feet for miles, meters otherwise
+    activities: np.ndarray
+    commutes: np.ndarray
+    co2_saved_kg: np.ndarray
+
+    def labels(self):
+        """Period starts as YYYY-MM-DD strings"""
+        return np.datetime_as_string(self.starts, unit="D").tolist()
+
+    def to_dict(self, digits=2):
+        """Period start string to its totals, newest first like the profile chart expects"""
+        totals = {}
+        for index in range(len(self.starts) - 1, -1, -1):
+            totals[str(self.starts[index])] = {
+                "distance": round(float(self.distance[index]), digits),
+                "commute_distance": round(float(self.commute_distance[index]), digits),
+                "moving_time": int(self.moving_time[index]),
+                "elevation": round(float(self.elevation[index]), digits),
+                "activities": int(self.activities[index]),
+                "commutes": int(self.commutes[index]),
+                "co2_saved_kg": round(float(self.co2_saved_kg[index]), digits),
+            }
+        return totals
+
+
+def period_totals(columns, period="week", starts=None, units="miles"):
+    """Sums activities per period in one pass per measure
+
+    Args:
+        columns (ActivityColumns): The activities
+        period (str, optional): day, week, month or year. Defaults to "week".
+        starts (np.ndarray, optional): Period starts to report, oldest first. Periods without
+            activities are zero and activities outside them are left out. Defaults to every
+            period with an activity.
+        units (str, optional): Distance units, see DISTANCE_UNITS. Defaults to "miles".
+
+    Returns:
+        PeriodTotals: Totals per period
+    """
+    distance_scale, elevation_scale = unit_scales(units)
+    activity_starts = period_start(columns.start, period)
+    if starts is None:
+        starts = np.unique(activity_starts)
+    size = len(starts)
+    index = np.searchsorted(starts, activity_starts)
+    inside = index < size
+    inside[inside] = starts[index[inside]] == activity_starts[inside]
+    index = index[inside]
+
+    def total(weights=None):
+        if weights is not None:
+            weights = weights[inside]
+        return np.bincount(index, weights=weights, minlength=size)
+
+    commute = columns.commute.astype(np.float64)
+    commute_meters = total(columns.distance * commute)
+    return PeriodTotals(
+        period=period,
+        units=units,
+        starts=starts,
+        distance=total(columns.distance) / distance_scale,
+        commute_distance=commute_meters / distance_scale,
+        moving_time=total(columns.moving_time.astype(np.float64)).astype(np.int64),
+        elevation=total(columns.elevation) / elevation_scale,
+        activities=total().astype(np.int64),
+        commutes=total(commute).astype(np.int64),
+        co2_saved_kg=commute_meters / 1000 * CO2_KG_PER_KM,
+    )
+
+
+def last_period_totals(columns, period="week", count=10, units="miles", end=None):
+    """Totals for the last count periods, including empty ones. See period_totals"""
+    return period_totals(columns, period, last_periods(period, count, end), units)
+
+
+def commute_streaks(columns, period="day", end=None):
+    """Runs of consecutive days or weeks with at least one commute
+
+    Args:
+        columns (ActivityColumns): The activities
+        period (str, optional): day or week. Defaults to "day".
+        end (datetime, optional): Now, for whether the latest streak is still going. Defaults to
+            now in UTC.
+
+    Returns:
+        dict: current and longest streak lengths in periods. The current streak counts if its
+            last commute was this period or the one before.
+    """
+    step = {"day": 1, "week": 7}.get(period)
+    if step is None:
+        raise ValueError("Streaks are counted in days or weeks")
+    commuted = np.unique(period_start(columns.start[columns.commute], period))
+    if not len(commuted):
+        return {"current": 0, "longest": 0}
+    gaps = np.diff(commuted).astype(np.int64) != step
+    # Index where each run starts, then run lengths from the distance between starts
+    run_starts = np.concatenate(([0], np.flatnonzero(gaps) + 1))
+    run_lengths = np.diff(np.concatenate((run_starts, [len(commuted)])))
+    now = np.datetime64(end or datetime.utcnow(), "D")
+    this_period = period_start(np.array([now]), period)[0]
+    current = 0
+    if (this_period - commuted[-1]).astype(np.int64) <= step:
+        current = int(run_lengths[-1])
+    return {"current": current, "longest": int(run_lengths.max())}
+
+
+def summary(columns, units="miles"):
+    """All time totals
+
+    Returns:
+        dict: distance, commute_distance, moving_time, elevation, activities, commutes and
+            co2_saved_kg
+    """
+    distance_scale, elevation_scale = unit_scales(units)
+    commute_meters = float(columns.distance[columns.commute].sum())
+    return {
+        "distance": float(columns.distance.sum()) / distance_scale,
+        "commute_distance": commute_meters / distance_scale,
+        "moving_time": int(columns.moving_time.sum()),
+        "elevation": float(columns.elevation.sum()) / elevation_scale,
+        "activities": len(columns),
+        "commutes": int(columns.commute.sum()),
+        "co2_saved_kg": commute_meters / 1000 * CO2_KG_PER_KM,
+    }
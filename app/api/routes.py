@@ -0,0 +1,99 @@
+from datetime import datetime
+from flask import current_app, jsonify, request
+from flask_login import login_required
+from app import analytics
+from app.api import bp
+from app.api.totals import gzip_chunks, iter_totals_json
+from app.conditional import conditional_response, data_validators
+from app.db_queries.data_versions import get_data_version
+from app.models import load_user
+
+# Fewest days in each period, to bound a date range before building its periods
+PERIOD_DAYS = {"day": 1, "week": 7, "month": 28, "year": 365}
+
+
+def error(message, status=400):
+    return jsonify(error=message), status
+
+
+def parse_day(value):
+    """A YYYY-MM-DD query argument as a date, None if it's missing"""
+    if not value:
+        return None
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+@bp.route("/users/<username>/totals")
+@login_required
+def user_totals(username):
+    """Distance, time, elevation, commutes and CO2 saved per period
+
+    Query args:
+        period: day, week, month or year. Defaults to week.
+        start, end: First and last day, YYYY-MM-DD. end defaults to today in UTC. Without start,
+            the last count periods up to end are returned.
+        count: Periods when start isn't given. Defaults to 10.
+        units: Distance units, see analytics.DISTANCE_UNITS. Defaults to miles.
+
+    The totals are computed in memory as numpy columns, bounded by TOTALS_MAX_PERIODS. For
+    long series only the JSON encoding, and gzip for clients that accept it, is streamed.
+    """
+    period = request.args.get("period", "week")
+    units = request.args.get("units", "miles")
+    max_periods = current_app.config["TOTALS_MAX_PERIODS"]
+    if period not in analytics.PERIODS:
+        return error(f"Unknown period {period}. Use one of {', '.join(analytics.PERIODS)}")
+    try:
+        analytics.unit_scales(units)
+    except ValueError as e:
+        return error(str(e))
+    try:
+        start = parse_day(request.args.get("start"))
+        end = parse_day(request.args.get("end")) or datetime.utcnow().date()
+    except ValueError:
+        return error("Dates are YYYY-MM-DD")
+    if start is None:
+        count = request.args.get("count", 10, type=int)
+        if not 1 <= count <= max_periods:
+            return error(f"count must be between 1 and {max_periods}")
+        starts = analytics.last_periods(period, count, end)
+    else:
+        range_error = f"start must not be after end, and the range at most {max_periods} periods"
+        if start > end or (end - start).days // PERIOD_DAYS[period] >= max_periods:
+            return error(range_error)
+        starts = analytics.period_range(period, start, end)
+        if len(starts) > max_periods:
+            return error(range_error)
+    version = get_data_version(username)
+    if version is None:
+        return error("User not found", 404)
+    first, end = str(starts[0]), str(end)
+    gzipped = "gzip" in request.accept_encodings
+    etag, last_modified = data_validators(
+        (username, period, units, first, end, gzipped),
+        version,
+        # The latest period can change without a write, when it starts
+        not_before=starts[-1].astype("datetime64[s]").astype(datetime),
+    )
+    response, modified = conditional_response(
+        etag, last_modified, vary=("Cookie", "Accept-Encoding")
+    )
+    if not modified:
+        return response
+    user = load_user(username)
+    if user is None:
+        return error("User not found", 404)
+    totals = user.get_range_totals(starts, period, units)
+    header = {"username": username, "period": period, "units": units, "start": first, "end": end}
+    chunks = iter_totals_json(totals, header)
+    if gzipped:
+        response.content_encoding = "gzip"
+        chunks = gzip_chunks(chunks)
+    else:
+        chunks = (chunk.encode("utf-8") for chunk in chunks)
+    response.mimetype = "application/json"
+    if len(starts) > current_app.config["TOTALS_STREAM_PERIODS"]:
+        response.response = chunks
+    else:
+        response.set_data(b"".join(chunks))
+    return response
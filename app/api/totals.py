@@ -0,0 +1,64 @@
+import json
+import zlib
+import numpy as np
+
+# PeriodTotals fields in the totals JSON, after the period start labels
+TOTALS_COLUMNS = (
+    "distance",
+    "commute_distance",
+    "moving_time",
+    "elevation",
+    "activities",
+    "commutes",
+    "co2_saved_kg",
+)
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"))
+
+
+def iter_totals_json(totals, header, chunk_size=2048, digits=2):
+    """Encodes totals as one compact JSON object, a slice of a column at a time
+
+    Each column is a list with one value per period, so a series is never built as one string
+    or as a list of objects. The totals themselves are already in memory, only the encoding is
+    spread over the chunks. Ex: {"period":"week",...,"labels":["2024-01-01"],"distance":[12.5]}
+
+    Args:
+        totals (PeriodTotals): The totals
+        header (dict): Fields written before the columns
+        chunk_size (int, optional): Values per chunk. Defaults to 2048.
+        digits (int, optional): Decimal places kept. Defaults to 2.
+
+    Yields:
+        str: Pieces of the JSON document
+    """
+    yield _dumps(header)[:-1] + ("," if header else "")
+    columns = [("labels", totals.starts)]
+    columns += [(name, getattr(totals, name)) for name in TOTALS_COLUMNS]
+    for index, (name, values) in enumerate(columns):
+        yield f'{"," if index else ""}{_dumps(name)}:['
+        for offset in range(0, len(values), chunk_size):
+            chunk = values[offset : offset + chunk_size]
+            if name == "labels":
+                chunk = np.datetime_as_string(chunk, unit="D")
+            elif chunk.dtype.kind == "f":
+                chunk = chunk.round(digits)
+            yield ("," if offset else "") + _dumps(chunk.tolist())[1:-1]
+        yield "]"
+    yield "}"
+
+
+def gzip_chunks(chunks, level=6):
+    """Compresses text chunks into one gzip stream as they come
+
+    Yields:
+        bytes: Compressed data
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
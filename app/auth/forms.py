@@ -26,6 +26,6 @@ class RegistrationForm(FlaskForm):
             raise ValidationError("Please use a different username.")
 
     def validate_email(self, email):
-        user = db_client.db.users.find_one({"username": email.data})
+        user = db_client.db.users.find_one({"email": email.data})
         if user is not None:
             raise ValidationError("Please use a different email address.")
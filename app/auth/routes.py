@@ -10,14 +10,16 @@ from flask import (
 )
 from flask_login import current_user, login_user, logout_user, login_required
 from urllib.parse import urlsplit, urlencode
+from pymongo.errors import DuplicateKeyError
 from app.models import User
+from app.strava_api import strava_url
+from app.passwords import VerifierBusy
 from app import db_client
 from app.auth import bp
 
 
 @bp.route("/strava_authorize", methods=["GET"])
 def strava_authorize():
-    strava_url = "https://www.strava.com/oauth/authorize"
     params = {
         "client_id": current_app.config["STRAVA_CLIENT_ID"],
         "redirect_uri": f"{current_app.host_url}/auth/strava_token",
@@ -25,7 +27,7 @@ def strava_authorize():
         "scope": current_app.config["REQUIRED_SCOPE"],
         "approval_prompt": "force",
     }
-    return redirect(f"{strava_url}?{urlencode(params)}")
+    return redirect(f"{strava_url('/oauth/authorize')}?{urlencode(params)}")
 
 
 @bp.route("/strava_token", methods=["GET"])
@@ -53,14 +55,21 @@ def login():
         return redirect(url_for("main.index"))
     form = LoginForm()
     if form.validate_on_submit():
-        user_data = db_client.db.users.find_one(
-            {"username": form.username.data}
-        ) or db_client.db.users.find_one({"email": form.username.data})
-        if user_data:
-            user = User(**user_data)
-        else:
-            user = None
-        if user is None or not user.check_password(form.password.data):
+        # One lookup on the username and email indexes. A username match wins
+        matches = list(
+            db_client.db.users.find(
+                {"$or": [{"username": form.username.data}, {"email": form.username.data}]},
+                limit=2,
+            )
+        )
+        matches.sort(key=lambda user_data: user_data.get("username") != form.username.data)
+        user = User(**matches[0]) if matches else None
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+        except VerifierBusy:
+            flash("Too many people are signing in, please try again", "warning")
+            return redirect(url_for("auth.login"))
+        if not valid:
             flash("Invalid username or password", "warning")
             return redirect(url_for("auth.login"))
         login_user(user, remember=form.remember_me.data)
@@ -80,8 +89,16 @@ def register():
     form = RegistrationForm()
     if form.validate_on_submit():
         user = User(username=form.username.data, email=form.email.data)
-        user.set_password(form.password.data)
-        db_client.db.users.insert_one(user.__dict__)
+        try:
+            user.set_password(form.password.data)
+        except VerifierBusy:
+            flash("Too many people are signing in, please try again", "warning")
+            return redirect(url_for("auth.register"))
+        try:
+            db_client.db.users.insert_one(user.__dict__)
+        except DuplicateKeyError:
+            flash("Please use a different username or email address.", "warning")
+            return redirect(url_for("auth.register"))
         flash("Congratulations, you are now a registered user!", "success")
         return redirect(url_for("auth.login"))
     return render_template("auth/register.html", title="Register", form=form)
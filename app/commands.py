@@ -0,0 +1,166 @@
+import click
+from flask.cli import AppGroup
+
+rollups_cli = AppGroup("rollups", help="Manage the weekly commute rollups.")
+activities_cli = AppGroup("activities", help="Manage stored Strava activities.")
+indexes_cli = AppGroup("indexes", help="Manage Mongo indexes.")
+leaderboard_cli = AppGroup("leaderboard", help="Manage the commute leaderboards.")
+passwords_cli = AppGroup("passwords", help="Manage password hashing.")
+ingest_cli = AppGroup("ingest", help="Sync Strava activities with the asyncio worker.")
+
+
+@rollups_cli.command("rebuild")
+@click.option("--athlete", type=int, default=None, help="Strava athlete id to rebuild.")
+def rebuild_rollups(athlete):
+    """Recomputes weekly rollups from the activities collection."""
+    from app.db_queries.rollups import rebuild_weekly_rollups
+
+    count = rebuild_weekly_rollups(athlete)
+    click.echo(f"Rebuilt {count} weekly rollups")
+
+
+@leaderboard_cli.command("rebuild")
+def rebuild_leaderboard_scores():
+    """Recomputes the weekly and monthly leaderboards from the activities collection."""
+    from app.db_queries.leaderboard import rebuild_leaderboard
+
+    count = rebuild_leaderboard()
+    click.echo(f"Rebuilt {count} leaderboard scores")
+
+
+@activities_cli.command("migrate-dates")
+@click.option("--batch-size", type=int, default=1000, show_default=True)
+def migrate_dates(batch_size):
+    """Converts string start dates to BSON dates and creates the weekly aggregation index."""
+    from app.db_queries.indexes import ensure_activity_indexes
+    from app.db_queries.migrations import migrate_activity_dates
+
+    summary = migrate_activity_dates(batch_size)
+    ensure_activity_indexes()
+    click.echo(f"Converted dates on {summary['converted']} activities")
+    if summary["skipped"]:
+        click.echo(f"Skipped {summary['skipped']} activities with invalid dates", err=True)
+
+
+@activities_cli.command("reset-store")
+@click.option("--athlete", type=int, required=True, help="Strava athlete id.")
+def reset_store(athlete):
+    """Deletes an athlete's local activity store. It's rebuilt from Mongo on the next read."""
+    from app.activity_store import activity_store
+
+    activity_store.drop(athlete)
+    click.echo(f"Reset the activity store for athlete {athlete}")
+
+
+@activities_cli.command("compact")
+@click.option("--batch-size", type=int, default=500, show_default=True)
+def compact(batch_size):
+    """Moves full activity payloads to the compressed archive."""
+    from app.db_queries.migrations import compact_activities
+
+    count = compact_activities(batch_size)
+    click.echo(f"Compacted {count} activities")
+
+
+@indexes_cli.command("ensure")
+def ensure():
+    """Creates every registered index that doesn't exist yet."""
+    from app.db_queries.indexes import ensure_indexes
+
+    failed = ensure_indexes()
+    for collection, names in failed.items():
+        click.echo(f"Couldn't create {', '.join(names)} on {collection}", err=True)
+    if failed:
+        raise SystemExit(1)
+    click.echo("Indexes are up to date")
+
+
+@indexes_cli.command("check")
+def check():
+    """Explains the app's queries and fails if any would scan a whole collection."""
+    from app.db_queries.indexes import collection_scans
+
+    scans = collection_scans()
+    for description in scans:
+        click.echo(f"COLLSCAN: {description}", err=True)
+    if scans:
+        raise SystemExit(1)
+    click.echo("Every query uses an index")
+
+
+@passwords_cli.command("calibrate")
+@click.option("--target-ms", type=float, default=250, show_default=True)
+@click.option("--memory-cost", type=int, default=65536, show_default=True, help="KiB to start from.")
+@click.option("--parallelism", type=int, default=1, show_default=True)
+@click.option(
+    "--write",
+    "env_file",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Env file to save the settings to, e.g. .env",
+)
+def calibrate_passwords(target_ms, memory_cost, parallelism, env_file):
+    """Benchmarks argon2 settings on this host against a target login latency.
+
+    Stored hashes are upgraded to new settings the next time each user logs in.
+    """
+    from app.passwords import calibrate
+
+    settings = calibrate(target_ms, memory_cost=memory_cost, parallelism=parallelism)
+    click.echo(
+        f"time_cost={settings['time_cost']} memory_cost={settings['memory_cost']} "
+        f"parallelism={settings['parallelism']} ({settings['milliseconds']:.0f} ms per hash)"
+    )
+    if env_file:
+        from dotenv import set_key
+
+        for key in ("time_cost", "memory_cost", "parallelism"):
+            set_key(env_file, f"ARGON2_{key.upper()}", str(settings[key]), quote_mode="never")
+        click.echo(f"Saved to {env_file}")
+
+
+@ingest_cli.command("sync")
+@click.option("--user", "usernames", multiple=True, help="Username to sync. Can be repeated.")
+@click.option("--all", "sync_all", is_flag=True, help="Sync every user connected to Strava.")
+@click.option("--concurrency", type=int, default=None, help="Strava calls at once in total.")
+@click.option("--per-athlete", type=int, default=None, help="Strava calls at once per athlete.")
+def ingest_sync(usernames, sync_all, concurrency, per_athlete):
+    """Brings users' activities up to date with Strava, many users at once."""
+    from flask import current_app
+    from app import db_client
+    from app.ingest import run_ingest
+
+    usernames = list(usernames)
+    if sync_all:
+        users = db_client.db.users.find(
+            {"scope": True, "strava_id": {"$ne": 0}}, {"_id": 0, "username": 1}
+        )
+        usernames.extend(user["username"] for user in users)
+    syncs, _ = run_ingest(
+        current_app._get_current_object(),
+        usernames,
+        max_concurrency=concurrency,
+        per_athlete=per_athlete,
+    )
+    failed = False
+    for username, result in syncs.items():
+        if result is None:
+            click.echo(f"{username}: not connected to Strava")
+        elif isinstance(result, BaseException):
+            failed = True
+            click.echo(f"{username}: {result}", err=True)
+        else:
+            status = "complete" if result.complete else "failed"
+            failed = failed or not result.complete
+            click.echo(f"{username}: {result.activities} activities, {status}")
+    if failed:
+        raise SystemExit(1)
+
+
+def register_commands(app):
+    app.cli.add_command(rollups_cli)
+    app.cli.add_command(activities_cli)
+    app.cli.add_command(leaderboard_cli)
+    app.cli.add_command(indexes_cli)
+    app.cli.add_command(passwords_cli)
+    app.cli.add_command(ingest_cli)
@@ -0,0 +1,60 @@
+from datetime import timezone
+import hashlib
+from flask import make_response, request, session
+from werkzeug.http import is_resource_modified
+
+
+def data_validators(key, version, not_before=None):
+    """Strong ETag and Last-Modified for a response built from a user's data
+
+    Args:
+        key (tuple): Everything else the response depends on. Ex: the query arguments
+        version (dict): From get_data_version
+        not_before (datetime, optional): Earliest Last-Modified, for responses that also change
+            with the date. Defaults to None.
+
+    Returns:
+        tuple: (etag, last_modified). last_modified is timezone aware, or None if the user has
+            no write time
+    """
+    key = (key, version.get("data_version", 0))
+    etag = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+    times = [
+        time
+        for time in (version.get("data_updated_at") or version.get("created_at"), not_before)
+        if time is not None
+    ]
+    if not times:
+        return etag, None
+    return etag, max(times).replace(tzinfo=timezone.utc, microsecond=0)
+
+
+def conditional_response(etag, last_modified=None, vary=("Cookie",)):
+    """An empty response carrying the validators, with a 304 status if the client is current
+
+    Browsers keep the response but revalidate it on every use. Pending flashes are shown by the
+    next full render, so they skip the 304.
+
+    Args:
+        etag (str): Strong ETag
+        last_modified (datetime, optional): Defaults to None.
+        vary (iterable(str), optional): Request headers the response depends on. Defaults to
+            ("Cookie",).
+
+    Returns:
+        tuple: (response, modified). Fill in the response's body when modified is True
+    """
+    response = make_response()
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    for header in vary:
+        response.vary.add(header)
+    modified = "_flashes" in session or is_resource_modified(
+        request.environ, etag=etag, last_modified=last_modified
+    )
+    if not modified:
+        response.status_code = 304
+    return response, modified
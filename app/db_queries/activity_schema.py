@@ -0,0 +1,138 @@
+from datetime import datetime
+import zlib
+import bson
+from bson.binary import Binary
+from pymongo import UpdateOne
+from app import db_client
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
+
+SCHEMA_VERSION = 1
+
+# Top level fields kept on the hot activities documents
+HOT_FIELDS = (
+    "id",
+    "name",
+    "type",
+    "sport_type",
+    "commute",
+    "private",
+    "start_date",
+    "start_date_local",
+    "timezone",
+    "distance",
+    "moving_time",
+    "elapsed_time",
+    "total_elevation_gain",
+)
+
+
+def compact_activity(activity):
+    """Projects a Strava activity down to the fields the app reads
+
+    Everything else (laps, splits, segment efforts, photos, the full polyline...) only goes to
+    the activity_archive collection.
+
+    Args:
+        activity (dict): Strava activity, summary or detailed
+
+    Returns:
+        dict: Compact activity document
+    """
+    compact = {key: activity[key] for key in HOT_FIELDS if key in activity}
+    athlete_id = (activity.get("athlete") or {}).get("id")
+    if athlete_id is not None:
+        compact["athlete"] = {"id": athlete_id}
+    summary_polyline = (activity.get("map") or {}).get("summary_polyline")
+    if summary_polyline is not None:
+        compact["map"] = {"summary_polyline": summary_polyline}
+    compact["schema_version"] = SCHEMA_VERSION
+    return compact
+
+
+def compress_payload(activity):
+    """Encodes an activity as BSON and compresses it with zstd if installed, otherwise zlib
+
+    Returns:
+        tuple: (codec, Binary)
+    """
+    data = bson.encode(activity)
+    if zstandard is not None:
+        return "zstd", Binary(zstandard.ZstdCompressor(level=10).compress(data))
+    return "zlib", Binary(zlib.compress(data, 6))
+
+
+def decompress_payload(codec, data):
+    """Reverses compress_payload
+
+    Args:
+        codec (str): "zstd" or "zlib"
+        data (bytes): Compressed payload
+
+    Returns:
+        dict: The activity
+    """
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("The zstandard package is needed to read this activity")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        data = zlib.decompress(data)
+    return bson.decode(data)
+
+
+def archive_operation(activity, overwrite=False):
+    """Builds the activity_archive write for a full Strava payload
+
+    Args:
+        activity (dict): Strava activity
+        overwrite (bool, optional): Replace an archived payload, for detailed fetches. Summary
+            payloads from the activity list don't replace one. Defaults to False.
+
+    Returns:
+        UpdateOne: Operation for activity_archive.bulk_write
+    """
+    codec, payload = compress_payload({k: v for k, v in activity.items() if k != "_id"})
+    document = {
+        "athlete_id": (activity.get("athlete") or {}).get("id"),
+        "codec": codec,
+        "payload": payload,
+        "archived_at": datetime.utcnow(),
+    }
+    update = {"$set": document} if overwrite else {"$setOnInsert": document}
+    return UpdateOne({"_id": activity.get("id")}, update, upsert=True)
+
+
+def insert_operation(activity):
+    """Builds the activities write for a payload from the activity list
+
+    Activities that are already stored are left alone, so the detailed fetch of a webhook event
+    isn't replaced by a summary.
+
+    Args:
+        activity (dict): Strava activity with normalized dates
+
+    Returns:
+        UpdateOne: Operation for activities.bulk_write
+    """
+    return UpdateOne(
+        {"id": activity.get("id")}, {"$setOnInsert": compact_activity(activity)}, upsert=True
+    )
+
+
+def load_activity_payload(activity_id):
+    """Loads the full Strava payload for an activity from the archive
+
+    Args:
+        activity_id (int): Strava activity id
+
+    Returns:
+        dict: The activity as Strava sent it, or None if it isn't archived
+    """
+    archived = db_client.db.activity_archive.find_one({"_id": activity_id})
+    if archived is None:
+        return None
+    return decompress_payload(archived["codec"], archived["payload"])
@@ -0,0 +1,125 @@
+from pymongo import UpdateMany
+from app import db_client
+from app.db_queries.activity_schema import archive_operation, compact_activity, insert_operation
+from app.db_queries.data_versions import version_update
+from app.db_queries.dates import normalize_activity_dates
+from app.db_queries.leaderboard import leaderboard, leaderboard_deltas, leaderboard_operations
+from app.db_queries.rollups import rollup_operations
+
+# Shared by the blocking models and the async IngestWorker. Each builds its writes here, runs
+# them with its own driver, then takes the (old_activity, new_activity) changes through
+# store_changes, change_writes and changes_written.
+
+
+def _athlete_id(activity):
+    return (activity.get("athlete") or {}).get("id")
+
+
+def insert_writes(activities):
+    """Builds the writes that store a page of activities from Strava
+
+    The full payloads go to the cold archive, activities only keeps the compact fields.
+    Activities that are already stored are left alone.
+
+    Args:
+        activities (list(dict)): Activities from Strava
+
+    Returns:
+        tuple: (activities, archive, operations). The activities with normalized dates, and the
+            operations for activity_archive.bulk_write and activities.bulk_write. The upserted_ids
+            of the activities result are indexes into activities.
+    """
+    activities = [normalize_activity_dates(activity) for activity in activities]
+    archive = [archive_operation(activity) for activity in activities]
+    operations = [insert_operation(activity) for activity in activities]
+    return activities, archive, operations
+
+
+def upsert_writes(activity):
+    """Builds the writes that store a fetched activity over the stored copy
+
+    Args:
+        activity (dict): Activity from Strava
+
+    Returns:
+        tuple: (activity, archive, update). The activity with normalized dates, the
+            activity_archive operation and the $set for activities
+    """
+    activity = normalize_activity_dates(activity)
+    archive = archive_operation(activity, overwrite=True)
+    return activity, archive, {"$set": compact_activity(activity)}
+
+
+def store_changes(changes):
+    """Applies written activity changes to the activity store
+
+    Runs before the data versions are bumped, so a profile rendered for the new version never
+    reads the old store.
+
+    Args:
+        changes (list(tuple)): (old_activity, new_activity) pairs. old_activity is None for
+            inserts and new_activity is None for deletes.
+    """
+    from app.activity_store import activity_store
+
+    activity_store.record([new for _, new in changes if new])
+    deleted = {}
+    for old, new in changes:
+        if new is None and old and _athlete_id(old) is not None:
+            deleted.setdefault(_athlete_id(old), []).append(old["id"])
+    for athlete_id, activity_ids in deleted.items():
+        activity_store.forget(athlete_id, activity_ids)
+
+
+def change_writes(changes):
+    """Builds the writes that follow activity changes
+
+    Leaderboard scores and weekly rollups come first, then the data versions of every athlete
+    whose activities changed.
+
+    Args:
+        changes (list(tuple)): (old_activity, new_activity) pairs, see store_changes. Old
+            activities only need leaderboard.SCORE_FIELDS.
+
+    Returns:
+        list(tuple): (collection, operations) pairs to bulk_write in order
+    """
+    writes = []
+    deltas = leaderboard_deltas(changes)
+    if deltas:
+        writes.append(("leaderboard_scores", leaderboard_operations(deltas)))
+    rollups = rollup_operations(changes)
+    if rollups:
+        writes.append(("weekly_rollups", rollups))
+    strava_ids = sorted(
+        {_athlete_id(activity) for change in changes for activity in change if activity} - {None}
+    )
+    if strava_ids:
+        update = UpdateMany({"strava_id": {"$in": strava_ids}}, version_update())
+        writes.append(("users", [update]))
+    return writes
+
+
+def changes_written(changes):
+    """Drops this process's cached leaderboards that the changes' writes touched"""
+    leaderboard.invalidate({(period, start) for period, start, _ in leaderboard_deltas(changes)})
+
+
+def apply_activity_changes(changes):
+    """Runs every step that follows activity changes with the blocking driver
+
+    Args:
+        changes (iterable(tuple)): (old_activity, new_activity) pairs, see store_changes
+
+    Returns:
+        bool: True if no writeErrors, False otherwise
+    """
+    changes = list(changes)
+    store_changes(changes)
+    success = True
+    for collection, operations in change_writes(changes):
+        result = db_client.db.get_collection(collection).bulk_write(operations, ordered=False)
+        if result.bulk_api_result.get("writeErrors"):
+            success = False
+    changes_written(changes)
+    return success
@@ -0,0 +1,50 @@
+from datetime import datetime
+from app import db_client
+
+# Fields get_data_version reads from the user document
+VERSION_FIELDS = {"_id": 0, "data_version": 1, "data_updated_at": 1, "created_at": 1}
+
+
+def version_update():
+    """Update that marks a user's profile data as changed
+
+    data_updated_at is truncated to seconds, the resolution of Last-Modified, so
+    If-Modified-Since compares exactly.
+
+    Returns:
+        dict: $inc of data_version and $set of data_updated_at
+    """
+    return {
+        "$inc": {"data_version": 1},
+        "$set": {"data_updated_at": datetime.utcnow().replace(microsecond=0)},
+    }
+
+
+def with_version_update(set_fields):
+    """A $set of set_fields that also bumps the user's data version"""
+    update = version_update()
+    update["$set"] = {**set_fields, **update["$set"]}
+    return update
+
+
+def bump_data_versions(strava_ids):
+    """Marks users' profile data as changed after their activities or Strava profile change
+
+    Args:
+        strava_ids (iterable(int)): Strava athlete ids
+    """
+    strava_ids = sorted(set(strava_ids))
+    if strava_ids:
+        db_client.db.users.update_many({"strava_id": {"$in": strava_ids}}, version_update())
+
+
+def get_data_version(username):
+    """Reads a user's data version from Mongo, never from the user cache
+
+    Args:
+        username (str): Username
+
+    Returns:
+        dict: data_version, data_updated_at and created_at, or None if there's no such user
+    """
+    return db_client.db.users.find_one({"username": username}, VERSION_FIELDS)
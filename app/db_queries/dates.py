@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+
+def parse_strava_date(value):
+    """Converts a Strava date to a naive UTC datetime
+
+    Args:
+        value (str | datetime): ISO 8601 string like "2018-02-16T14:52:54Z" or a datetime
+
+    Returns:
+        datetime: Naive datetime, or None if value is empty
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = (value - value.utcoffset()).replace(tzinfo=None)
+    return value
+
+
+def iso_week_start(date):
+    """Returns midnight on the monday of the ISO week containing date"""
+    monday = date - timedelta(days=date.weekday())
+    return monday.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def iso_year_week(date):
+    """Returns the ISO year-week label for date. Ex: 2024-03"""
+    year, week, _ = date.isocalendar()
+    return f"{year}-{week:02d}"
+
+
+def normalize_activity_dates(activity):
+    """Returns a copy of a Strava activity with its dates as datetimes so Mongo stores BSON dates
+
+    Args:
+        activity (dict): Strava activity
+
+    Returns:
+        dict: Activity with start_date and start_date_local converted
+    """
+    activity = dict(activity)
+    for key in ("start_date", "start_date_local"):
+        if key in activity:
+            activity[key] = parse_strava_date(activity[key])
+    return activity
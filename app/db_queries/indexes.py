@@ -0,0 +1,211 @@
+from datetime import datetime
+import logging
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from app import db_client
+from app.db_queries.mongo_queries import weekly_aggregator
+
+logger = logging.getLogger(__name__)
+
+# Every index the app relies on, by collection. Applied by ensure_indexes
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # Not unique, users that haven't connected Strava have a strava_id of 0
+        IndexModel([("strava_id", ASCENDING)], name="strava_id"),
+    ],
+    "activities": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Analytics loads an athlete's activities with a range scan on this, and the weekly
+        # aggregation runs as a covered range scan
+        IndexModel(
+            [("athlete.id", ASCENDING), ("start_date", ASCENDING), ("distance", ASCENDING)],
+            name="athlete_start_date_distance",
+        ),
+    ],
+    "strava_athletes": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "weekly_rollups": [
+        IndexModel(
+            [("athlete_id", ASCENDING), ("week_start", ASCENDING)],
+            name="athlete_week_unique",
+            unique=True,
+        ),
+    ],
+    "webhook_deliveries": [
+        # Redeliveries come within minutes, records are kept for two days
+        IndexModel(
+            [("received_at", ASCENDING)], name="received_at_ttl", expireAfterSeconds=172800
+        ),
+    ],
+    "leaderboard_scores": [
+        IndexModel(
+            [("period", ASCENDING), ("period_start", ASCENDING), ("athlete_id", ASCENDING)],
+            name="period_athlete_unique",
+            unique=True,
+        ),
+        # Pages in rank order, and counts the scores ahead of a distance for a rank
+        IndexModel(
+            [
+                ("period", ASCENDING),
+                ("period_start", ASCENDING),
+                ("distance", DESCENDING),
+                ("athlete_id", ASCENDING),
+            ],
+            name="period_distance",
+        ),
+    ],
+    "sync_state": [
+        IndexModel([("athlete_id", ASCENDING)], name="athlete_id_unique", unique=True),
+    ],
+}
+
+
+def ensure_indexes(collections=None):
+    """Creates the registered indexes. Indexes that already exist are left alone
+
+    An index that can't be built, like a unique index over duplicate values, is logged and
+    skipped so the rest are still created.
+
+    Args:
+        collections (list(str), optional): Collections to index. Defaults to every collection
+            in INDEXES.
+
+    Returns:
+        dict: Collection name to the names of the indexes that couldn't be created
+    """
+    failed = {}
+    for name in collections or INDEXES:
+        collection = db_client.db.get_collection(name)
+        for index in INDEXES[name]:
+            try:
+                collection.create_indexes([index])
+            except OperationFailure as e:
+                logger.error(f"Couldn't create index {index.document['name']} on {name}. {e}")
+                failed.setdefault(name, []).append(index.document["name"])
+    return failed
+
+
+def ensure_activity_indexes():
+    ensure_indexes(["activities"])
+
+
+def ensure_rollup_indexes():
+    ensure_indexes(["weekly_rollups"])
+
+
+def explain_stages(explain):
+    """Collects every plan stage name in explain output. Ex: COLLSCAN, IXSCAN, FETCH
+
+    Args:
+        explain (dict): Output of an explain command
+
+    Returns:
+        set(str): Stage names found anywhere in the output
+    """
+    stages = set()
+    if isinstance(explain, dict):
+        stage = explain.get("stage")
+        if isinstance(stage, str):
+            stages.add(stage)
+        for value in explain.values():
+            stages |= explain_stages(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            stages |= explain_stages(value)
+    return stages
+
+
+def _find(collection, query, sort=None):
+    command = {"find": collection, "filter": query}
+    if sort:
+        command["sort"] = dict(sort)
+    return command
+
+
+def query_shapes():
+    """Example of every query the app runs, with placeholder values
+
+    Filters that have a query helper are built with it, so the shapes follow the queries.
+
+    Returns:
+        list(tuple): (description, collection, command) where command is a find or aggregate
+            command document for explain
+    """
+    from app.analytics import activity_columns_query
+    from app.db_queries.leaderboard import Leaderboard, PageCursor
+    from app.db_queries.rollups import weekly_rollups_query
+    from app.db_queries.webhook_events import object_key
+
+    since = datetime(2023, 1, 2)
+    # Leaderboard pages are read in rank order
+    rank_order = [("distance", -1), ("athlete_id", 1)]
+    cursor = PageCursor(1000.0, 1, 26, 25)
+    finds = [
+        ("users by username", "users", {"username": "alice"}),
+        ("users by email", "users", {"email": "alice@example.com"}),
+        ("users by strava_id", "users", {"strava_id": 1}),
+        (
+            "login by username or email",
+            "users",
+            {"$or": [{"username": "alice"}, {"email": "alice"}]},
+        ),
+        ("activities by id", "activities", {"id": 1}),
+        ("activities by athlete", "activities", activity_columns_query(1)),
+        ("activities by athlete since", "activities", activity_columns_query(1, since)),
+        ("strava_athletes by id", "strava_athletes", {"id": 1}),
+        ("weekly_rollups by athlete since", "weekly_rollups", weekly_rollups_query(1, since)),
+        ("sync_state by athlete", "sync_state", {"athlete_id": 1}),
+        ("webhook_pending by object", "webhook_pending", {"_id": object_key("activity", 1)}),
+        ("webhook_objects by object", "webhook_objects", {"_id": object_key("activity", 1)}),
+        (
+            "leaderboard_scores first page",
+            "leaderboard_scores",
+            Leaderboard._after_query("week", since, None),
+            rank_order,
+        ),
+        (
+            "leaderboard_scores page after a cursor",
+            "leaderboard_scores",
+            Leaderboard._after_query("week", since, cursor),
+            rank_order,
+        ),
+        (
+            "leaderboard_scores ahead of a distance",
+            "leaderboard_scores",
+            Leaderboard._query("week", since, distance={"$gt": 1000.0}),
+        ),
+        (
+            "leaderboard_scores by athlete",
+            "leaderboard_scores",
+            {"period": "week", "period_start": since, "athlete_id": 1},
+        ),
+    ]
+    shapes = [
+        (description, collection, _find(collection, *query))
+        for description, collection, *query in finds
+    ]
+    shapes.append(
+        (
+            "weekly aggregator",
+            "activities",
+            {"aggregate": "activities", "pipeline": weekly_aggregator(1, since), "cursor": {}},
+        )
+    )
+    return shapes
+
+
+def collection_scans():
+    """Explains every query in query_shapes
+
+    Returns:
+        list(str): Descriptions of the queries that would scan a whole collection
+    """
+    scans = []
+    for description, _, command in query_shapes():
+        explain = db_client.db.command("explain", command, verbosity="queryPlanner")
+        if "COLLSCAN" in explain_stages(explain):
+            scans.append(description)
+    return scans
@@ -0,0 +1,105 @@
+import atexit
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from app import db_client
+
+logger = logging.getLogger(__name__)
+
+
+class LastSeenBuffer:
+    """Write-behind buffer for users' last_seen times
+
+    Touches are coalesced per user in memory and written in one unordered bulk write when the
+    buffer reaches flush_size or flush_interval seconds have passed. Users whose stored last_seen
+    is within granularity of now aren't buffered at all.
+
+    Args:
+        granularity (int, optional): Seconds last_seen can be behind before it's updated. Defaults to 300.
+        flush_interval (int, optional): Most seconds a touch waits in the buffer. Defaults to 30.
+        flush_size (int, optional): Number of users that triggers a flush. Defaults to 100.
+    """
+
+    def __init__(self, granularity=300, flush_interval=30, flush_size=100):
+        self.granularity = timedelta(seconds=granularity)
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._flusher = None
+
+    def init_app(self, app):
+        self.granularity = timedelta(seconds=app.config.get("LAST_SEEN_GRANULARITY", 300))
+        self.flush_interval = app.config.get("LAST_SEEN_FLUSH_INTERVAL", 30)
+        self.flush_size = app.config.get("LAST_SEEN_FLUSH_SIZE", 100)
+
+    def touch(self, user, now=None):
+        """Records that a user was seen
+
+        Args:
+            user (User): The user. Its last_seen is updated in place.
+            now (datetime, optional): Time the user was seen. Defaults to now.
+
+        Returns:
+            bool: True if the touch was buffered, False if last_seen was recent enough
+        """
+        now = now or datetime.utcnow()
+        if user.last_seen and now - user.last_seen < self.granularity:
+            return False
+        user.last_seen = now
+        with self._lock:
+            self._pending[user.username] = now
+            due = (
+                len(self._pending) >= self.flush_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+            self._start_flusher()
+        if due:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Writes every buffered last_seen to Mongo
+
+        Returns:
+            int: Number of users written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+        operations = [
+            # Never move last_seen backwards if another process wrote a newer time
+            UpdateOne(
+                {"username": username, "last_seen": {"$not": {"$gte": seen}}},
+                {"$set": {"last_seen": seen}},
+            )
+            for username, seen in pending.items()
+        ]
+        try:
+            db_client.db.users.bulk_write(operations, ordered=False)
+        except PyMongoError as e:
+            logger.warning(f"Failed to write last_seen for {len(operations)} users. {e}")
+            return 0
+        return len(operations)
+
+    def _start_flusher(self):
+        # Flushes the buffer in the background so touches aren't held forever by idle processes
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+last_seen_buffer = LastSeenBuffer()
+atexit.register(last_seen_buffer.flush)
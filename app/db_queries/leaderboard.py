@@ -0,0 +1,268 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from pymongo import UpdateOne
+from app import db_client
+from app.cache import TTLCache
+from app.db_queries.dates import iso_week_start, parse_strava_date
+from app.db_queries.indexes import ensure_indexes
+from app.db_queries.mongo_queries import leaderboard_aggregator
+
+PERIODS = ("week", "month")
+# Only these fields of a stored activity are needed to take it off the leaderboards and the
+# weekly rollups
+SCORE_FIELDS = {
+    "_id": 0,
+    "id": 1,
+    "athlete.id": 1,
+    "start_date": 1,
+    "distance": 1,
+    "commute": 1,
+}
+
+
+def period_start(period, date):
+    """Monday of date's ISO week, or the first of its month"""
+    if period == "week":
+        return iso_week_start(date)
+    return date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def leaderboard_deltas(changes):
+    """Distance and commute count changes per leaderboard entry
+
+    Only commutes score. Deltas for the same athlete and period are merged, so an edit within a
+    period is a single $inc and an edit that moves an activity to another period is a decrement
+    plus an increment.
+
+    Args:
+        changes (iterable(tuple)): (old_activity, new_activity) pairs. old_activity is None
+            for inserts and new_activity is None for deletes.
+
+    Returns:
+        dict: (period, period_start, athlete_id) to [distance, commutes]
+    """
+    deltas = defaultdict(lambda: [0.0, 0])
+    for old_activity, new_activity in changes:
+        for activity, sign in ((old_activity, -1), (new_activity, 1)):
+            if not activity or not activity.get("commute"):
+                continue
+            athlete_id = (activity.get("athlete") or {}).get("id")
+            start_date = parse_strava_date(activity.get("start_date"))
+            if athlete_id is None or start_date is None:
+                continue
+            for period in PERIODS:
+                key = (period, period_start(period, start_date), athlete_id)
+                deltas[key][0] += sign * (activity.get("distance") or 0)
+                deltas[key][1] += sign
+    return {key: delta for key, delta in deltas.items() if delta != [0, 0]}
+
+
+def leaderboard_operations(deltas):
+    """Builds the leaderboard_scores updates for leaderboard_deltas
+
+    Returns:
+        list(UpdateOne): Operations for leaderboard_scores.bulk_write
+    """
+    return [
+        UpdateOne(
+            {"period": period, "period_start": start, "athlete_id": athlete_id},
+            {"$inc": {"distance": distance, "commutes": commutes}},
+            upsert=True,
+        )
+        for (period, start, athlete_id), (distance, commutes) in deltas.items()
+    ]
+
+
+@dataclass(frozen=True)
+class PageCursor:
+    """The last entry of a leaderboard page, the next page starts after it
+
+    Args:
+        distance (float): Its distance in meters
+        athlete_id (int): Its athlete, breaks distance ties
+        rank (int): Its rank
+        position (int): Its position in the leaderboard, from 1
+    """
+
+    distance: float
+    athlete_id: int
+    rank: int
+    position: int
+
+    def encode(self):
+        return f"{self.distance!r}:{self.athlete_id}:{self.rank}:{self.position}"
+
+    @classmethod
+    def decode(cls, text):
+        """Parses an encoded cursor
+
+        Raises:
+            ValueError: If text isn't an encoded cursor
+        """
+        distance, athlete_id, rank, position = text.split(":")
+        return cls(float(distance), int(athlete_id), int(rank), int(position))
+
+
+def ranked(scores, after=None):
+    """Ranks a page of scores sorted by distance descending
+
+    Ties share the best rank, so two athletes on the same distance are both 3rd and the next is
+    5th. The ranks follow from the page and the previous page's last entry, so nothing has to be
+    counted.
+
+    Args:
+        scores (list(dict)): athlete_id and distance
+        after (PageCursor, optional): Last entry of the previous page. Defaults to None, for
+            the first page.
+
+    Returns:
+        list(dict): rank, athlete_id and distance in meters
+    """
+    entries = []
+    distance, rank, position = None, 0, 0
+    if after is not None:
+        distance, rank, position = after.distance, after.rank, after.position
+    for score in scores:
+        position += 1
+        if score["distance"] != distance:
+            distance, rank = score["distance"], position
+        entries.append(
+            {"rank": rank, "athlete_id": score["athlete_id"], "distance": float(distance)}
+        )
+    return entries
+
+
+class Leaderboard:
+    """Weekly and monthly commute distance leaderboards
+
+    Scores are kept up to date in leaderboard_scores by the activity writes. Pages are read in
+    rank order from the period_distance index, each starting after the (distance, athlete_id)
+    of the previous page's last entry, so a page costs the same however deep it is and nothing
+    loads a whole leaderboard. Pages are cached per leaderboard. This process drops a cached
+    leaderboard when it changes a score in it, other processes pick the change up after
+    LEADERBOARD_CACHE_TTL seconds.
+
+    Args:
+        maxsize (int, optional): Leaderboards cached. Defaults to 64.
+        ttl (float, optional): Seconds a leaderboard is cached. Defaults to 30.
+    """
+
+    def __init__(self, maxsize=64, ttl=30):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def init_app(self, app):
+        self.cache.configure(
+            app.config.get("LEADERBOARD_CACHE_SIZE", 64),
+            app.config.get("LEADERBOARD_CACHE_TTL", 30),
+        )
+
+    def _cached(self, period, start, key, load):
+        results = self.cache.get((period, start))
+        if results is None:
+            results = {}
+            self.cache.set((period, start), results)
+        if key not in results:
+            results[key] = load()
+        return results[key]
+
+    @staticmethod
+    def _query(period, start, **conditions):
+        return {"period": period, "period_start": start, "commutes": {"$gt": 0}, **conditions}
+
+    @classmethod
+    def _after_query(cls, period, start, after):
+        if after is None:
+            return cls._query(period, start)
+        return cls._query(
+            period,
+            start,
+            **{
+                "$or": [
+                    {"distance": {"$lt": after.distance}},
+                    {"distance": after.distance, "athlete_id": {"$gt": after.athlete_id}},
+                ]
+            },
+        )
+
+    def page(self, period, start, after=None, limit=25):
+        """Up to limit entries of the period starting at start
+
+        Args:
+            period (str): week or month
+            start (datetime): Start of the period
+            after (PageCursor, optional): Last entry of the previous page. Defaults to None, for
+                the first page.
+            limit (int, optional): Entries per page. Defaults to 25.
+
+        Returns:
+            tuple: (entries, cursor). entries are dicts of rank, athlete_id and distance in
+                meters. cursor is the PageCursor of the next page, or None if this is the last.
+        """
+
+        def load():
+            scores = list(
+                db_client.db.leaderboard_scores.find(
+                    self._after_query(period, start, after),
+                    {"_id": 0, "athlete_id": 1, "distance": 1},
+                )
+                .sort([("distance", -1), ("athlete_id", 1)])
+                .limit(limit + 1)
+            )
+            entries = ranked(scores[:limit], after)
+            cursor = None
+            if len(scores) > limit:
+                last = entries[-1]
+                position = (after.position if after else 0) + limit
+                cursor = PageCursor(last["distance"], last["athlete_id"], last["rank"], position)
+            return entries, cursor
+
+        entries, cursor = self._cached(period, start, ("page", after, limit), load)
+        # Callers add to the entries, the cached ones stay as they are
+        return [dict(entry) for entry in entries], cursor
+
+    def rank(self, period, start, athlete_id):
+        """An athlete's entry for the period starting at start
+
+        The rank is a count of the scores ahead over the period_distance index. That's a count
+        scan of index keys, no documents are read, but it grows with the rank. It's kept rather
+        than maintaining ranks on every score change, which would rewrite every entry between an
+        athlete's old and new distance on each commute.
+
+        Returns:
+            dict: rank, athlete_id and distance, or None if they haven't commuted in the period
+        """
+        score = db_client.db.leaderboard_scores.find_one(
+            {"period": period, "period_start": start, "athlete_id": athlete_id},
+            {"_id": 0, "distance": 1, "commutes": 1},
+        )
+        if score is None or score.get("commutes", 0) <= 0:
+            return None
+        ahead = db_client.db.leaderboard_scores.count_documents(
+            self._query(period, start, distance={"$gt": score["distance"]})
+        )
+        return {"rank": ahead + 1, "athlete_id": athlete_id, "distance": float(score["distance"])}
+
+    def current_start(self, period, now=None):
+        return period_start(period, now or datetime.utcnow())
+
+    def invalidate(self, periods):
+        for key in periods:
+            self.cache.pop(key)
+
+
+leaderboard = Leaderboard()
+
+
+def rebuild_leaderboard():
+    """Recomputes leaderboard_scores from the activities collection
+
+    Returns:
+        int: Number of score documents after the rebuild
+    """
+    ensure_indexes(["activities", "leaderboard_scores"])
+    db_client.db.leaderboard_scores.delete_many({})
+    for period in PERIODS:
+        db_client.db.activities.aggregate(leaderboard_aggregator(period))
+    leaderboard.cache.clear()
+    return db_client.db.leaderboard_scores.count_documents({})
@@ -0,0 +1,48 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import threading
+import uuid
+from pymongo.errors import DuplicateKeyError
+from app import db_client
+
+_local_locks = defaultdict(threading.Lock)
+_local_locks_guard = threading.Lock()
+
+
+@contextmanager
+def local_lock(name):
+    """Holds an in-process lock for name, so only one thread per process does the work"""
+    with _local_locks_guard:
+        lock = _local_locks[name]
+    with lock:
+        yield
+
+
+def acquire_lease(name, seconds):
+    """Takes a lock shared by every process. It expires on its own if the holder dies
+
+    Args:
+        name (str): Lock name
+        seconds (float): How long the lease is held before it expires
+
+    Returns:
+        str: Owner token to release the lease with, or None if someone else holds it
+    """
+    owner = uuid.uuid4().hex
+    now = datetime.utcnow()
+    try:
+        # Matches a free or expired lease. If it's held the upsert collides on _id
+        db_client.db.locks.update_one(
+            {"_id": name, "expires_at": {"$lt": now}},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return None
+    return owner
+
+
+def release_lease(name, owner):
+    """Releases a lease if it's still held by owner"""
+    db_client.db.locks.delete_one({"_id": name, "owner": owner})
@@ -0,0 +1,95 @@
+import logging
+from pymongo import ReplaceOne, UpdateOne
+from app import db_client
+from app.db_queries.activity_schema import archive_operation, compact_activity
+from app.db_queries.dates import parse_strava_date
+
+logger = logging.getLogger(__name__)
+
+
+def migrate_activity_dates(batch_size=1000):
+    """Converts start_date and start_date_local strings on stored activities to BSON dates
+
+    Walks the collection in _id order so each batch is an indexed range query and the
+    migration can be stopped and rerun at any point.
+
+    Args:
+        batch_size (int, optional): Documents per bulk write. Defaults to 1000.
+
+    Returns:
+        dict: converted, the number of activities updated, and skipped, the number with a date
+            that couldn't be parsed. Those are logged and left as strings.
+    """
+    query = {
+        "$or": [
+            {"start_date": {"$type": "string"}},
+            {"start_date_local": {"$type": "string"}},
+        ]
+    }
+    last_id = None
+    migrated = 0
+    skipped = 0
+    while True:
+        batch_query = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+        batch = list(
+            db_client.db.activities.find(
+                batch_query, {"start_date": 1, "start_date_local": 1}
+            )
+            .sort("_id", 1)
+            .limit(batch_size)
+        )
+        if not batch:
+            break
+        operations = []
+        for activity in batch:
+            update = {}
+            invalid = False
+            for key in ("start_date", "start_date_local"):
+                if isinstance(activity.get(key), str):
+                    try:
+                        update[key] = parse_strava_date(activity[key])
+                    except ValueError:
+                        invalid = True
+                        logger.warning(f"Invalid {key} on activity {activity['_id']}")
+            skipped += invalid
+            if update:
+                operations.append(UpdateOne({"_id": activity["_id"]}, {"$set": update}))
+        if operations:
+            db_client.db.activities.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+        last_id = batch[-1]["_id"]
+    return {"converted": migrated, "skipped": skipped}
+
+
+def compact_activities(batch_size=500):
+    """Moves full payloads of activities stored before the compact schema to activity_archive
+
+    Each activity's document is archived as it is, then replaced by its compact projection.
+    Already compacted activities are skipped, so the migration can be rerun.
+
+    Args:
+        batch_size (int, optional): Activities per batch. Defaults to 500.
+
+    Returns:
+        int: Number of activities compacted
+    """
+    query = {"schema_version": {"$exists": False}}
+    last_id = None
+    compacted = 0
+    while True:
+        batch_query = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+        batch = list(
+            db_client.db.activities.find(batch_query).sort("_id", 1).limit(batch_size)
+        )
+        if not batch:
+            break
+        archive = [archive_operation(activity) for activity in batch]
+        db_client.db.activity_archive.bulk_write(archive, ordered=False)
+        replacements = [
+            ReplaceOne({"_id": activity["_id"]}, compact_activity(activity))
+            for activity in batch
+        ]
+        db_client.db.activities.bulk_write(replacements, ordered=False)
+        compacted += len(batch)
+        last_id = batch[-1]["_id"]
+    return compacted
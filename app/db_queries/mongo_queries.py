@@ -1,46 +1,137 @@
-def weekly_aggregator(strava_id, last_date):
+def weekly_aggregator(strava_id=None, last_date=None):
+    """Pipeline that totals distance and activities per athlete and ISO week
+
+    start_date is stored as a BSON date, so for one athlete the match and project are a covered
+    range scan on the (athlete.id, start_date, distance) index.
+
+    Args:
+        strava_id (int, optional): Strava athlete id. Defaults to all athletes.
+        last_date (datetime, optional): Only include activities that started after this date.
+            Defaults to all activities.
+
+    Returns:
+        list(dict): Stages that output athlete_id, year, week, total and count
+    """
+    match = {}
+    if strava_id is not None:
+        match["athlete.id"] = strava_id
+    if last_date is not None:
+        match["start_date"] = {"$gt": last_date}
+    # $toDate also handles activities that haven't been migrated off strings yet
+    start_date = {"$toDate": "$start_date"}
     pipeline = [
-        {"$match": {"athlete.id": strava_id}}, 
-        {"$match": {"$dateFromString": {
-                    "dateString": "$start_date"
-                }, {
-            "$gt": {last_date
-                
-            }
-        }
-    }},
-        {
-            "$project": {
-                "_id": 1,
-                "date_field": {
-                    "$dateFromString": {
-                        "dateString": "$start_date"  # Assuming 'date_field' is the timestamp string field
-                    }
-                },
-                "distance": "$distance",  # Include other fields as needed
-            }
-        },
+        {"$match": match},
+        {"$project": {"_id": 0, "athlete.id": 1, "start_date": 1, "distance": 1}},
         {
             "$group": {
                 "_id": {
-                    "week": {"$isoWeek": "$date_field"},
-                    "year": {"$isoWeekYear": "$date_field"},
+                    "athlete_id": "$athlete.id",
+                    "week": {"$isoWeek": start_date},
+                    "year": {"$isoWeekYear": start_date},
                 },
                 "total": {"$sum": "$distance"},
+                "count": {"$sum": 1},
             }
         },
-        {"$sort": {"_id.year": -1, "_id.week": -1}},
         {
             "$project": {
                 "_id": 0,
+                "athlete_id": "$_id.athlete_id",
+                "year": "$_id.year",
+                "week": "$_id.week",
                 "total": 1,
+                "count": 1,
+            }
+        },
+    ]
+    return pipeline
+
+
+def weekly_rollup_aggregator(strava_id=None):
+    """Pipeline that recomputes the weekly_rollups documents from activities
+
+    Args:
+        strava_id (int, optional): Only rebuild this athlete. Defaults to all athletes.
+    """
+    week_string = {"$toString": "$week"}
+    return weekly_aggregator(strava_id) + [
+        {
+            "$project": {
+                "athlete_id": 1,
+                "week_start": {
+                    "$dateFromParts": {
+                        "isoWeekYear": "$year",
+                        "isoWeek": "$week",
+                        "isoDayOfWeek": 1,
+                    }
+                },
                 "year_week": {
                     "$concat": [
-                        {"$toString": "$_id.year"},
+                        {"$toString": "$year"},
                         "-",
-                        {"$toString": "$_id.week"},
+                        {
+                            "$cond": [
+                                {"$lt": ["$week", 10]},
+                                {"$concat": ["0", week_string]},
+                                week_string,
+                            ]
+                        },
                     ]
                 },
+                "total": 1,
+                "count": 1,
+            }
+        },
+        {
+            "$merge": {
+                "into": "weekly_rollups",
+                "on": ["athlete_id", "week_start"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+
+
+def leaderboard_aggregator(period):
+    """Pipeline that recomputes the leaderboard_scores documents for a period from activities
+
+    Args:
+        period (str): week or month
+    """
+    start_date = {"$toDate": "$start_date"}
+    if period == "week":
+        group = {"year": {"$isoWeekYear": start_date}, "week": {"$isoWeek": start_date}}
+        start = {"isoWeekYear": "$_id.year", "isoWeek": "$_id.week", "isoDayOfWeek": 1}
+    else:
+        group = {"year": {"$year": start_date}, "month": {"$month": start_date}}
+        start = {"year": "$_id.year", "month": "$_id.month", "day": 1}
+    pipeline = [
+        {"$match": {"commute": True}},
+        {"$project": {"_id": 0, "athlete.id": 1, "start_date": 1, "distance": 1}},
+        {
+            "$group": {
+                "_id": {"athlete_id": "$athlete.id", **group},
+                "distance": {"$sum": "$distance"},
+                "commutes": {"$sum": 1},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "period": period,
+                "period_start": {"$dateFromParts": start},
+                "athlete_id": "$_id.athlete_id",
+                "distance": 1,
+                "commutes": 1,
+            }
+        },
+        {
+            "$merge": {
+                "into": "leaderboard_scores",
+                "on": ["period", "period_start", "athlete_id"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
             }
         },
     ]
@@ -0,0 +1,96 @@
+from collections import defaultdict
+from pymongo import UpdateOne
+from app import db_client
+from app.db_queries.dates import parse_strava_date, iso_week_start, iso_year_week
+from app.db_queries.indexes import ensure_activity_indexes, ensure_rollup_indexes
+from app.db_queries.mongo_queries import weekly_rollup_aggregator
+
+
+def _rollup_key(activity):
+    athlete_id = (activity.get("athlete") or {}).get("id")
+    start_date = parse_strava_date(activity.get("start_date"))
+    if athlete_id is None or start_date is None:
+        return None
+    return athlete_id, iso_week_start(start_date)
+
+
+def rollup_operations(changes):
+    """Builds the weekly_rollups updates for a set of activity changes
+
+    Deltas for the same week are merged, so an edit within a week is a single $inc and an
+    edit that moves an activity to another week is a decrement plus an increment.
+
+    Args:
+        changes (iterable(tuple)): (old_activity, new_activity) pairs. old_activity is None
+            for inserts and new_activity is None for deletes.
+
+    Returns:
+        list(UpdateOne): Operations for weekly_rollups.bulk_write
+    """
+    deltas = defaultdict(lambda: [0.0, 0])
+    for old_activity, new_activity in changes:
+        for activity, sign in ((old_activity, -1), (new_activity, 1)):
+            if not activity:
+                continue
+            key = _rollup_key(activity)
+            if key is None:
+                continue
+            deltas[key][0] += sign * (activity.get("distance") or 0)
+            deltas[key][1] += sign
+    operations = []
+    for (athlete_id, week_start), (distance, count) in deltas.items():
+        if distance == 0 and count == 0:
+            continue
+        operations.append(
+            UpdateOne(
+                {"athlete_id": athlete_id, "week_start": week_start},
+                {
+                    "$inc": {"total": distance, "count": count},
+                    "$setOnInsert": {"year_week": iso_year_week(week_start)},
+                },
+                upsert=True,
+            )
+        )
+    return operations
+
+
+def weekly_rollups_query(strava_id, since):
+    """Filter for an athlete's rollups from the week starting at since"""
+    return {"athlete_id": strava_id, "week_start": {"$gte": since}}
+
+
+def get_weekly_rollups(strava_id, since):
+    """Fetches an athlete's weekly rollups, newest first
+
+    Args:
+        strava_id (int): Strava athlete id
+        since (datetime): Monday of the oldest week to return
+
+    Returns:
+        list(dict): Rollup documents with week_start, year_week, total and count
+    """
+    cursor = db_client.db.weekly_rollups.find(
+        weekly_rollups_query(strava_id, since),
+        {"_id": 0, "week_start": 1, "year_week": 1, "total": 1, "count": 1},
+    ).sort("week_start", -1)
+    return list(cursor)
+
+
+def rebuild_weekly_rollups(strava_id=None):
+    """Recomputes weekly_rollups from the activities collection
+
+    Used to backfill the collection and to repair drift. The rollups are rebuilt on the server
+    with a single $merge so nothing is pulled into the app.
+
+    Args:
+        strava_id (int, optional): Only rebuild this athlete. Defaults to all athletes.
+
+    Returns:
+        int: Number of rollup documents after the rebuild
+    """
+    ensure_activity_indexes()
+    ensure_rollup_indexes()
+    query = {} if strava_id is None else {"athlete_id": strava_id}
+    db_client.db.weekly_rollups.delete_many(query)
+    db_client.db.activities.aggregate(weekly_rollup_aggregator(strava_id))
+    return db_client.db.weekly_rollups.count_documents(query)
@@ -0,0 +1,118 @@
+from datetime import datetime, timezone
+import time
+from pymongo import ReturnDocument
+from app import db_client
+from app.db_queries.dates import parse_strava_date
+
+RUNNING = "running"
+PAUSED = "paused"  # Waiting for the rate limit to reset
+FAILED = "failed"
+COMPLETE = "complete"
+
+
+def get_sync_state(athlete_id):
+    """Fetches an athlete's activity sync state
+
+    Args:
+        athlete_id (int): Strava athlete id
+
+    Returns:
+        dict: The state, or None if the athlete has never been synced
+    """
+    return db_client.db.sync_state.find_one({"athlete_id": athlete_id}, {"_id": 0})
+
+
+def start_sync(athlete_id, before=None, after=None):
+    """Starts a new sync job. The watermarks from earlier jobs are kept
+
+    Args:
+        athlete_id (int): Strava athlete id
+        before (int, optional): Epoch timestamp the job fetches activities before. Defaults to None.
+        after (int, optional): Epoch timestamp the job fetches activities after. Defaults to None.
+
+    Returns:
+        dict: The new state
+    """
+    now = datetime.utcnow()
+    return db_client.db.sync_state.find_one_and_update(
+        {"athlete_id": athlete_id},
+        {
+            "$set": {
+                "status": RUNNING,
+                "before": before,
+                "after": after,
+                "last_page": 0,
+                "job_activities": 0,
+                "started_at": now,
+                "updated_at": now,
+                "finished_at": None,
+            }
+        },
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def next_sync_job(athlete_id):
+    """Resumes an athlete's unfinished sync job or starts the next one
+
+    An unfinished job resumes after its last written page, with the same before timestamp so
+    pages don't shift. Once a full import has finished, later jobs only fetch activities after
+    the newest one seen.
+
+    Args:
+        athlete_id (int): Strava athlete id
+
+    Returns:
+        tuple: (before, after, start_page) for the activity list
+    """
+    state = get_sync_state(athlete_id)
+    if state and state.get("status") != COMPLETE:
+        return state.get("before"), state.get("after"), state.get("last_page", 0) + 1
+    if state and state.get("newest_start_date"):
+        before = None
+        after = int(state["newest_start_date"].replace(tzinfo=timezone.utc).timestamp())
+    else:
+        before = int(time.time())
+        after = None
+    start_sync(athlete_id, before=before, after=after)
+    return before, after, 1
+
+
+def record_page(athlete_id, page, activities):
+    """Checkpoints a page that has been written to Mongo
+
+    Args:
+        athlete_id (int): Strava athlete id
+        page (int): Page number that was written
+        activities (list(dict)): The page's activities
+    """
+    update = {
+        "$max": {"last_page": page},
+        "$inc": {"job_activities": len(activities)},
+        "$set": {"updated_at": datetime.utcnow()},
+    }
+    start_dates = [
+        parse_strava_date(activity.get("start_date"))
+        for activity in activities
+        if activity.get("start_date")
+    ]
+    if start_dates:
+        update["$max"]["newest_start_date"] = max(start_dates)
+        update["$min"] = {"oldest_start_date": min(start_dates)}
+    db_client.db.sync_state.update_one({"athlete_id": athlete_id}, update)
+
+
+def finish_sync(athlete_id, status):
+    """Records how a sync job ended
+
+    Args:
+        athlete_id (int): Strava athlete id
+        status (str): COMPLETE, PAUSED or FAILED
+    """
+    now = datetime.utcnow()
+    update = {"status": status, "updated_at": now}
+    if status == COMPLETE:
+        update["finished_at"] = now
+    db_client.db.sync_state.update_one({"athlete_id": athlete_id}, {"$set": update})
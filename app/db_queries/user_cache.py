@@ -0,0 +1,66 @@
+from app import db_client
+from app.cache import TTLCache
+
+
+class UserCache:
+    """Caches user documents by username and by strava_id
+
+    Documents are copied in and out so callers can't change a cached entry. Writes to a user
+    have to call invalidate, or refresh for fields that can't change the cache keys.
+
+    Args:
+        maxsize (int, optional): Most entries kept, counting both keys. Defaults to 1024.
+        ttl (float, optional): Seconds a document is cached. Defaults to 60.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def init_app(self, app):
+        self.cache.configure(
+            app.config.get("USER_CACHE_SIZE", 1024), app.config.get("USER_CACHE_TTL", 60)
+        )
+
+    def find(self, field, value):
+        """Fetches a user document, from the cache if possible
+
+        Args:
+            field (str): "username" or "strava_id"
+            value (str | int): Value to look up
+
+        Returns:
+            dict: Copy of the user document, or None if there's no such user
+        """
+        user = self.cache.get((field, value))
+        if user is None:
+            user = db_client.db.users.find_one({field: value})
+            if user is None:
+                return None
+            self._store(user)
+        return dict(user)
+
+    def _store(self, user):
+        user = dict(user)
+        self.cache.set(("username", user.get("username")), user)
+        if user.get("strava_id"):
+            self.cache.set(("strava_id", user["strava_id"]), user)
+
+    def invalidate(self, username=None, strava_id=None):
+        """Drops a user from the cache under both of its keys"""
+        for key in (("username", username), ("strava_id", strava_id)):
+            user = self.cache.pop(key)
+            if user is not None:
+                self.cache.pop(("username", user.get("username")))
+                self.cache.pop(("strava_id", user.get("strava_id")))
+
+    def refresh(self, username, updates):
+        """Applies an update to the cached document for fields that aren't cache keys"""
+        user = self.cache.peek(("username", username))
+        if user is not None:
+            self._store({**user, **updates})
+
+    def stats(self):
+        return self.cache.stats()
+
+
+user_cache = UserCache()
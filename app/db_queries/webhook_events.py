@@ -0,0 +1,145 @@
+from datetime import datetime
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app import db_client
+
+
+def object_key(object_type, object_id):
+    return f"{object_type}:{object_id}"
+
+
+def _delivery_id(event):
+    return f"{object_key(event.object_type, event.object_id)}:{event.aspect_type}:{event.event_time}"
+
+
+def record_delivery(event):
+    """Records a webhook delivery so redeliveries can be dropped
+
+    Args:
+        event (Event): The event
+
+    Returns:
+        bool: True if this is the first delivery, False for a duplicate
+    """
+    try:
+        db_client.db.webhook_deliveries.insert_one(
+            {"_id": _delivery_id(event), "received_at": datetime.utcnow()}
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+def forget_delivery(event):
+    """Removes a delivery record, so Strava's retry of an event we couldn't queue isn't dropped"""
+    db_client.db.webhook_deliveries.delete_one({"_id": _delivery_id(event)})
+
+
+def add_pending(event_data):
+    """Queues an event behind any others waiting for the same object
+
+    Args:
+        event_data (dict): Event fields
+
+    Returns:
+        bool: True if nothing was waiting, so the caller has to schedule processing
+    """
+    key = object_key(event_data["object_type"], event_data["object_id"])
+    previous = db_client.db.webhook_pending.find_one_and_update(
+        {"_id": key},
+        {"$push": {"events": event_data}, "$setOnInsert": {"created_at": datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+    )
+    return previous is None
+
+
+def remove_pending(event_data):
+    """Takes an event back out of the queue, dropping the queue if it's left empty"""
+    key = object_key(event_data["object_type"], event_data["object_id"])
+    db_client.db.webhook_pending.update_one({"_id": key}, {"$pull": {"events": event_data}})
+    db_client.db.webhook_pending.delete_one({"_id": key, "events": {"$size": 0}})
+
+
+def get_pending(object_type, object_id):
+    """Events waiting for an object, in the order they arrived"""
+    pending = db_client.db.webhook_pending.find_one({"_id": object_key(object_type, object_id)})
+    if pending is None:
+        return []
+    return pending["events"]
+
+
+def finish_pending(object_type, object_id, events):
+    """Removes processed events from an object's queue
+
+    The queue is only deleted if it's empty, in the same operation, so an event that arrives
+    meanwhile either finds the queue and is left for the caller, or starts a new one.
+
+    Args:
+        object_type (str): activity or athlete
+        object_id (int): Object id
+        events (list(dict)): Events that were processed
+
+    Returns:
+        bool: True if more events arrived and the object has to be processed again
+    """
+    key = object_key(object_type, object_id)
+    db_client.db.webhook_pending.update_one({"_id": key}, {"$pull": {"events": {"$in": events}}})
+    deleted = db_client.db.webhook_pending.find_one_and_delete(
+        {"_id": key, "events": {"$size": 0}}
+    )
+    if deleted is not None:
+        return False
+    return db_client.db.webhook_pending.count_documents({"_id": key}) > 0
+
+
+def applied_event_time(object_type, object_id):
+    """event_time of the newest event applied to an object, 0 if none has been"""
+    applied = db_client.db.webhook_objects.find_one({"_id": object_key(object_type, object_id)})
+    if applied is None:
+        return 0
+    return applied["event_time"]
+
+
+def set_applied_event_time(object_type, object_id, event_time):
+    db_client.db.webhook_objects.update_one(
+        {"_id": object_key(object_type, object_id)},
+        {"$max": {"event_time": event_time}},
+        upsert=True,
+    )
+
+
+def coalesce_events(events, applied_time=0):
+    """Collapses the events waiting for one object into a single event
+
+    Events older than applied_time are dropped so old data never replaces new data. Events at
+    applied_time are kept, since event_time is in seconds and an event from the same second may
+    have arrived after the batch that was applied. A delete wins if it's the newest event, a
+    create followed by updates is still a create, and updates are merged oldest to newest.
+
+    Args:
+        events (list(dict)): Events for the same object
+        applied_time (int, optional): event_time already applied to the object. Defaults to 0.
+
+    Returns:
+        dict: The event to process, or None if every event was stale
+    """
+    events = sorted(
+        (event for event in events if event["event_time"] >= applied_time),
+        key=lambda event: event["event_time"],
+    )
+    if not events:
+        return None
+    newest = events[-1]
+    if newest["aspect_type"] == "delete":
+        return dict(newest)
+    merged = dict(newest, updates={})
+    for event in events:
+        if event["aspect_type"] == "create":
+            merged["aspect_type"] = "create"
+        elif event["aspect_type"] == "delete":
+            # Recreated after a delete. Only what came after the delete matters
+            merged["aspect_type"] = "update"
+            merged["updates"] = {}
+        merged["updates"].update(event.get("updates") or {})
+    return merged
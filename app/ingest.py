@@ -0,0 +1,407 @@
+import asyncio
+from contextlib import asynccontextmanager
+import logging
+import time
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from app.db_queries.activity_writes import (
+    change_writes,
+    changes_written,
+    insert_writes,
+    store_changes,
+    upsert_writes,
+)
+from app.db_queries.leaderboard import SCORE_FIELDS
+from app.db_queries.webhook_events import (
+    applied_event_time,
+    coalesce_events,
+    forget_delivery,
+    object_key,
+    record_delivery,
+    set_applied_event_time,
+)
+from app.db_queries.sync_state import (
+    COMPLETE,
+    FAILED,
+    PAUSED,
+    finish_sync,
+    next_sync_job,
+    record_page,
+)
+from app.metrics import MongoCommandMetrics, WEBHOOK_UPDATES, observe_webhook_event
+from app.models import Event, load_user, load_user_by_strava_id
+from app.strava_api import PRIORITY_BACKFILL, PRIORITY_LIVE, RateLimitExceeded, strava_url
+from app.strava_api.async_client import AsyncStravaClient
+from app.strava_api.backfill import BackfillStats
+from app.strava_api.client import rate_limit_governor
+
+logger = logging.getLogger(__name__)
+
+
+class IngestWorker:
+    """Runs many athletes' syncs and webhook fetches at once on one event loop
+
+    Strava calls share one async connection pool and activities are written with the async Mongo
+    driver, through the activity_writes steps User.insert_activities_to_mongo and
+    Event.upsert_to_mongo use. Each athlete gets at most per_athlete calls in flight and the
+    worker at most max_concurrency. Token refreshes, sync checkpoints and webhook bookkeeping
+    reuse the blocking app code in threads.
+
+    Use it as an async context manager so the pools are opened and closed on the running loop.
+
+    Args:
+        app (Flask): App to take the config from and run blocking code in
+        max_concurrency (int, optional): Strava calls in flight across every athlete.
+            Defaults to 32.
+        per_athlete (int, optional): Strava calls in flight for one athlete. Defaults to 4.
+        transport (httpx.AsyncBaseTransport, optional): Transport for Strava calls, for tests.
+            Defaults to None.
+    """
+
+    def __init__(self, app, max_concurrency=32, per_athlete=4, transport=None):
+        self.app = app
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_athlete = max(1, per_athlete)
+        self.transport = transport
+        self.strava = None
+        self.mongo = None
+        self.db = None
+        self._slots = None
+        self._athlete_slots = {}
+        self._object_locks = {}
+        with app.app_context():
+            self.api_url = strava_url("/api/v3")
+
+    async def __aenter__(self):
+        config = self.app.config
+        listeners = [MongoCommandMetrics()] if config.get("METRICS_ENABLED") else []
+        self.mongo = AsyncIOMotorClient(config["MONGO_URI"], event_listeners=listeners)
+        self.db = self.mongo.get_default_database()
+        self.strava = AsyncStravaClient(
+            max_connections=self.max_concurrency,
+            max_keepalive_connections=self.max_concurrency,
+            connect_timeout=config.get("STRAVA_CONNECT_TIMEOUT", 3.05),
+            read_timeout=config.get("STRAVA_READ_TIMEOUT", 10),
+            governor=rate_limit_governor(config),
+            transport=self.transport,
+        )
+        self._slots = asyncio.BoundedSemaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.strava.close()
+        self.mongo.close()
+
+    async def _in_app(self, func, *args):
+        """Runs blocking app code in a thread, inside an app context"""
+
+        def call():
+            with self.app.app_context():
+                return func(*args)
+
+        return await asyncio.to_thread(call)
+
+    async def _request(self, athlete_id, url, **kwargs):
+        athlete_slots = self._athlete_slots.get(athlete_id)
+        if athlete_slots is None:
+            athlete_slots = asyncio.BoundedSemaphore(self.per_athlete)
+            self._athlete_slots[athlete_id] = athlete_slots
+        # The athlete's slot first, so waiting on a busy athlete doesn't hold a worker slot
+        async with athlete_slots, self._slots:
+            return await self.strava.request(url, **kwargs)
+
+    async def fetch_activities_page(
+        self, user, page, per_page=50, before=None, after=None, retries=5
+    ):
+        """Async counterpart of User.fetch_activities_page
+
+        Raises:
+            RateLimitExceeded: When the backfill share of the rate limit is used up. Its page is
+                the page that wasn't fetched.
+
+        Returns:
+            list(dict): The activities, or None if the page couldn't be fetched
+        """
+        params = {"page": page, "before": before, "after": after, "per_page": per_page}
+        headers = {"Authorization": f"Bearer {user.access_token}"}
+        for retry in range(retries):
+            result = await self._request(
+                user.strava_id,
+                f"{self.api_url}/athlete/activities",
+                method="GET",
+                params=params,
+                headers=headers,
+                priority=PRIORITY_BACKFILL,
+            )
+            if result.rate_limited:
+                raise RateLimitExceeded(result.retry_after, page=page)
+            if result.ok and isinstance(result.data, list):
+                return result.data
+            logger.warning(
+                f"Failed to fetch activities page {page} for {user.username}. "
+                f"Retry: {retry + 1}, Max retries: {retries}"
+            )
+            await asyncio.sleep(retry + 1)
+        return None
+
+    async def _apply_activity_changes(self, changes):
+        """Async counterpart of activity_writes.apply_activity_changes"""
+        await asyncio.to_thread(store_changes, changes)
+        success = True
+        for collection, operations in change_writes(changes):
+            result = await self.db[collection].bulk_write(operations, ordered=False)
+            if result.bulk_api_result.get("writeErrors"):
+                success = False
+        changes_written(changes)
+        return success
+
+    async def insert_activities(self, activities):
+        """Async counterpart of User.insert_activities_to_mongo
+
+        Returns:
+            bool: True if no writeErrors, False otherwise
+        """
+        if not activities:
+            return True
+        activities, archive, operations = insert_writes(activities)
+        await self.db.activity_archive.bulk_write(archive, ordered=False)
+        result = await self.db.activities.bulk_write(operations)
+        if result.bulk_api_result.get("writeErrors"):
+            return False
+        return await self._apply_activity_changes(
+            [(None, activities[index]) for index in result.upserted_ids]
+        )
+
+    async def upsert_activity(self, activity_id, activity):
+        """Async counterpart of Event.upsert_to_mongo for activities
+
+        Returns:
+            bool: True if the write succeeded, whether it updated or inserted
+        """
+        activity, archive, update = upsert_writes(activity)
+        await self.db.activity_archive.bulk_write([archive])
+        previous = await self.db.activities.find_one_and_update(
+            {"id": activity_id},
+            update,
+            projection=SCORE_FIELDS,
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        return await self._apply_activity_changes([(previous, activity)])
+
+    async def sync_athlete(self, username, per_page=50):
+        """Async counterpart of User.sync_activities
+
+        Fetches per_athlete pages at a time and writes them in page order, checkpointing after
+        every page so User.sync_activities or another worker can resume the job.
+
+        Args:
+            username (str): User to sync
+            per_page (int, optional): Activities per page. Defaults to 50.
+
+        Raises:
+            RateLimitExceeded: When the rate limit runs out. The job is paused.
+            Exception: Anything else that stops the sync. The job is marked failed.
+
+        Returns:
+            BackfillStats: Pages and activities stored, or None if the user isn't connected to
+                Strava
+        """
+        user = await self._in_app(load_user, username)
+        if user is None or not user.check_user_is_authenticated_with_strava():
+            return None
+        await self._in_app(user.check_access_token)
+        before, after, start_page = await self._in_app(next_sync_job, user.strava_id)
+        stats = BackfillStats()
+        started = time.perf_counter()
+        next_page = start_page
+        failed = False
+        try:
+            while not stats.complete and not failed:
+                pages = range(next_page, next_page + self.per_athlete)
+                results = await asyncio.gather(
+                    *(
+                        self.fetch_activities_page(user, page, per_page, before, after)
+                        for page in pages
+                    ),
+                    return_exceptions=True,
+                )
+                for page, activities in zip(pages, results):
+                    if isinstance(activities, BaseException):
+                        raise activities
+                    if activities is None or not await self.insert_activities(activities):
+                        failed = True
+                        break
+                    await self._in_app(record_page, user.strava_id, page, activities)
+                    stats.pages += 1
+                    stats.activities += len(activities)
+                    stats.last_page = page
+                    if len(activities) < per_page:
+                        stats.complete = True
+                        break
+                next_page = pages.stop
+        except RateLimitExceeded:
+            await self._in_app(finish_sync, user.strava_id, PAUSED)
+            raise
+        except BaseException:
+            await self._in_app(finish_sync, user.strava_id, FAILED)
+            raise
+        finally:
+            stats.seconds = time.perf_counter() - started
+        await self._in_app(finish_sync, user.strava_id, COMPLETE if stats.complete else FAILED)
+        return stats
+
+    async def fetch_activity(self, event):
+        """Async counterpart of Event.fetch_object
+
+        Raises:
+            RateLimitExceeded: When the rate limit is used up
+
+        Returns:
+            dict: The activity, or None if it couldn't be fetched
+        """
+        user = await self._in_app(load_user_by_strava_id, event.owner_id)
+        if user is None:
+            return None
+        await self._in_app(user.check_access_token)
+        result = await self._request(
+            event.owner_id,
+            f"{self.api_url}/activities/{event.object_id}",
+            method="GET",
+            params={"include_all_efforts": False},
+            headers={"Authorization": f"Bearer {user.access_token}"},
+            priority=PRIORITY_LIVE,
+        )
+        if result.rate_limited:
+            raise RateLimitExceeded(result.retry_after)
+        if result.ok and result.data:
+            return result.data
+        return None
+
+    @asynccontextmanager
+    async def _object_lock(self, key):
+        """Holds the lock for an object's events, dropped once nobody holds or waits for it"""
+        entry = self._object_locks.get(key)
+        if entry is None:
+            entry = self._object_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._object_locks[key]
+
+    async def process_event(self, event_data):
+        """Processes a webhook event like enqueue_event and process_object_events
+
+        Redeliveries are dropped and events older than the newest one applied to their object
+        are skipped, with the same webhook_events records the Celery tasks use. Events for one
+        object are processed one at a time. An event that fails has its delivery forgotten, so
+        Strava's retry of it isn't dropped.
+
+        Args:
+            event_data (dict): Event fields
+
+        Raises:
+            RateLimitExceeded: When the rate limit is used up
+
+        Returns:
+            bool: True if the event was processed or was stale, False for a duplicate or a
+                failure
+        """
+        event = Event(**event_data)
+        if not await self._in_app(record_delivery, event):
+            return False
+        try:
+            async with self._object_lock(object_key(event.object_type, event.object_id)):
+                applied_time = await self._in_app(
+                    applied_event_time, event.object_type, event.object_id
+                )
+                if coalesce_events([event_data], applied_time) is None:
+                    return True
+                success = await self._process_event(event)
+                if success or event.aspect_type == "delete":
+                    await self._in_app(
+                        set_applied_event_time,
+                        event.object_type,
+                        event.object_id,
+                        event.event_time,
+                    )
+        except BaseException:
+            await self._in_app(forget_delivery, event)
+            raise
+        if not success and event.aspect_type != "delete":
+            await self._in_app(forget_delivery, event)
+        return success
+
+    async def _process_event(self, event):
+        """Applies an event like Event.create_update_or_delete_event
+
+        Activity creates, and updates that can't be applied locally, are fetched over the shared
+        pool. Everything else doesn't call Strava and runs the blocking Event code in a thread.
+
+        Returns:
+            bool: True if the event was processed
+        """
+        if event.object_type != "activity" or event.aspect_type == "delete":
+            success = await self._in_app(event.create_update_or_delete_event)
+        elif event.aspect_type == "update" and await self._in_app(event.apply_updates_locally):
+            WEBHOOK_UPDATES.labels("local").inc()
+            success = True
+        else:
+            if event.aspect_type == "update":
+                WEBHOOK_UPDATES.labels("refetch").inc()
+            activity = await self.fetch_activity(event)
+            if activity is None:
+                return False
+            success = await self.upsert_activity(event.object_id, activity)
+        if success or event.aspect_type == "delete":
+            observe_webhook_event(event.object_type, event.aspect_type, event.event_time)
+        return success
+
+    async def run(self, usernames=(), events=()):
+        """Syncs athletes and processes events, all at the same time
+
+        Args:
+            usernames (iterable(str), optional): Users to sync. Defaults to ().
+            events (iterable(dict), optional): Webhook event fields. Defaults to ().
+
+        Returns:
+            tuple: (syncs, events). syncs maps each username to its BackfillStats, None or the
+                exception it raised. events holds each event's result or exception, in order.
+        """
+        usernames = list(usernames)
+        results = await asyncio.gather(
+            *(self.sync_athlete(username) for username in usernames),
+            *(self.process_event(event_data) for event_data in events),
+            return_exceptions=True,
+        )
+        return dict(zip(usernames, results[: len(usernames)])), results[len(usernames) :]
+
+
+def run_ingest(app, usernames=(), events=(), max_concurrency=None, per_athlete=None):
+    """Runs an IngestWorker over usernames and events on a new event loop
+
+    Args:
+        app (Flask): The app
+        usernames (iterable(str), optional): Users to sync. Defaults to ().
+        events (iterable(dict), optional): Webhook event fields. Defaults to ().
+        max_concurrency (int, optional): Defaults to INGEST_MAX_CONCURRENCY.
+        per_athlete (int, optional): Defaults to INGEST_PER_ATHLETE.
+
+    Returns:
+        tuple: See IngestWorker.run
+    """
+
+    async def main():
+        worker = IngestWorker(
+            app,
+            max_concurrency=max_concurrency or app.config["INGEST_MAX_CONCURRENCY"],
+            per_athlete=per_athlete or app.config["INGEST_PER_ATHLETE"],
+        )
+        async with worker:
+            return await worker.run(usernames, events)
+
+    return asyncio.run(main())
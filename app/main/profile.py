@@ -0,0 +1,43 @@
+from app.cache import TTLCache
+
+
+class ProfileCache:
+    """Rendered profile page fragments
+
+    Keys hold the user's data version, so a write never has to find and drop stale fragments,
+    they just stop being asked for and age out.
+
+    Args:
+        maxsize (int, optional): Fragments kept. Defaults to 256.
+        ttl (float, optional): Seconds a fragment is kept. Defaults to 300.
+    """
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def init_app(self, app):
+        self.cache.configure(
+            app.config.get("PROFILE_CACHE_SIZE", 256), app.config.get("PROFILE_CACHE_TTL", 300)
+        )
+
+    def fragment(self, key, render):
+        """The cached fragment for key, rendering and caching it on a miss
+
+        Args:
+            key (tuple): (username, data_version, weeks, units)
+            render (callable): Returns the fragment's HTML
+
+        Returns:
+            str: The fragment
+        """
+        fragment = self.cache.get(key)
+        if fragment is None:
+            fragment = render()
+            self.cache.set(key, fragment)
+        return fragment
+
+    def stats(self):
+        return self.cache.stats()
+
+
+profile_cache = ProfileCache()
@@ -1,10 +1,19 @@
-from app import db_client
-from flask import render_template, abort, current_app, flash
+from flask import render_template, abort, current_app, flash, request, url_for
 from flask_login import current_user, login_required
+from app import db_client
+from app.analytics import unit_scales
+from app.conditional import conditional_response, data_validators
 from app.models import User, Subscription
+from app.db_queries.data_versions import get_data_version
+from app.db_queries.leaderboard import PERIODS, PageCursor, leaderboard
+from app.db_queries.user_cache import user_cache
 from app.main.forms import SubscriptionForm
+from app.main.profile import profile_cache
 from app.main import bp
 
+# Most weeks the profile chart shows, which also bounds the fragments cached per user
+MAX_PROFILE_WEEKS = 104
+
 
 @bp.route("/")
 @bp.route("/index")
@@ -15,9 +24,92 @@ def index():
 @bp.route("/user/<username>")
 @login_required
 def user(username):
-    user = User(**db_client.db.users.find_one_or_404({"username": username}))
-    user_weekly_totals = user.get_user_commute_totals()
-    return render_template("user.html", user=user, weekly_totals=user_weekly_totals)
+    weeks = request.args.get("weeks", 10, type=int)
+    units = request.args.get("units", "miles")
+    if not 1 <= weeks <= MAX_PROFILE_WEEKS:
+        abort(400)
+    try:
+        unit_scales(units)
+    except ValueError:
+        abort(400)
+    version = get_data_version(username)
+    if version is None:
+        abort(404)
+    key = (username, version.get("data_version", 0), weeks, units)
+    # The viewer is in the nav bar
+    etag, last_modified = data_validators(
+        (key, current_user.username, current_user.is_admin), version
+    )
+    response, modified = conditional_response(etag, last_modified)
+    if not modified:
+        return response
+
+    def render_profile():
+        user_data = user_cache.find("username", username)
+        if user_data is None:
+            abort(404)
+        user = User(**user_data)
+        # The chart's data is fetched by the page, so the page renders without aggregating
+        return render_template(
+            "_profile.html",
+            user=user,
+            strava_url=user.get_user_strava_url(),
+            totals_url=url_for(
+                "api.user_totals", username=username, period="week", count=weeks, units=units
+            ),
+            units=units,
+        )
+
+    profile = profile_cache.fragment(key, render_profile)
+    response.set_data(render_template("user.html", title=username, profile=profile))
+    return response
+
+
+@bp.route("/leaderboard")
+@bp.route("/leaderboard/<period>")
+@login_required
+def leaderboard_page(period="week"):
+    if period not in PERIODS:
+        abort(404)
+    units = request.args.get("units", "miles")
+    try:
+        distance_scale, _ = unit_scales(units)
+    except ValueError:
+        abort(400)
+    after = request.args.get("after")
+    if after is not None:
+        try:
+            after = PageCursor.decode(after)
+        except ValueError:
+            abort(400)
+    start = leaderboard.current_start(period)
+    entries, cursor = leaderboard.page(period, start, after)
+    mine = None
+    if current_user.strava_id:
+        mine = leaderboard.rank(period, start, current_user.strava_id)
+    athlete_ids = [entry["athlete_id"] for entry in entries]
+    if mine is not None:
+        athlete_ids.append(mine["athlete_id"])
+    usernames = {
+        user["strava_id"]: user["username"]
+        for user in db_client.db.users.find(
+            {"strava_id": {"$in": athlete_ids}}, {"_id": 0, "username": 1, "strava_id": 1}
+        )
+    }
+    for entry in entries + ([mine] if mine else []):
+        entry["username"] = usernames.get(entry["athlete_id"])
+        entry["distance"] = round(entry["distance"] / distance_scale, 2)
+    return render_template(
+        "leaderboard.html",
+        title="Leaderboard",
+        period=period,
+        start=start,
+        units=units,
+        entries=entries,
+        mine=mine,
+        first_page=after is None,
+        cursor=cursor,
+    )
 
 
 @bp.route("/admin", methods=["GET", "POST"])
@@ -37,12 +129,12 @@ def admin():
         if current_app.host_url != subscription_url or subscription_url is None:
             if subscription_url != None:
                 subscription.delete_subscription()
-            response = subscription.create_subscription().json()
-            if response.get("id"):
+            result = subscription.create_subscription()
+            if result.ok and (result.data or {}).get("id"):
                 flash("Created subscription successfully", "success")
             else:
-                flash(f"Couldn't create subscription: {response}", "warning")
-    return render_template("admin.html", form=form)
+                flash(f"Couldn't create subscription: {result.data or result.error}", "warning")
+    return render_template("admin.html", form=form, user_cache_stats=user_cache.stats())
 
 
 @bp.before_app_request
@@ -0,0 +1,146 @@
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from pymongo import monitoring
+
+# With PROMETHEUS_MULTIPROC_DIR set every process (web workers and Celery workers) writes its
+# samples to files there, and /metrics adds them all up
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "commutr_http_request_seconds",
+    "Flask request latency by route",
+    ["method", "route", "status"],
+)
+MONGO_COMMAND_SECONDS = Histogram(
+    "commutr_mongo_command_seconds",
+    "Mongo command latency by collection and command",
+    ["collection", "command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "commutr_mongo_command_failures_total",
+    "Mongo commands that failed by collection and command",
+    ["collection", "command"],
+)
+STRAVA_REQUEST_SECONDS = Histogram(
+    "commutr_strava_request_seconds",
+    "Strava API call latency by endpoint",
+    ["method", "endpoint"],
+)
+STRAVA_RESPONSES = Counter(
+    "commutr_strava_responses_total",
+    "Strava API responses by endpoint and status. Status 0 means no response",
+    ["method", "endpoint", "status"],
+)
+STRAVA_TOKEN_REFRESHES = Counter(
+    "commutr_strava_token_refreshes_total",
+    "Access token refreshes. shared means another thread or process had already refreshed",
+    ["result"],
+)
+WEBHOOK_UPDATES = Counter(
+    "commutr_webhook_updates_total",
+    "Activity update events by how they were applied. local means no Strava call was made",
+    ["path"],
+)
+WEBHOOK_EVENT_LAG_SECONDS = Histogram(
+    "commutr_webhook_event_lag_seconds",
+    "Seconds from a webhook event's event_time to it being processed",
+    ["object_type", "aspect_type"],
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 1800, 3600, 21600),
+)
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def strava_endpoint(url):
+    """Strava URL path with ids replaced, so each endpoint is one label value
+
+    Ex: https://www.strava.com/api/v3/activities/123 is /api/v3/activities/{id}
+    """
+    return _ID_SEGMENT.sub("/{id}", urlsplit(url).path)
+
+
+def observe_strava_call(method, url, status_code, seconds):
+    endpoint = strava_endpoint(url)
+    STRAVA_REQUEST_SECONDS.labels(method, endpoint).observe(seconds)
+    STRAVA_RESPONSES.labels(method, endpoint, str(status_code)).inc()
+
+
+def observe_webhook_event(object_type, aspect_type, event_time):
+    WEBHOOK_EVENT_LAG_SECONDS.labels(object_type, aspect_type).observe(
+        max(0, time.time() - event_time)
+    )
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every Mongo command by collection and command name"""
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = "none"
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _collection(self, event):
+        with self._lock:
+            return self._collections.pop((event.connection_id, event.request_id), "none")
+
+    def succeeded(self, event):
+        MONGO_COMMAND_SECONDS.labels(self._collection(event), event.command_name).observe(
+            event.duration_micros / 1e6
+        )
+
+    def failed(self, event):
+        collection = self._collection(event)
+        MONGO_COMMAND_SECONDS.labels(collection, event.command_name).observe(
+            event.duration_micros / 1e6
+        )
+        MONGO_COMMAND_FAILURES.labels(collection, event.command_name).inc()
+
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def _observe_request(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        # The route template, not the path, so /user/<username> is one series
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.labels(request.method, route, str(response.status_code)).observe(
+            time.perf_counter() - started
+        )
+    return response
+
+
+def metrics_view():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """Times every request and serves the metrics at /metrics"""
+    app.before_request(_start_timer)
+    app.after_request(_observe_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
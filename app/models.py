@@ -1,10 +1,9 @@
-from dataclasses import dataclass, field, InitVar
+from dataclasses import dataclass, InitVar
 from typing import Optional
 import string
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 import secrets
-import requests
 from flask import current_app
 from argon2.exceptions import (
     VerifyMismatchError,
@@ -12,10 +11,37 @@ from argon2.exceptions import (
     InvalidHashError,
 )
 from flask_login import UserMixin
-from pymongo import UpdateOne
-from app.db_queries.mongo_queries import weekly_aggregator
+from pymongo import ReturnDocument
+from app.cache import TTLCache
+from app.metrics import STRAVA_TOKEN_REFRESHES, WEBHOOK_UPDATES
+from app.passwords import VerifierBusy, password_verifier
+from app.db_queries.activity_writes import apply_activity_changes, insert_writes, upsert_writes
+from app.db_queries.data_versions import bump_data_versions, with_version_update
+from app.db_queries.last_seen import last_seen_buffer
+from app.db_queries.leaderboard import SCORE_FIELDS
+from app.db_queries.locks import acquire_lease, local_lock, release_lease
+from app.db_queries.user_cache import user_cache
+from app.db_queries.sync_state import (
+    COMPLETE,
+    FAILED,
+    PAUSED,
+    finish_sync,
+    next_sync_job,
+    record_page,
+)
+from app.strava_api import (
+    PRIORITY_BACKFILL,
+    PRIORITY_LIVE,
+    RateLimitExceeded,
+    get_strava_client,
+    strava_url,
+)
+from app.strava_api.backfill import ConcurrentBackfill
 from app import db_client, login
 
+# Decrypted refresh tokens keyed by their ciphertext, so refreshes skip the Fernet decrypt
+decrypted_tokens = TTLCache(maxsize=1024, ttl=300)
+
 
 @dataclass
 class User(UserMixin):
@@ -37,49 +63,72 @@ class User(UserMixin):
     updated_at: datetime = datetime.utcnow()
     last_seen: datetime = datetime.utcnow()
     is_admin: bool = False
+    # Bumped on every activity or profile write, see data_versions
+    data_version: int = 0
+    data_updated_at: Optional[datetime] = None
     # Internal mongo id
     _id: InitVar[Optional[int]] = None
 
     def set_password(self, password):
-        self.password = current_app.PH.hash(password)
+        self.password = password_verifier.run(current_app.PH.hash, password)
 
     def check_password(self, password):
+        """Verifies a password and upgrades its hash if the argon2 settings have changed
+
+        Raises:
+            VerifierBusy: When too many password checks are already running. A busy pool only
+                skips the rehash of a matching password.
+
+        Returns:
+            bool: True if the password matches
+        """
         try:
-            current_app.PH.verify(self.password, password)
-            return True
+            password_verifier.run(current_app.PH.verify, self.password, password)
         except VerifyMismatchError:
             # Passwords don't match
             return False
         except VerificationError:
-            print("Issue with argon2 password hash verification")
+            current_app.logger.error(f"argon2 couldn't verify the password of {self.username}")
             return False
         except InvalidHashError:
-            print("Hash is not valid")
+            current_app.logger.error(f"Password hash of {self.username} is not valid")
             return False
+        if current_app.PH.check_needs_rehash(self.password):
+            try:
+                self.set_password(password)
+            except VerifierBusy:
+                # The password matched, so the login goes ahead. The next one upgrades the hash
+                current_app.logger.info(f"Skipped rehashing the password of {self.username}")
+                return True
+            self.update_user_in_mongo({"password": self.password})
+        return True
 
     def check_user_is_authenticated_with_strava(self):
         if self.scope is False or self.strava_id == 0:
             return False
         return True
 
-    def update_user_in_mongo(self, update_data):
+    def update_user_in_mongo(self, update_data, profile=False):
+        # Drop the cached user under its old strava_id before the update can change it
+        user_cache.invalidate(username=self.username, strava_id=self.strava_id)
         # First update the user in our model
         self.update(update_data)
+        # Changes shown on the profile page bump its data version
+        update = with_version_update(update_data) if profile else {"$set": update_data}
         result = db_client.db.users.update_one(
             {"username": self.username},  # Use the user's _id for identification
-            {"$set": update_data},
+            update,
         )
+        user_cache.invalidate(username=self.username, strava_id=self.strava_id)
 
         if result.matched_count == 1:
             return True
         return False
 
     def set_last_seen(self):
-        login_data = {"last_seen": datetime.utcnow()}
-        update = self.update_user_in_mongo(login_data)
-        if update is False:
-            # TODO: Print failed login
-            print("Failed to set last seen")
+        # Buffered and written in batches, see LastSeenBuffer
+        if last_seen_buffer.touch(self):
+            user_cache.refresh(self.username, {"last_seen": self.last_seen})
 
     def get_id(self):
         return self.username
@@ -107,17 +156,18 @@ class User(UserMixin):
             return current_app.ENCRYPTOR.decrypt(data).decode("utf-8")
 
     def exchange_auth_token_for_refresh_token(self, code):
-        url = "https://www.strava.com/oauth/token"
+        url = strava_url("/oauth/token")
         data = {
             "client_id": current_app.config["STRAVA_CLIENT_ID"],
             "client_secret": current_app.config["STRAVA_CLIENT_SECRET"],
             "code": code,
             "grant_type": "authorization_code",
         }
-        response = self._request(url, method="POST", payload=data)
+        result = get_strava_client().request(url, method="POST", payload=data)
         # If lookup fails, return None
-        if not response:
+        if not result.ok or not result.data:
             return None
+        response = result.data
         athlete_info = response.get("athlete")
         self.strava_id = athlete_info.get("id")
         user_data = {
@@ -130,24 +180,80 @@ class User(UserMixin):
             ),
             "scope": True,
         }
-        self.update_user_in_mongo(user_data)
+        self.update_user_in_mongo(user_data, profile=True)
         db_client.db.strava_athletes.update_one(
             {"id": self.strava_id}, {"$set": athlete_info}, upsert=True
         )
         # TODO: Handle a failed code lookup in app
         return True
 
+    def decrypt_refresh_token(self):
+        token = decrypted_tokens.get(self.refresh_token)
+        if token is None:
+            token = self.string_crypto(self.refresh_token, decrypt=True)
+            decrypted_tokens.set(self.refresh_token, token)
+        return token
+
+    def reload_access_token(self):
+        """Loads the token fields another process may have refreshed from Mongo
+
+        Returns:
+            bool: True if the stored access token isn't about to expire
+        """
+        stored = db_client.db.users.find_one(
+            {"username": self.username},
+            {"_id": 0, "access_token": 1, "access_token_exp": 1, "refresh_token": 1},
+        )
+        if not stored or int(time.time()) - 60 >= (stored.get("access_token_exp") or 0):
+            return False
+        self.update(stored)
+        return True
+
     def refresh_access_token(self):
-        url = "https://www.strava.com/oauth/token"
+        """Refreshes the access token, once across every thread and process
+
+        Concurrent callers for the same user wait for the refresh in flight and pick up its
+        token from Mongo instead of spending a refresh of their own. If that refresh fails or
+        its process dies, the next waiter to take the lease refreshes instead.
+
+        Returns:
+            bool: True if the user has a fresh access token
+        """
+        name = f"token_refresh:{self.username}"
+        lease_seconds = current_app.config.get("TOKEN_REFRESH_LEASE_SECONDS", 15)
+        with local_lock(name):
+            deadline = time.monotonic() + lease_seconds
+            while True:
+                if self.reload_access_token():
+                    STRAVA_TOKEN_REFRESHES.labels("shared").inc()
+                    return True
+                owner = acquire_lease(name, lease_seconds)
+                if owner is not None:
+                    break
+                # Another process is refreshing, wait for its token or for the lease to be free
+                if time.monotonic() >= deadline:
+                    STRAVA_TOKEN_REFRESHES.labels("timeout").inc()
+                    return False
+                time.sleep(0.2)
+            try:
+                success = self._request_access_token()
+            finally:
+                release_lease(name, owner)
+            STRAVA_TOKEN_REFRESHES.labels("success" if success else "failed").inc()
+            return success
+
+    def _request_access_token(self):
+        url = strava_url("/oauth/token")
         data = {
             "client_id": current_app.config["STRAVA_CLIENT_ID"],
             "client_secret": current_app.config["STRAVA_CLIENT_SECRET"],
-            "refresh_token": self.string_crypto(self.refresh_token, decrypt=True),
+            "refresh_token": self.decrypt_refresh_token(),
             "grant_type": "refresh_token",
         }
-        response = self._request(url, method="POST", payload=data)
-        if not response:
+        result = get_strava_client().request(url, method="POST", payload=data)
+        if not result.ok or not result.data:
             return False
+        response = result.data
         access_data = {
             "access_token": response.get("access_token"),
             "access_token_exp": response.get("expires_at"),
@@ -155,6 +261,7 @@ class User(UserMixin):
                 response.get("refresh_token"), encrypt=True
             ),
         }
+        decrypted_tokens.set(access_data["refresh_token"], response.get("refresh_token"))
         success = self.update_user_in_mongo(access_data)
         if not success:
             return False
@@ -165,7 +272,7 @@ class User(UserMixin):
         current_timestamp = int(current_datetime.timestamp())
         # If the timestamp is within a minute of
         if current_timestamp - 60 >= self.access_token_exp:
-            print("Refreshing access token")
+            current_app.logger.info(f"Refreshing access token for {self.username}")
             success = self.refresh_access_token()
             if success:
                 return True
@@ -178,33 +285,93 @@ class User(UserMixin):
 
     def get_user_strava_url(self):
         profile_data = self.fetch_user_strava_profile()
+        if not profile_data:
+            return None
         url = profile_data.get("profile")
         return url
 
+    def get_period_totals(self, period="week", count=10, units="miles"):
+        """Totals for the user's last count days, weeks, months or years
+
+        Args:
+            period (str, optional): day, week, month or year. Defaults to "week".
+            count (int, optional): Number of periods, including the current one. Defaults to 10.
+            units (str, optional): Distance units, see analytics.DISTANCE_UNITS. Defaults to
+                "miles".
+
+        Returns:
+            PeriodTotals: Distance, moving time, elevation, commutes and CO2 saved per period
+        """
+        from app import analytics
+
+        return self.get_range_totals(analytics.last_periods(period, count), period, units)
+
+    def get_range_totals(self, starts, period="week", units="miles"):
+        """Totals for the periods starting at starts, see analytics.period_totals
+
+        Args:
+            starts (np.ndarray): datetime64[D] period starts, oldest first
+            period (str, optional): day, week, month or year. Defaults to "week".
+            units (str, optional): Distance units. Defaults to "miles".
+
+        Returns:
+            PeriodTotals: Totals per period
+        """
+        from app import analytics
+
+        since = starts[0].astype("datetime64[s]").astype(datetime) if len(starts) else None
+        columns = self.get_activity_columns(since)
+        return analytics.period_totals(columns, period, starts, units)
+
+    def get_activity_columns(self, since=None):
+        """The user's activities from the activity store, or from Mongo if it's turned off
+
+        Args:
+            since (datetime, optional): Oldest start date needed. Only narrows the Mongo query.
+                Defaults to all activities.
+
+        Returns:
+            ActivityColumns: The activities
+        """
+        from app import analytics
+        from app.activity_store import activity_store
+
+        if activity_store.enabled:
+            return activity_store.columns(self.strava_id)
+        return analytics.load_activity_columns(self.strava_id, since=since)
+
+    def get_activity_summary(self, units="miles"):
+        """All time totals, see analytics.summary"""
+        from app import analytics
+
+        return analytics.summary(self.get_activity_columns(), units)
+
     def get_user_commute_totals(self, weeks=10, units="miles"):
-        total_map = self.get_last_n_weeks(weeks)
-        final_date = list(total_map.keys())[-1]
-        pipeline = weekly_aggregator(self.strava_id, last_date=final_date[-1])
-        results = db_client.db.activities.aggregate(pipeline)
-        results = list(results)
-        if units == "miles":
-            scaling = 1609.34
-        else:
-            scaling = 1000
-        for result in results:
-            date_obj = datetime.strptime(result["year_week"] + "-1", "%G-%V-%u")
-            date_time = datetime.strftime(date_obj, "%Y-%m-%d")
-            total_map[date_time] = round(result["total"] / scaling, 2)
-        return total_map
-    
+        """Distance per week for the last weeks, newest first, read from the weekly rollups
+
+        Returns:
+            dict: Week start (YYYY-MM-DD) to distance in units
+        """
+        from app import analytics
+        from app.db_queries.rollups import get_weekly_rollups
+
+        distance_scale, _ = analytics.unit_scales(units)
+        totals = self.get_last_n_weeks(weeks)
+        since = datetime.strptime(list(totals)[-1], "%Y-%m-%d")
+        for rollup in get_weekly_rollups(self.strava_id, since):
+            week = rollup["week_start"].strftime("%Y-%m-%d")
+            if week in totals:
+                totals[week] = round(rollup["total"] / distance_scale, 2)
+        return totals
+
     def get_last_n_weeks(self, weeks):
-        current_date = datetime.now()
-        week_map = {}
-        for i in range(weeks):
-            # Generates the start date (monday) of the last n weeks
-            start_date = datetime.strftime(current_date - timedelta(days=current_date.weekday(), weeks=i), "%Y-%m-%d")
-            week_map[start_date] = 0
-        return week_map
+        # Mondays of the last n weeks, newest first
+        import numpy as np
+        from app import analytics
+
+        return dict.fromkeys(
+            np.datetime_as_string(analytics.last_periods("week", weeks)[::-1]).tolist(), 0
+        )
 
     def insert_activities_to_mongo(self, activities):
         """Takes a list of activities from Strava and inserts them to Mongo using Bulk Write operation
@@ -215,87 +382,188 @@ class User(UserMixin):
         Returns:
             bool: True if no writeErrors, False otherwise
         """
-        operations = []
-        for activity in activities:
-            operation = UpdateOne(
-                {"id": activity.get("id")}, {"$setOnInsert": activity}, upsert=True
-            )
-            operations.append(operation)
-        result = db_client.db.activities.bulk_write(operations)
-        # print(result.bulk_api_result)
-        if not result.bulk_api_result.get("writeErrors"):
+        if not activities:
             return True
-        return False
+        activities, archive, operations = insert_writes(activities)
+        db_client.db.activity_archive.bulk_write(archive, ordered=False)
+        result = db_client.db.activities.bulk_write(operations)
+        if result.bulk_api_result.get("writeErrors"):
+            return False
+        # Only newly inserted activities count towards the leaderboards
+        return apply_activity_changes(
+            [(None, activities[index]) for index in result.upserted_ids]
+        )
+
+    def fetch_activities_page(self, page, per_page=50, before=None, after=None, retries=5):
+        """Fetches one page of the athlete's activities
+
+        Args:
+            page (int): Page number, starting at 1
+            per_page (int, optional): Activities per page. Defaults to 50.
+            before (int, optional): Epoch timestamp to filter activities before a certain time. Defaults to None.
+            after (int, optional): Epoch timestamp to filter activities after a certain time. Defaults to None.
+            retries (int, optional): Number of retries to try. Defaults to 5.
+
+        Raises:
+            RateLimitExceeded: When the backfill share of the rate limit is used up. Its page is
+                the page that wasn't fetched.
+
+        Returns:
+            list(dict): The activities, or None if the page couldn't be fetched
+        """
+        url = strava_url("/api/v3/athlete/activities")
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        params = {"page": page, "before": before, "after": after, "per_page": per_page}
+        time_sleep = 1
+        for retry in range(retries):
+            result = get_strava_client().request(
+                url,
+                method="GET",
+                params=params,
+                headers=headers,
+                priority=PRIORITY_BACKFILL,
+            )
+            if result.rate_limited:
+                raise RateLimitExceeded(result.retry_after, page=page)
+            if result.ok and isinstance(result.data, list):
+                return result.data
+            current_app.logger.warning(
+                f"Failed to fetch activities page {page}. "
+                f"Retry: {retry + 1}, Max retries: {retries}"
+            )
+            time.sleep(time_sleep * (retry + 1))
+        return None
 
     def fetch_previous_events(
-        self, before=None, after=None, activities_to_fetch=50, retries=5, weeks=10
+        self,
+        before=None,
+        after=None,
+        activities_to_fetch=50,
+        retries=5,
+        weeks=10,
+        start_page=1,
+        concurrency=1,
+        on_page=None,
     ):
         """Fetches athletes previous activities
 
+        With concurrency above 1 several pages are fetched at once while a separate thread writes
+        finished pages to Mongo.
+
         Args:
             before (int, optional): Epoch timestamp to filter activities before a certain time. Defaults to None.
             after (int, optional): Epoch timestamp to filter activities after a certain time. Defaults to None.
-            activities_to_fetch (int, optional): Number of activities to fetch. Defaults to 50.
+            activities_to_fetch (int, optional): Number of activities to fetch, None for all. Defaults to 50.
             retries (int, optional): Number of retries to try. Defaults to 5.
+            start_page (int, optional): Page to start on when resuming a backfill. Defaults to 1.
+            concurrency (int, optional): Pages to fetch at once. Capped by
+                STRAVA_BACKFILL_MAX_CONCURRENCY. Defaults to 1.
+            on_page (callable, optional): Called with (page, activities) after each page is
+                written, in page order. Defaults to None.
+
+        Raises:
+            RateLimitExceeded: When the backfill share of the rate limit is used up. Its page is
+                the page to resume from.
+
+        Returns:
+            BackfillStats: Pages and activities stored and the throughput
         """
         self.check_access_token()
-        url = "https://www.strava.com/api/v3/athlete/activities"
-        batch_size = activities_to_fetch if activities_to_fetch <= 50 else 50
-        headers = {"Authorization": f"Bearer {self.access_token}"}
-        params = {"page": 0, "before": before, "after": after, "per_page": batch_size}
-        activities = [0] * batch_size
-        batch_num = 0
-        time_sleep = 1
-        while len(activities) == batch_size:
-            batch_num += 1
-            params["page"] += 1
-            for retry in range(retries):
-                print(f"Fetching num {batch_num*batch_size}, total: {activities_to_fetch}")
-                activities = self._request(
-                    url, method="GET", params=params, headers=headers
+        if activities_to_fetch is None:
+            batch_size = 50
+            last_page = None
+        else:
+            batch_size = activities_to_fetch if activities_to_fetch <= 50 else 50
+            last_page = -(-activities_to_fetch // batch_size)
+        concurrency = min(concurrency, current_app.config["STRAVA_BACKFILL_MAX_CONCURRENCY"])
+        app = current_app._get_current_object()
+
+        def fetch_page(page):
+            with app.app_context():
+                current_app.logger.info(
+                    f"Fetching num {page*batch_size}, total: {activities_to_fetch or 'all'}"
                 )
-                if activities:
-                    success = self.insert_activities_to_mongo(activities)
-                    if success:
-                        break
-                print(
-                    f"Failed to fetch activities. Retry: {retry + 1}, Max retries: {retries}"
+                return self.fetch_activities_page(
+                    page, per_page=batch_size, before=before, after=after, retries=retries
                 )
-                time.sleep(time_sleep * (retry + 1))
-            if activities_to_fetch <= batch_size * batch_num:
-                # If we have fetched the requested number of activites, then break
-                break
 
-    def create_weekly_total_map(self, weeks=10):
-        pass
+        def write_page(page, activities):
+            with app.app_context():
+                if not self.insert_activities_to_mongo(activities):
+                    return False
+                if on_page is not None:
+                    on_page(page, activities)
+                return True
+
+        backfill = ConcurrentBackfill(
+            fetch_page,
+            write_page,
+            per_page=batch_size,
+            concurrency=concurrency,
+            start_page=start_page,
+            last_page=last_page,
+        )
+        stats = backfill.run()
+        current_app.logger.info(
+            f"Fetched {stats.activities} activities for {self.username} in {stats.seconds:.1f}s "
+            f"({stats.activities_per_sec:.1f} activities/sec, concurrency {concurrency})"
+        )
+        return stats
+
+    def sync_activities(self, concurrency=1):
+        """Brings the athlete's stored activities up to date with Strava
+
+        Picks up where the last sync left off, see next_sync_job.
+
+        Args:
+            concurrency (int, optional): Pages to fetch at once. Defaults to 1.
+
+        Raises:
+            RateLimitExceeded: When the rate limit runs out. The job is paused and the next call resumes it.
+
+        Returns:
+            BackfillStats: Pages and activities stored by this call
+        """
+        before, after, start_page = next_sync_job(self.strava_id)
+
+        def checkpoint(page, activities):
+            record_page(self.strava_id, page, activities)
 
-    def _request(self, url, method="GET", payload=None, params=None, headers=None):
         try:
-            response = requests.request(
-                method,
-                url,
-                headers=headers,
-                params=params,
-                data=payload,
-                timeout=10,
+            stats = self.fetch_previous_events(
+                before=before,
+                after=after,
+                activities_to_fetch=None,
+                start_page=start_page,
+                concurrency=concurrency,
+                on_page=checkpoint,
             )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Failed to retrieve access code. {e}")
-            return None
+        except RateLimitExceeded:
+            finish_sync(self.strava_id, PAUSED)
+            raise
+        finish_sync(self.strava_id, COMPLETE if stats.complete else FAILED)
+        return stats
+
+    def create_weekly_total_map(self, weeks=10, units="miles"):
+        """Every weekly total for the last weeks, newest first
+
+        Returns:
+            dict: Week start (YYYY-MM-DD) to distance, commute_distance, moving_time, elevation,
+                activities, commutes and co2_saved_kg
+        """
+        return self.get_period_totals("week", weeks, units).to_dict()
 
 
 @login.user_loader
 def load_user(username=None):
-    user = db_client.db.users.find_one({"username": username})
+    user = user_cache.find("username", username)
     if not user:
         return None
     return User(**user)
 
 
 def load_user_by_strava_id(strava_id):
-    user = db_client.db.users.find_one({"strava_id": strava_id})
+    user = user_cache.find("strava_id", strava_id)
     if not user:
         return None
     return User(**user)
@@ -303,46 +571,25 @@ def load_user_by_strava_id(strava_id):
 
 class Subscription:
     def __init__(self):
-        self.strava_url = "https://www.strava.com/api/v3/push_subscriptions"
+        self.strava_url = strava_url("/api/v3/push_subscriptions")
         self.webhook_url = (f"{current_app.host_url}/strava/webhook",)
 
-    def send_request(
-        self,
-        url,
-        method="GET",
-        payload=None,
-        params=None,
-        headers=None,
-        create=False,
-    ):
-        try:
-            response = requests.request(
-                method,
-                url,
-                headers=headers,
-                params=params,
-                data=payload,
-                timeout=10,
-            )
-            if create:
-                return response
-            response.raise_for_status()
-            return response
-        except requests.exceptions.RequestException as e:
-            print(f"Failed to send request. {e}")
-            return None
-
     def get_subscriptions(self):
         params = {
             "client_id": current_app.config.get("STRAVA_CLIENT_ID"),
             "client_secret": current_app.config.get("STRAVA_CLIENT_SECRET"),
         }
-        response = self.send_request(self.strava_url, method="GET", params=params)
-        if not response:
+        result = get_strava_client().request(self.strava_url, method="GET", params=params)
+        if not result.ok:
             return None
-        return response.json()
+        return result.data
 
     def create_subscription(self):
+        """Creates the webhook subscription
+
+        Returns:
+            StravaResponse: The result. data holds Strava's error message if it failed
+        """
         current_app.verify_token = self._generate_random_string()
         payload = {
             "client_id": current_app.config.get("STRAVA_CLIENT_ID"),
@@ -350,9 +597,7 @@ class Subscription:
             "callback_url": self.webhook_url,
             "verify_token": current_app.verify_token,
         }
-        return self.send_request(
-            self.strava_url, method="POST", payload=payload, create=True
-        )
+        return get_strava_client().request(self.strava_url, method="POST", payload=payload)
 
     def delete_subscription(self):
         current_subscription = self.get_subscriptions()
@@ -361,12 +606,12 @@ class Subscription:
             "client_id": current_app.config.get("STRAVA_CLIENT_ID"),
             "client_secret": current_app.config.get("STRAVA_CLIENT_SECRET"),
         }
-        response = self.send_request(
+        result = get_strava_client().request(
             f"{self.strava_url}/{current_subscription_id}",
             method="DELETE",
             params=params,
         )
-        if response.status_code == 204:
+        if result.status_code == 204:
             return True
         return False
 
@@ -395,6 +640,44 @@ class Event:
     event_time: int  # Time event occured
     collection: str = "activities"
 
+    OBJECT_TYPES = ("activity", "athlete")
+    ASPECT_TYPES = ("create", "update", "delete")
+    # Update keys Strava sends that map straight onto stored activity fields. Any other key
+    # could change derived data like distance, so the activity is fetched again
+    LOCAL_UPDATE_FIELDS = {"title": "name", "type": "type", "private": "private"}
+
+    @classmethod
+    def from_payload(cls, payload):
+        """Validates a webhook POST body and builds an Event from it
+
+        Args:
+            payload (dict): JSON body sent by Strava
+
+        Returns:
+            Event: The event, or None if the payload isn't a valid Strava event
+        """
+        if not isinstance(payload, dict):
+            return None
+        if payload.get("object_type") not in cls.OBJECT_TYPES:
+            return None
+        if payload.get("aspect_type") not in cls.ASPECT_TYPES:
+            return None
+        for key in ("object_id", "owner_id", "subscription_id", "event_time"):
+            if not isinstance(payload.get(key), int):
+                return None
+        updates = payload.get("updates") or {}
+        if not isinstance(updates, dict):
+            return None
+        return cls(
+            object_type=payload["object_type"],
+            object_id=payload["object_id"],
+            aspect_type=payload["aspect_type"],
+            updates=updates,
+            owner_id=payload["owner_id"],
+            subscription_id=payload["subscription_id"],
+            event_time=payload["event_time"],
+        )
+
     def create_update_or_delete_event(self):
         if self.object_type == "athlete":
             self.collection = "strava_athletes"
@@ -420,28 +703,91 @@ class Event:
         if self.object_type == "athlete":
             if self.updates.get("authorized") == "false":
                 db_client.db.users.update_one(
-                    {"strava_id": self.owner_id}, {"scope": False}
+                    {"strava_id": self.owner_id}, with_version_update({"scope": False})
                 )
-                return True
-            id_key = "strava_id"
-        else:
-            id_key = "id"
+                user_cache.invalidate(strava_id=self.owner_id)
+            # Nothing else an athlete update carries is stored, so there's nothing to refetch
+            return True
+        if self.apply_updates_locally():
+            WEBHOOK_UPDATES.labels("local").inc()
+            return True
+        WEBHOOK_UPDATES.labels("refetch").inc()
         object_info = self.fetch_object()
         if not object_info:
             return False
-        upsert_success = self.upsert_to_mongo(id_key, object_info)
-        if not upsert_success:
+        return self.upsert_to_mongo("id", object_info)
+
+    def local_updates(self):
+        """Maps the event's updates onto activity fields
+
+        Returns:
+            dict: Fields to $set, or None if an update can't be applied without a refetch
+        """
+        if not self.updates:
+            return None
+        fields = {}
+        for key, value in self.updates.items():
+            field_name = self.LOCAL_UPDATE_FIELDS.get(key)
+            if field_name is None:
+                return None
+            if key == "private" and isinstance(value, str):
+                # Strava sends booleans in updates as strings
+                value = value.lower() == "true"
+            fields[field_name] = value
+        return fields
+
+    def apply_updates_locally(self):
+        """Applies title, type and privacy changes to the stored activity without calling Strava
+
+        The archived full payload keeps the old values until the activity is next fetched.
+
+        Returns:
+            bool: True if the update was applied, False if the activity has to be fetched
+        """
+        fields = self.local_updates()
+        if fields is None:
+            return False
+        result = db_client.db.activities.update_one({"id": self.object_id}, {"$set": fields})
+        if result.matched_count != 1:
             return False
+        if "type" in fields:
+            from app import analytics
+            from app.activity_store import activity_store
+
+            activity_store.patch(
+                self.owner_id, self.object_id, {"type_code": analytics.type_code(fields["type"])}
+            )
+        bump_data_versions([self.owner_id])
         return True
 
     def upsert_to_mongo(self, object_id, data):
+        """Stores the fetched object over the stored copy, inserting it if it isn't stored yet
+
+        Args:
+            object_id (str): Field that holds the object's id
+            data (dict): Object from Strava
+
+        Returns:
+            bool: True if the write succeeded, whether it updated or inserted
+        """
         collection = db_client.db.get_collection(self.collection)
-        result = collection.update_one(
-            {object_id: self.object_id}, {"$set": data}, upsert=True
+        if self.collection != "activities":
+            result = collection.update_one(
+                {object_id: self.object_id}, {"$set": data}, upsert=True
+            )
+            bump_data_versions([self.owner_id])
+            return result.acknowledged
+        data, archive, update = upsert_writes(data)
+        db_client.db.activity_archive.bulk_write([archive])
+        # Keep the previous version so the leaderboards can apply the distance delta
+        previous = collection.find_one_and_update(
+            {object_id: self.object_id},
+            update,
+            projection=SCORE_FIELDS,
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
         )
-        if result.matched_count == 1:
-            return True
-        return False
+        return apply_activity_changes([(previous, data)])
 
     def delete_activity_or_athlete(self):
         collection = db_client.db.get_collection(self.collection)
@@ -450,35 +796,39 @@ class Event:
             id_key = "owner_id"
         else:
             id_key = "id"
-        result = collection.delete_one({id_key: self.object_id})
-        if result.deleted_count == 1:
-            return True
-        return False
+        if self.object_type == "athlete":
+            result = collection.delete_one({id_key: self.object_id})
+            if result.deleted_count == 1:
+                return True
+            return False
+        deleted = collection.find_one_and_delete(
+            {id_key: self.object_id}, projection=SCORE_FIELDS
+        )
+        if deleted is None:
+            return False
+        apply_activity_changes([(deleted, None)])
+        return True
 
     def fetch_object(self):
+        """Fetches the event's activity from Strava
+
+        Raises:
+            RateLimitExceeded: When the rate limit is used up
+
+        Returns:
+            dict: The activity, or None if it couldn't be fetched
+        """
         user = load_user_by_strava_id(self.owner_id)
         user.check_access_token()
         headers = {"Authorization": f"Bearer {user.access_token}"}
         if self.object_type == "activity":
-            url = f"https://www.strava.com/api/v3/activities/{self.object_id}"
+            url = strava_url(f"/api/v3/activities/{self.object_id}")
             params = {"include_all_efforts": False}
-            data = self._request(url, method="GET", params=params, headers=headers)
-            if data:
-                return data
-        return None
-
-    def _request(self, url, method="GET", payload=None, params=None, headers=None):
-        try:
-            response = requests.request(
-                method,
-                url,
-                headers=headers,
-                params=params,
-                data=payload,
-                timeout=10,
+            result = get_strava_client().request(
+                url, method="GET", params=params, headers=headers, priority=PRIORITY_LIVE
             )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Failed to retrieve object id. {e}")
-            return None
+            if result.rate_limited:
+                raise RateLimitExceeded(result.retry_after)
+            if result.ok and result.data:
+                return result.data
+        return None
@@ -0,0 +1,138 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import statistics
+import threading
+import time
+from argon2 import PasswordHasher
+
+# Smallest memory cost calibration will go down to, in KiB
+MIN_MEMORY_COST = 8192
+
+
+class VerifierBusy(Exception):
+    """Raised when too many password checks are already queued"""
+
+
+def build_password_hasher(config):
+    """Builds the app's PasswordHasher from the ARGON2_* settings
+
+    Args:
+        config (dict): App config
+
+    Returns:
+        PasswordHasher: The hasher
+    """
+    return PasswordHasher(
+        time_cost=config.get("ARGON2_TIME_COST", 3),
+        memory_cost=config.get("ARGON2_MEMORY_COST", 65536),
+        parallelism=config.get("ARGON2_PARALLELISM", 4),
+    )
+
+
+def time_hash(time_cost, memory_cost, parallelism, rounds=5):
+    """Measures how long hashing a password takes with some argon2 settings
+
+    Args:
+        time_cost (int): Argon2 iterations
+        memory_cost (int): Memory in KiB
+        parallelism (int): Lanes
+        rounds (int, optional): Hashes to time. Defaults to 5.
+
+    Returns:
+        float: Median milliseconds per hash
+    """
+    hasher = PasswordHasher(
+        time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism
+    )
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        hasher.hash("calibration-password")
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate(target_ms, memory_cost=65536, parallelism=1, max_time_cost=10, rounds=5):
+    """Finds the strongest argon2 settings that hash within target_ms on this host
+
+    Memory is halved until a single iteration fits the target, then iterations are added while
+    they still fit.
+
+    Args:
+        target_ms (float): Most milliseconds a login should spend hashing
+        memory_cost (int, optional): Starting memory in KiB. Defaults to 65536.
+        parallelism (int, optional): Lanes. Defaults to 1.
+        max_time_cost (int, optional): Most iterations to try. Defaults to 10.
+        rounds (int, optional): Hashes timed per setting. Defaults to 5.
+
+    Returns:
+        dict: time_cost, memory_cost, parallelism and the measured milliseconds
+    """
+    parallelism = max(1, parallelism)
+    memory_cost = max(memory_cost, 8 * parallelism)
+    elapsed = time_hash(1, memory_cost, parallelism, rounds)
+    while elapsed > target_ms and memory_cost // 2 >= MIN_MEMORY_COST:
+        memory_cost //= 2
+        elapsed = time_hash(1, memory_cost, parallelism, rounds)
+    time_cost = 1
+    while time_cost < max_time_cost:
+        candidate = time_hash(time_cost + 1, memory_cost, parallelism, rounds)
+        if candidate > target_ms:
+            break
+        time_cost += 1
+        elapsed = candidate
+    return {
+        "time_cost": time_cost,
+        "memory_cost": memory_cost,
+        "parallelism": parallelism,
+        "milliseconds": elapsed,
+    }
+
+
+class PasswordVerifier:
+    """Runs argon2 hashing and verification on a small bounded thread pool
+
+    Every check holds memory_cost KiB while it runs, so only max_workers run at once and at most
+    max_pending wait behind them. Checks past that raise VerifierBusy instead of queueing.
+
+    Args:
+        max_workers (int, optional): Checks run at once. Defaults to the number of CPUs.
+        max_pending (int, optional): Checks that can wait for a worker. Defaults to 4 x max_workers.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None):
+        self._executor = None
+        self._slots = None
+        self.configure(max_workers, max_pending)
+
+    def init_app(self, app):
+        self.configure(
+            app.config.get("ARGON2_MAX_WORKERS"), app.config.get("ARGON2_MAX_PENDING")
+        )
+
+    def configure(self, max_workers=None, max_pending=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending if max_pending is not None else 4 * self.max_workers
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="argon2"
+        )
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+
+    def run(self, func, *args):
+        """Runs func(*args) on the pool and waits for its result
+
+        Raises:
+            VerifierBusy: When the pool and its queue are full
+        """
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise VerifierBusy()
+        try:
+            return self._executor.submit(func, *args).result()
+        finally:
+            slots.release()
+
+
+password_verifier = PasswordVerifier()
@@ -1,16 +1,25 @@
 from flask import current_app, request, jsonify, abort
 from flask_login import login_required, current_user
+from kombu.exceptions import OperationalError
 from app.models import Subscription, Event
+from app.celery_tasks import enqueue_event
 from app.strava import bp
 
 
 @bp.route("/webhook", methods=["POST", "GET"])
 def webhook():
     if request.method == "POST":
-        # Webhook event received
-        print("Webhook event received!", request.args, request.json)
-        event = Event(**request.json)
-        event.create_update_or_delete_event()
+        # Webhook event received. Strava needs an answer within 2 seconds so workers do the processing
+        event = Event.from_payload(request.get_json(silent=True))
+        if event is None:
+            current_app.logger.warning(f"Invalid webhook event: {request.data!r}")
+            return "Invalid event", 400
+        try:
+            enqueue_event(event)
+        except OperationalError as e:
+            # Strava retries events that aren't acknowledged, so don't ACK if the broker is down
+            current_app.logger.error(f"Failed to enqueue webhook event. {e}")
+            return "Unavailable", 503
         return "EVENT_RECEIVED", 200
     elif request.method == "GET":
         # Your verify token. Should be a random string.
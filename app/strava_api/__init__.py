@@ -0,0 +1,7 @@
+from app.strava_api.client import StravaClient, StravaResponse, get_strava_client, strava_url
+from app.strava_api.rate_limit import (
+    PRIORITY_BACKFILL,
+    PRIORITY_LIVE,
+    RateLimitExceeded,
+    RateLimitGovernor,
+)
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+import httpx
+from app.metrics import observe_strava_call
+from app.strava_api.client import StravaResponse
+from app.strava_api.rate_limit import seconds_until_reset
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncStravaClient:
+    """asyncio counterpart of StravaClient, for the ingestion worker
+
+    Every coroutine shares one httpx connection pool. Calls return the same StravaResponse as
+    StravaClient. The rate limit governor talks to Mongo synchronously, so it runs in a thread.
+
+    Args:
+        max_connections (int, optional): Connections open at once. Defaults to 64.
+        max_keepalive_connections (int, optional): Idle connections kept open. Defaults to 32.
+        connect_timeout (float, optional): Seconds to wait for a connection. Defaults to 3.05.
+        read_timeout (float, optional): Seconds to wait for a response. Defaults to 10.
+        governor (RateLimitGovernor, optional): Shared rate limit for calls made with a priority.
+            Defaults to None.
+        transport (httpx.AsyncBaseTransport, optional): Transport to send requests with, for
+            tests. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        max_connections=64,
+        max_keepalive_connections=32,
+        connect_timeout=3.05,
+        read_timeout=10,
+        governor=None,
+        transport=None,
+    ):
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            transport=transport,
+        )
+        self.governor = governor
+
+    async def close(self):
+        await self.http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def request(
+        self, url, method="GET", payload=None, params=None, headers=None, priority=None
+    ):
+        """Sends a request to Strava. Same arguments and result as StravaClient.request"""
+        governed = self.governor is not None and priority is not None
+        if governed:
+            wait = await asyncio.to_thread(self.governor.acquire, priority)
+            if wait > 0:
+                return StravaResponse(
+                    ok=False, status_code=429, error="Rate limited", retry_after=wait
+                )
+        if params:
+            # requests leaves out None params, httpx would send them empty
+            params = {key: value for key, value in params.items() if value is not None}
+        started = time.perf_counter()
+        try:
+            response = await self.http.request(
+                method, url, headers=headers, params=params, data=payload
+            )
+        except httpx.HTTPError as e:
+            logger.warning(f"Strava {method} {url} failed. {e}")
+            observe_strava_call(method, url, 0, time.perf_counter() - started)
+            return StravaResponse(ok=False, error=str(e))
+        observe_strava_call(method, url, response.status_code, time.perf_counter() - started)
+        try:
+            data = response.json() if response.content else None
+        except ValueError:
+            data = None
+        result = StravaResponse(
+            ok=response.is_success,
+            status_code=response.status_code,
+            data=data,
+            headers=dict(response.headers),
+        )
+        if governed:
+            await asyncio.to_thread(
+                self.governor.update_from_response, response.headers, response.status_code
+            )
+        if result.rate_limited:
+            result.retry_after = seconds_until_reset()
+        if not response.is_success:
+            result.error = f"{response.status_code} {response.reason_phrase}"
+            logger.warning(f"Strava {method} {url} returned {result.error}. {data}")
+        return result
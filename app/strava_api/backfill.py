@@ -0,0 +1,152 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+import queue
+import threading
+import time
+from app.strava_api.rate_limit import RateLimitExceeded
+
+
+@dataclass
+class BackfillStats:
+    """Summary of a backfill run"""
+
+    pages: int = 0
+    activities: int = 0
+    seconds: float = 0
+    last_page: int = 0  # Last page written
+    complete: bool = False  # True if every page was fetched and written
+
+    @property
+    def activities_per_sec(self):
+        if not self.seconds:
+            return 0
+        return self.activities / self.seconds
+
+
+class ConcurrentBackfill:
+    """Fetches activity pages in parallel and writes them in page order on a separate thread
+
+    Up to concurrency pages are in flight at once. Finished pages are handed to a writer thread
+    so network waits and Mongo writes overlap. The first short page marks the end of the
+    athlete's history, no pages after it are requested and any already fetched are dropped.
+
+    Args:
+        fetch_page (callable): fetch_page(page) returns a list of activities, None if the page
+            couldn't be fetched, or raises RateLimitExceeded
+        write_page (callable): write_page(page, activities) stores a page and returns True on
+            success. If it raises, the backfill stops and run re-raises the error.
+        per_page (int): Activities per page, anything shorter is the last page
+        concurrency (int, optional): Pages fetched at once. Defaults to 4.
+        start_page (int, optional): First page to fetch. Defaults to 1.
+        last_page (int, optional): Last page to fetch. Defaults to None for all pages.
+    """
+
+    def __init__(
+        self,
+        fetch_page,
+        write_page,
+        per_page,
+        concurrency=4,
+        start_page=1,
+        last_page=None,
+    ):
+        self.fetch_page = fetch_page
+        self.write_page = write_page
+        self.per_page = per_page
+        self.concurrency = max(1, concurrency)
+        self.start_page = start_page
+        self.last_page = last_page
+        self.stats = BackfillStats()
+        self._write_queue = queue.Queue(maxsize=self.concurrency * 2)
+        self._write_failed = threading.Event()
+        self._write_error = None
+
+    def _writer(self):
+        # Keeps taking pages until the sentinel even after a failure, so run never blocks on a
+        # full queue
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                return
+            page, activities = item
+            if self._write_failed.is_set():
+                continue
+            try:
+                written = self.write_page(page, activities)
+            except Exception as e:
+                self._write_error = e
+                written = False
+            if not written:
+                self._write_failed.set()
+                continue
+            self.stats.pages += 1
+            self.stats.activities += len(activities)
+            self.stats.last_page = page
+
+    def run(self):
+        """Runs the backfill
+
+        Raises:
+            RateLimitExceeded: When the rate limit ran out. Its page is the first page that wasn't
+                written, so the backfill can be resumed from there.
+            Exception: Whatever write_page raised, after the pages in flight have finished
+
+        Returns:
+            BackfillStats: Pages and activities written and throughput
+        """
+        started = time.perf_counter()
+        writer = threading.Thread(target=self._writer, daemon=True)
+        writer.start()
+        next_page = self.start_page
+        next_write = self.start_page
+        end_page = self.last_page
+        fetched = {}
+        in_flight = {}
+        rate_limit = None
+        failed = False
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                while True:
+                    stopping = rate_limit is not None or failed or self._write_failed.is_set()
+                    while (
+                        not stopping
+                        and len(in_flight) < self.concurrency
+                        and (end_page is None or next_page <= end_page)
+                    ):
+                        in_flight[executor.submit(self.fetch_page, next_page)] = next_page
+                        next_page += 1
+                    if not in_flight:
+                        break
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        page = in_flight.pop(future)
+                        try:
+                            activities = future.result()
+                        except RateLimitExceeded as e:
+                            if rate_limit is None or page < rate_limit.page:
+                                rate_limit = RateLimitExceeded(e.retry_after, page=page)
+                            continue
+                        if activities is None:
+                            failed = True
+                            continue
+                        fetched[page] = activities
+                        if len(activities) < self.per_page:
+                            end_page = page if end_page is None else min(end_page, page)
+                    # Hand pages to the writer in order, stopping at a gap
+                    while (
+                        next_write in fetched
+                        and (end_page is None or next_write <= end_page)
+                        and not self._write_failed.is_set()
+                    ):
+                        self._write_queue.put((next_write, fetched.pop(next_write)))
+                        next_write += 1
+        finally:
+            self._write_queue.put(None)
+            writer.join()
+            self.stats.seconds = time.perf_counter() - started
+        if self._write_error is not None:
+            raise self._write_error
+        if rate_limit is not None and not self._write_failed.is_set():
+            raise RateLimitExceeded(rate_limit.retry_after, page=next_write)
+        self.stats.complete = not failed and not self._write_failed.is_set()
+        return self.stats
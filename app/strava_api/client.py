@@ -0,0 +1,177 @@
+from dataclasses import dataclass, field
+import logging
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app, has_app_context
+from app.metrics import observe_strava_call
+from app.strava_api.rate_limit import RateLimitGovernor, seconds_until_reset
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://www.strava.com"
+
+
+@dataclass
+class StravaResponse:
+    """Result of a Strava API call. Failed calls are returned instead of raised"""
+
+    ok: bool
+    status_code: int = 0  # 0 when no response was received
+    data: object = None  # Decoded JSON body, if there was one
+    error: str = ""
+    headers: dict = field(default_factory=dict)
+    retry_after: float = 0  # Seconds to wait before retrying when rate limited
+
+    @property
+    def rate_limited(self):
+        return self.status_code == 429
+
+
+class StravaClient:
+    """HTTP client for the Strava API backed by a single pooled keep-alive session
+
+    Args:
+        pool_connections (int, optional): Number of hosts to keep connection pools for. Defaults to 4.
+        pool_maxsize (int, optional): Connections kept open per host. Defaults to 16.
+        connect_timeout (float, optional): Seconds to wait for a connection. Defaults to 3.05.
+        read_timeout (float, optional): Seconds to wait for a response. Defaults to 10.
+        governor (RateLimitGovernor, optional): Shared rate limit for calls made with a priority.
+            Defaults to None.
+    """
+
+    def __init__(
+        self,
+        pool_connections=4,
+        pool_maxsize=16,
+        connect_timeout=3.05,
+        read_timeout=10,
+        governor=None,
+    ):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.governor = governor
+
+    def request(
+        self, url, method="GET", payload=None, params=None, headers=None, priority=None
+    ):
+        """Sends a request to Strava
+
+        Args:
+            url (str): Full url of the endpoint
+            method (str, optional): HTTP method. Defaults to "GET".
+            payload (dict, optional): Form data for the body. Defaults to None.
+            params (dict, optional): Query string parameters. Defaults to None.
+            headers (dict, optional): Extra headers, like Authorization. Defaults to None.
+            priority (str, optional): Rate limit priority. PRIORITY_LIVE or PRIORITY_BACKFILL.
+                Calls without one aren't rate limited. Defaults to None.
+
+        Returns:
+            StravaResponse: ok is False for connection errors and non 2xx responses. When the rate
+                limit is used up the call isn't made and a 429 with retry_after is returned.
+        """
+        governed = self.governor is not None and priority is not None
+        if governed:
+            wait = self.governor.acquire(priority)
+            if wait > 0:
+                return StravaResponse(
+                    ok=False, status_code=429, error="Rate limited", retry_after=wait
+                )
+        started = time.perf_counter()
+        try:
+            response = self.session.request(
+                method,
+                url,
+                headers=headers,
+                params=params,
+                data=payload,
+                timeout=self.timeout,
+            )
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Strava {method} {url} failed. {e}")
+            observe_strava_call(method, url, 0, time.perf_counter() - started)
+            return StravaResponse(ok=False, error=str(e))
+        observe_strava_call(method, url, response.status_code, time.perf_counter() - started)
+        try:
+            data = response.json() if response.content else None
+        except ValueError:
+            data = None
+        result = StravaResponse(
+            ok=response.ok,
+            status_code=response.status_code,
+            data=data,
+            headers=dict(response.headers),
+        )
+        if governed:
+            self.governor.update_from_response(response.headers, response.status_code)
+        if result.rate_limited:
+            result.retry_after = seconds_until_reset()
+        if not response.ok:
+            result.error = f"{response.status_code} {response.reason}"
+            logger.warning(f"Strava {method} {url} returned {result.error}. {data}")
+        return result
+
+
+def rate_limit_governor(config):
+    """Builds the rate limit governor from app config, or None if rate limiting is off"""
+    if not config.get("STRAVA_RATE_LIMIT_ENABLED", True):
+        return None
+    return RateLimitGovernor(
+        short_limit=config.get("STRAVA_RATE_LIMIT_SHORT", 200),
+        long_limit=config.get("STRAVA_RATE_LIMIT_LONG", 2000),
+        backfill_reserve=config.get("STRAVA_BACKFILL_RESERVE", 0.25),
+    )
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_strava_client():
+    """Returns the process-wide StravaClient, creating it on first use
+
+    Pool sizes and timeouts come from the app config when there is an app context. A new client
+    is made after a fork so worker processes never share sockets with their parent.
+
+    Returns:
+        StravaClient: Shared client
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            config = current_app.config if has_app_context() else {}
+            _client = StravaClient(
+                pool_connections=config.get("STRAVA_POOL_CONNECTIONS", 4),
+                pool_maxsize=config.get("STRAVA_POOL_MAXSIZE", 16),
+                connect_timeout=config.get("STRAVA_CONNECT_TIMEOUT", 3.05),
+                read_timeout=config.get("STRAVA_READ_TIMEOUT", 10),
+                governor=rate_limit_governor(config),
+            )
+            _client_pid = pid
+    return _client
+
+
+def strava_url(path):
+    """Builds a Strava URL on STRAVA_BASE_URL, so the app can be pointed at a simulator
+
+    Args:
+        path (str): Path starting with a slash. Ex: /api/v3/athlete/activities
+
+    Returns:
+        str: Full URL
+    """
+    base_url = DEFAULT_BASE_URL
+    if has_app_context():
+        base_url = current_app.config.get("STRAVA_BASE_URL") or DEFAULT_BASE_URL
+    return f"{base_url.rstrip('/')}{path}"
@@ -0,0 +1,182 @@
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from app import db_client
+
+# Webhook fetches can use the whole budget, backfills have to leave a reserve for them
+PRIORITY_LIVE = "live"
+PRIORITY_BACKFILL = "backfill"
+
+SHORT_WINDOW = timedelta(minutes=15)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a Strava call has to wait for the rate limit to reset
+
+    Args:
+        retry_after (float): Seconds until the call can be made
+        page (int, optional): Page a paged fetch stopped on, so it can be resumed. Defaults to None.
+    """
+
+    def __init__(self, retry_after, page=None):
+        super().__init__(f"Strava rate limit reached. Retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+        self.page = page
+
+
+def short_window_start(now):
+    """Strava's 15 minute limits reset on the quarter hour"""
+    return now.replace(minute=now.minute - now.minute % 15, second=0, microsecond=0)
+
+
+def day_start(now):
+    """Strava's daily limits reset at midnight UTC"""
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def seconds_until_reset(now=None):
+    """Seconds until the current 15 minute window resets"""
+    now = now or datetime.utcnow()
+    return (short_window_start(now) + SHORT_WINDOW - now).total_seconds()
+
+
+def parse_rate_limit_headers(headers):
+    """Reads Strava's rate limit headers
+
+    Strava sends X-RateLimit-* for all requests and X-ReadRateLimit-* for read requests. When
+    both are present the pair with the least remaining budget is used.
+
+    Args:
+        headers (dict): Response headers
+
+    Returns:
+        tuple(int): (short_limit, long_limit, short_usage, long_usage), or None if missing
+    """
+    budgets = []
+    for prefix in ("X-RateLimit", "X-ReadRateLimit"):
+        limit = headers.get(f"{prefix}-Limit")
+        usage = headers.get(f"{prefix}-Usage")
+        if not limit or not usage:
+            continue
+        try:
+            short_limit, long_limit = (int(value) for value in limit.split(","))
+            short_usage, long_usage = (int(value) for value in usage.split(","))
+        except ValueError:
+            continue
+        budgets.append((short_limit, long_limit, short_usage, long_usage))
+    if not budgets:
+        return None
+    return min(budgets, key=lambda budget: min(budget[0] - budget[2], budget[1] - budget[3]))
+
+
+class RateLimitGovernor:
+    """Token bucket for the Strava API shared by every web and worker process
+
+    The bucket is a single Mongo document holding the usage for the current 15 minute window
+    and day. Every call takes a token with one atomic update, and Strava's response headers
+    correct the usage so calls made elsewhere with the same app are accounted for.
+
+    Args:
+        short_limit (int, optional): Requests per 15 minutes until headers say otherwise. Defaults to 200.
+        long_limit (int, optional): Requests per day until headers say otherwise. Defaults to 2000.
+        backfill_reserve (float, optional): Fraction of each budget backfills can't use. Defaults to 0.25.
+        key (str, optional): Bucket document id. Defaults to "strava".
+    """
+
+    def __init__(self, short_limit=200, long_limit=2000, backfill_reserve=0.25, key="strava"):
+        self.short_limit = short_limit
+        self.long_limit = long_limit
+        self.backfill_reserve = backfill_reserve
+        self.key = key
+
+    @property
+    def collection(self):
+        return db_client.db.strava_rate_limits
+
+    def _reset_windows(self, now):
+        # Zero the usage counters once their window has rolled over. A missing start sorts
+        # before any date, so a new bucket starts at zero
+        window = short_window_start(now)
+        day = day_start(now)
+        return {
+            "short_usage": {
+                "$cond": [{"$lt": ["$window_start", window]}, 0, "$short_usage"]
+            },
+            "long_usage": {
+                "$cond": [{"$lt": ["$day_start", day]}, 0, "$long_usage"]
+            },
+            "window_start": {"$max": ["$window_start", window]},
+            "day_start": {"$max": ["$day_start", day]},
+            "short_limit": {"$ifNull": ["$short_limit", self.short_limit]},
+            "long_limit": {"$ifNull": ["$long_limit", self.long_limit]},
+        }
+
+    def acquire(self, priority=PRIORITY_LIVE, now=None):
+        """Takes a token from the bucket
+
+        Args:
+            priority (str, optional): PRIORITY_LIVE or PRIORITY_BACKFILL. Defaults to PRIORITY_LIVE.
+            now (datetime, optional): Current UTC time. Defaults to now.
+
+        Returns:
+            float: 0 if the call can be made, otherwise seconds until the budget resets
+        """
+        now = now or datetime.utcnow()
+        share = 1 if priority == PRIORITY_LIVE else 1 - self.backfill_reserve
+        granted = {
+            "$and": [
+                {"$lt": ["$short_usage", {"$multiply": ["$short_limit", share]}]},
+                {"$lt": ["$long_usage", {"$multiply": ["$long_limit", share]}]},
+            ]
+        }
+        taken = {"$cond": ["$granted", 1, 0]}
+        bucket = self.collection.find_one_and_update(
+            {"_id": self.key},
+            [
+                {"$set": self._reset_windows(now)},
+                {"$set": {"granted": granted}},
+                {
+                    "$set": {
+                        "short_usage": {"$add": ["$short_usage", taken]},
+                        "long_usage": {"$add": ["$long_usage", taken]},
+                    }
+                },
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket["granted"]:
+            return 0
+        if bucket["long_usage"] >= bucket["long_limit"] * share:
+            reset = day_start(now) + timedelta(days=1)
+        else:
+            reset = short_window_start(now) + SHORT_WINDOW
+        return (reset - now).total_seconds()
+
+    def update_from_response(self, headers, status_code, now=None):
+        """Corrects the bucket with the usage Strava reports
+
+        Args:
+            headers (dict): Response headers
+            status_code (int): Response status. A 429 without headers empties the window.
+            now (datetime, optional): Current UTC time. Defaults to now.
+        """
+        now = now or datetime.utcnow()
+        limits = parse_rate_limit_headers(headers)
+        if limits is None:
+            if status_code != 429:
+                return
+            update = {"short_usage": "$short_limit"}
+        else:
+            short_limit, long_limit, short_usage, long_usage = limits
+            update = {
+                "short_limit": short_limit,
+                "long_limit": long_limit,
+                "short_usage": {"$max": ["$short_usage", short_usage]},
+                "long_usage": {"$max": ["$long_usage", long_usage]},
+            }
+        self.collection.update_one(
+            {"_id": self.key},
+            [{"$set": self._reset_windows(now)}, {"$set": update}],
+            upsert=True,
+        )
+
@@ -0,0 +1,53 @@
+"""Synthetic Strava payloads shaped like the real ones in tests/example_activity.json"""
+import copy
+import json
+import os
+from datetime import datetime, timedelta
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), "..", "tests", "example_activity.json")
+
+_template = None
+
+
+def activity_template():
+    global _template
+    if _template is None:
+        with open(TEMPLATE_PATH, "r", encoding="utf-8") as json_file:
+            _template = json.load(json_file)
+    return _template
+
+
+def make_activity(activity_id, athlete_id, start_date, index=0):
+    """Builds a detailed activity. Distance and commute vary with index
+
+    Args:
+        activity_id (int): Activity id
+        athlete_id (int): Owner's athlete id
+        start_date (datetime): UTC start time
+        index (int, optional): Seed for the varying fields. Defaults to 0.
+
+    Returns:
+        dict: The activity
+    """
+    activity = copy.deepcopy(activity_template())
+    activity.update(
+        {
+            "id": activity_id,
+            "athlete": {"id": athlete_id, "resource_state": 1},
+            "name": f"Synthetic ride {index}",
+            "commute": index % 3 != 0,
+            "distance": 2000.0 + (index * 37) % 15000,
+            "start_date": start_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "start_date_local": start_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+    )
+    return activity
+
+
+def synthetic_activities(count, first_id, athlete_id, now=None):
+    """Builds count activities, newest first, about one every eight hours back from now"""
+    now = now or datetime.utcnow()
+    return [
+        make_activity(first_id + i, athlete_id, now - timedelta(hours=8 * i + 1), index=i)
+        for i in range(count)
+    ]
@@ -0,0 +1,265 @@
+"""Benchmarks for webhook throughput, weekly totals latency and backfill speed
+
+Seeds a synthetic athlete and times the app's hot paths against mocked Strava endpoints. Runs on
+an in-memory mongomock database unless --mongo-uri points at a real mongod. Results are written
+as JSON so runs can be compared.
+
+    python -m benchmarks.run --activities 5000 --output benchmark.json
+    python -m benchmarks.run --mongo-uri mongodb://localhost:27017/commutr_benchmark
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import platform
+import re
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from cryptography.fernet import Fernet
+import responses
+from config import Config
+from app import create_app, db_client
+from benchmarks import payloads
+
+STRAVA_API = "https://www.strava.com/api/v3"
+ATHLETE_ID = 990000001
+USERNAME = "benchmark"
+
+
+class BenchmarkConfig(Config):
+    TESTING = True
+    DEBUG = True
+    SECRET_KEY = os.getenv("KEY") or base64.b64encode(Fernet.generate_key()).decode()
+    MONGO_URI = "mongodb://localhost:27017/commutr_benchmark"
+    CELERY_LOCAL = True
+    STRAVA_RATE_LIMIT_ENABLED = False
+    LAST_SEEN_FLUSH_INTERVAL = 3600
+    ACTIVITY_STORE_DIR = tempfile.mkdtemp(prefix="commutr_benchmark_store_")
+
+
+def make_app(mongo_uri=None):
+    """Builds the app, on mongomock unless mongo_uri is given"""
+    config = type(
+        "Config", (BenchmarkConfig,), {"MONGO_URI": mongo_uri or BenchmarkConfig.MONGO_URI}
+    )
+    app = create_app(config)
+    if mongo_uri is None:
+        import mongomock
+
+        db_client.cx = mongomock.MongoClient()
+        db_client.db = db_client.cx["commutr_benchmark"]
+    return app
+
+
+def percentile(values, pct):
+    """Nearest rank percentile of values"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def synthetic_activities(count, first_id):
+    return payloads.synthetic_activities(count, first_id, athlete_id=ATHLETE_ID)
+
+
+def seed_athlete():
+    """Replaces the benchmark athlete and its data, and returns the user"""
+    from app.activity_store import activity_store
+    from app.models import User, load_user
+
+    activity_store.drop(ATHLETE_ID)
+    db_client.db.users.delete_many({"username": USERNAME})
+    db_client.db.activities.delete_many({"athlete.id": ATHLETE_ID})
+    db_client.db.activity_archive.delete_many({"athlete_id": ATHLETE_ID})
+    db_client.db.weekly_rollups.delete_many({"athlete_id": ATHLETE_ID})
+    db_client.db.sync_state.delete_many({"athlete_id": ATHLETE_ID})
+    user = User(
+        username=USERNAME,
+        email="benchmark@example.com",
+        strava_id=ATHLETE_ID,
+        access_token="benchmark",
+        access_token_exp=int(time.time()) + 86400,
+        scope=True,
+    )
+    db_client.db.users.insert_one(dict(user.__dict__))
+    return load_user(USERNAME)
+
+
+def bench_insert(user, activities, batch_size=200):
+    """insert_activities_to_mongo throughput in batches like backfill pages"""
+    started = time.perf_counter()
+    for start in range(0, len(activities), batch_size):
+        user.insert_activities_to_mongo(activities[start : start + batch_size])
+    seconds = time.perf_counter() - started
+    return {
+        "activities": len(activities),
+        "batch_size": batch_size,
+        "seconds": seconds,
+        "activities_per_sec": len(activities) / seconds if seconds else 0,
+    }
+
+
+def bench_commute_totals(user, runs, weeks=10):
+    """get_user_commute_totals latency"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        user.get_user_commute_totals(weeks=weeks)
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "runs": runs,
+        "weeks": weeks,
+        "p50_ms": percentile(timings, 50),
+        "p99_ms": percentile(timings, 99),
+        "mean_ms": statistics.mean(timings),
+    }
+
+
+def bench_profile_page(app, user, runs):
+    """/user/<username> latency for full renders and for revalidations answered with a 304"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = user.username
+    url = f"/user/{user.username}"
+    etag = client.get(url).headers["ETag"]
+    timings = {200: [], 304: []}
+    for headers in ({}, {"If-None-Match": etag}):
+        for _ in range(runs):
+            started = time.perf_counter()
+            response = client.get(url, headers=headers)
+            timings[response.status_code].append((time.perf_counter() - started) * 1000)
+    return {
+        "runs": runs,
+        "render_p50_ms": percentile(timings[200], 50),
+        "not_modified_p50_ms": percentile(timings[304], 50),
+        "not_modified": len(timings[304]),
+    }
+
+
+def bench_backfill(user, count, concurrency):
+    """fetch_previous_events throughput against a mocked activity list"""
+    activities = synthetic_activities(count, first_id=9_100_000_000)
+
+    def activity_page(request):
+        params = request.params
+        page = int(params.get("page", 1))
+        per_page = int(params.get("per_page", 30))
+        body = activities[(page - 1) * per_page : page * per_page]
+        return 200, {}, json.dumps(body)
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as mock:
+        mock.add_callback(
+            responses.GET,
+            f"{STRAVA_API}/athlete/activities",
+            callback=activity_page,
+            content_type="application/json",
+        )
+        stats = user.fetch_previous_events(activities_to_fetch=None, concurrency=concurrency)
+    return {
+        "activities": stats.activities,
+        "pages": stats.pages,
+        "concurrency": concurrency,
+        "seconds": stats.seconds,
+        "activities_per_sec": stats.activities_per_sec,
+    }
+
+
+def bench_webhook(app, events):
+    """Webhook create events per second, from POST to the activity being stored"""
+    activities = {a["id"]: a for a in synthetic_activities(events, first_id=9_200_000_000)}
+
+    def activity_detail(request):
+        activity_id = int(request.path_url.split("?")[0].rsplit("/", 1)[-1])
+        return 200, {}, json.dumps(activities[activity_id])
+
+    client = app.test_client()
+    statuses = {}
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as mock:
+        mock.add_callback(
+            responses.GET,
+            re.compile(rf"{re.escape(STRAVA_API)}/activities/\d+"),
+            callback=activity_detail,
+            content_type="application/json",
+        )
+        started = time.perf_counter()
+        for activity_id in activities:
+            response = client.post(
+                "/strava/webhook",
+                json={
+                    "object_type": "activity",
+                    "object_id": activity_id,
+                    "aspect_type": "create",
+                    "updates": {},
+                    "owner_id": ATHLETE_ID,
+                    "subscription_id": 1,
+                    "event_time": int(time.time()),
+                },
+            )
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        seconds = time.perf_counter() - started
+    return {
+        "events": events,
+        "seconds": seconds,
+        "events_per_sec": events / seconds if seconds else 0,
+        "statuses": statuses,
+        "stored": db_client.db.activities.count_documents({"id": {"$in": list(activities)}}),
+    }
+
+
+def run(activities=2000, events=500, runs=200, concurrency=4, mongo_uri=None):
+    """Runs every benchmark
+
+    Args:
+        activities (int, optional): Activities seeded and backfilled. Defaults to 2000.
+        events (int, optional): Webhook events posted. Defaults to 500.
+        runs (int, optional): Weekly totals calls and profile page views timed. Defaults to
+            200.
+        concurrency (int, optional): Backfill page concurrency. Defaults to 4.
+        mongo_uri (str, optional): Real mongod to run against. Defaults to mongomock.
+
+    Returns:
+        dict: Run metadata and results per benchmark
+    """
+    app = make_app(mongo_uri)
+    with app.app_context():
+        user = seed_athlete()
+        results = {
+            "insert_activities_to_mongo": bench_insert(
+                user, synthetic_activities(activities, first_id=9_000_000_000)
+            ),
+            "get_user_commute_totals": bench_commute_totals(user, runs),
+            "profile_page": bench_profile_page(app, user, runs),
+            "fetch_previous_events": bench_backfill(user, activities, concurrency),
+            "webhook": bench_webhook(app, events),
+        }
+        seed_athlete()
+    return {
+        "started_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "mongo": mongo_uri or "mongomock",
+        "activities": activities,
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--activities", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--mongo-uri", default=None, help="Defaults to in-memory mongomock")
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args(argv)
+    report = run(args.activities, args.events, args.runs, args.concurrency, args.mongo_uri)
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump(report, output, indent=2)
+    for name, result in report["results"].items():
+        print(name, json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Cold start latency of create_app for each app role
+
+Every run is a new interpreter, so imports are timed as a fresh web, worker or cli process would
+pay them. Reports the interpreter's total wall time, the time to import the app package and the
+time create_app takes, and which heavy modules each role loaded.
+
+    python -m benchmarks.startup --runs 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from app import ROLES
+from benchmarks.run import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules a role should only load if it needs them
+HEAVY_MODULES = ("celery", "numpy", "argon2", "cryptography.fernet", "ngrok", "app.models")
+
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app(role=sys.argv[1])
+created = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_ms": (created - imported) * 1000,
+    "modules": [name for name in sys.argv[2:] if name in sys.modules],
+}))
+"""
+
+
+def start_once(role, workdir):
+    """Starts a new interpreter that builds the app for role
+
+    Returns:
+        dict: process_ms, import_ms, create_ms and the heavy modules loaded
+    """
+    env = {
+        **os.environ,
+        "PYTHONPATH": ROOT,
+        "MONGO_URI": os.getenv("MONGO_URI") or "mongodb://localhost:27017/commutr_benchmark",
+    }
+    started = time.perf_counter()
+    # Run outside the repo so the log folder production mode creates is thrown away
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT, role, *HEAVY_MODULES],
+        cwd=workdir,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process_ms"] = (time.perf_counter() - started) * 1000
+    return timings
+
+
+def run(runs=5, roles=ROLES):
+    """Times cold starts for each role
+
+    Args:
+        runs (int, optional): Processes started per role. Defaults to 5.
+        roles (iterable(str), optional): Roles to time. Defaults to every role.
+
+    Returns:
+        dict: Run metadata and p50/max timings per role
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="commutr_startup_") as workdir:
+        for role in roles:
+            samples = [start_once(role, workdir) for _ in range(runs)]
+            result = {"runs": runs, "modules": samples[-1]["modules"]}
+            for name in ("process_ms", "import_ms", "create_ms"):
+                values = [sample[name] for sample in samples]
+                result[f"{name[:-3]}_p50_ms"] = percentile(values, 50)
+                result[f"{name[:-3]}_max_ms"] = max(values)
+            results[role] = result
+    return {
+        "started_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--role", dest="roles", action="append", choices=ROLES)
+    parser.add_argument("--output", default="startup.json")
+    args = parser.parse_args(argv)
+    report = run(args.runs, args.roles or ROLES)
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump(report, output, indent=2)
+    for role, result in report["results"].items():
+        print(role, json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
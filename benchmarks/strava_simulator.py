@@ -0,0 +1,356 @@
+"""Local stand-in for the Strava API, for load testing ingestion offline
+
+Serves /oauth/authorize, /oauth/token, /api/v3/athlete/activities, /api/v3/activities/<id> and
+/api/v3/push_subscriptions with synthetic payloads, per-call latency, random errors and 429s, and
+X-RateLimit headers. It can also POST webhook events to the app at a target rate.
+
+    python -m benchmarks.strava_simulator serve --port 8081 --latency-ms 80 --rate-limit-rate 0.01
+    STRAVA_BASE_URL=http://localhost:8081 flask run
+    python -m benchmarks.strava_simulator emit --url http://localhost:8080/strava/webhook --rate 50
+
+Athletes and activities are derived from ids, so any athlete has activities_per_athlete of them.
+Activity ids are athlete_id * ACTIVITY_ID_FACTOR + n, with n = 0 the newest. Access tokens
+carry the athlete id, tokens the simulator didn't issue belong to default_athlete_id.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import itertools
+import json
+import math
+import random
+import secrets
+import threading
+import time
+from urllib.parse import urlencode
+from flask import Flask, abort, jsonify, redirect, request
+import requests
+from app.strava_api.rate_limit import day_start, short_window_start
+from benchmarks.payloads import make_activity
+from benchmarks.run import percentile
+
+ACTIVITY_ID_FACTOR = 100000
+
+
+@dataclass
+class SimulatorSettings:
+    latency_ms: float = 0  # Added to every API call
+    latency_jitter_ms: float = 0  # Random extra latency, up to this much
+    error_rate: float = 0  # Fraction of calls answered with a 500
+    rate_limit_rate: float = 0  # Fraction of calls answered with a 429 while under the limit
+    short_limit: int = 200  # Requests per 15 minutes
+    long_limit: int = 2000  # Requests per day
+    activities_per_athlete: int = 500
+    default_athlete_id: int = 990000001
+    seed: int = None
+
+
+class UsageCounter:
+    """Counts requests per 15 minute window and day like Strava does"""
+
+    def __init__(self):
+        self.short_usage = 0
+        self.long_usage = 0
+        self._short_start = None
+        self._day_start = None
+        self._lock = threading.Lock()
+
+    def count(self, now=None):
+        now = now or datetime.utcnow()
+        with self._lock:
+            if self._short_start != short_window_start(now):
+                self._short_start = short_window_start(now)
+                self.short_usage = 0
+            if self._day_start != day_start(now):
+                self._day_start = day_start(now)
+                self.long_usage = 0
+            self.short_usage += 1
+            self.long_usage += 1
+            return self.short_usage, self.long_usage
+
+
+def issue_token(athlete_id):
+    return f"sim.{athlete_id}.{secrets.token_hex(8)}"
+
+
+def athlete_from_token(token, default):
+    try:
+        prefix, athlete_id, _ = token.split(".")
+        if prefix == "sim":
+            return int(athlete_id)
+    except (AttributeError, ValueError):
+        pass
+    return default
+
+
+def create_simulator(settings=None):
+    """Builds the simulator's Flask app
+
+    Args:
+        settings (SimulatorSettings, optional): Latency, errors and limits. Defaults to none of
+            them.
+
+    Returns:
+        Flask: The simulator
+    """
+    settings = settings or SimulatorSettings()
+    simulator = Flask(__name__)
+    simulator.config["SIMULATOR"] = settings
+    usage = UsageCounter()
+    rng = random.Random(settings.seed)
+    rng_lock = threading.Lock()
+    # Activities are dated back from when the simulator started, so pages stay stable
+    anchor = datetime.utcnow().replace(microsecond=0)
+    subscriptions = {}
+    subscription_ids = itertools.count(1)
+
+    def chance(rate):
+        with rng_lock:
+            return rng.random() < rate
+
+    def token_athlete():
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        return athlete_from_token(token, settings.default_athlete_id)
+
+    def activity(athlete_id, n):
+        start_date = anchor - timedelta(hours=8 * n + 1)
+        return make_activity(athlete_id * ACTIVITY_ID_FACTOR + n, athlete_id, start_date, index=n)
+
+    @simulator.before_request
+    def simulate_conditions():
+        if request.endpoint == "authorize":
+            return None
+        delay = settings.latency_ms
+        if settings.latency_jitter_ms:
+            with rng_lock:
+                delay += rng.uniform(0, settings.latency_jitter_ms)
+        if delay:
+            time.sleep(delay / 1000)
+        short_usage, long_usage = usage.count()
+        if short_usage > settings.short_limit or long_usage > settings.long_limit:
+            return jsonify({"message": "Rate Limit Exceeded", "errors": []}), 429
+        if settings.rate_limit_rate and chance(settings.rate_limit_rate):
+            return jsonify({"message": "Rate Limit Exceeded", "errors": []}), 429
+        if settings.error_rate and chance(settings.error_rate):
+            return jsonify({"message": "Internal Server Error", "errors": []}), 500
+        return None
+
+    @simulator.after_request
+    def rate_limit_headers(response):
+        if request.endpoint != "authorize":
+            response.headers["X-RateLimit-Limit"] = f"{settings.short_limit},{settings.long_limit}"
+            response.headers["X-RateLimit-Usage"] = f"{usage.short_usage},{usage.long_usage}"
+        return response
+
+    @simulator.route("/oauth/authorize")
+    def authorize():
+        # Approves straight away and sends the user back with a code for the default athlete
+        params = {
+            "state": request.args.get("state", ""),
+            "code": f"sim.{settings.default_athlete_id}.code",
+            "scope": request.args.get("scope", ""),
+        }
+        return redirect(f"{request.args.get('redirect_uri', '')}?{urlencode(params)}")
+
+    @simulator.route("/oauth/token", methods=["POST"])
+    def token():
+        grant_type = request.values.get("grant_type")
+        if grant_type == "authorization_code":
+            code = request.values.get("code")
+        elif grant_type == "refresh_token":
+            code = request.values.get("refresh_token")
+        else:
+            return jsonify({"message": "Bad Request", "errors": []}), 400
+        athlete_id = athlete_from_token(code, settings.default_athlete_id)
+        data = {
+            "token_type": "Bearer",
+            "access_token": issue_token(athlete_id),
+            "expires_at": int(time.time()) + 21600,
+            "expires_in": 21600,
+            "refresh_token": issue_token(athlete_id),
+        }
+        if grant_type == "authorization_code":
+            data["athlete"] = {
+                "id": athlete_id,
+                "username": f"athlete{athlete_id}",
+                "resource_state": 2,
+                "firstname": "Sim",
+                "lastname": str(athlete_id),
+                "profile": "https://example.com/profile.jpg",
+            }
+        return jsonify(data)
+
+    @simulator.route("/api/v3/athlete/activities")
+    def athlete_activities():
+        athlete_id = token_athlete()
+        page = max(1, request.args.get("page", 1, type=int))
+        per_page = min(200, max(1, request.args.get("per_page", 30, type=int)))
+        before = request.args.get("before", type=int)
+        after = request.args.get("after", type=int)
+        # Activity n starts 8n + 1 hours before the anchor. Find the n range inside before/after
+        first = 0
+        last = settings.activities_per_athlete
+        if before is not None:
+            hours = (anchor - datetime.utcfromtimestamp(before)).total_seconds() / 3600
+            first = max(first, math.floor((hours - 1) / 8) + 1)
+        if after is not None:
+            hours = (anchor - datetime.utcfromtimestamp(after)).total_seconds() / 3600
+            last = min(last, max(0, math.ceil((hours - 1) / 8)))
+        start = first + (page - 1) * per_page
+        end = min(last, start + per_page)
+        return jsonify([activity(athlete_id, n) for n in range(start, end)])
+
+    @simulator.route("/api/v3/activities/<int:activity_id>")
+    def activity_detail(activity_id):
+        athlete_id, n = divmod(activity_id, ACTIVITY_ID_FACTOR)
+        if n >= settings.activities_per_athlete:
+            abort(404)
+        return jsonify(activity(athlete_id, n))
+
+    @simulator.route("/api/v3/push_subscriptions", methods=["GET", "POST"])
+    def push_subscriptions():
+        if request.method == "GET":
+            return jsonify(list(subscriptions.values()))
+        if subscriptions:
+            return jsonify({"message": "Bad Request", "errors": [{"code": "already exists"}]}), 400
+        subscription_id = next(subscription_ids)
+        now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+        subscriptions[subscription_id] = {
+            "id": subscription_id,
+            "application_id": request.values.get("client_id"),
+            "callback_url": request.values.get("callback_url"),
+            "created_at": now,
+            "updated_at": now,
+        }
+        return jsonify({"id": subscription_id}), 201
+
+    @simulator.route("/api/v3/push_subscriptions/<int:subscription_id>", methods=["DELETE"])
+    def delete_push_subscription(subscription_id):
+        if subscriptions.pop(subscription_id, None) is None:
+            abort(404)
+        return "", 204
+
+    return simulator
+
+
+def emit_webhooks(
+    url,
+    rate,
+    count,
+    owner_id=SimulatorSettings.default_athlete_id,
+    aspect_types=("create",),
+    subscription_id=1,
+    workers=16,
+):
+    """POSTs webhook events to the app at a target rate
+
+    Object ids follow the simulator's scheme, so the app can fetch every activity from it.
+
+    Args:
+        url (str): The app's webhook URL. Ex: http://localhost:8080/strava/webhook
+        rate (float): Events per second
+        count (int): Events to send
+        owner_id (int, optional): Athlete the events belong to. Defaults to the default athlete.
+        aspect_types (tuple(str), optional): Aspect types to cycle through. Defaults to creates.
+        subscription_id (int, optional): Subscription id sent with the events. Defaults to 1.
+        workers (int, optional): Requests in flight at once. Defaults to 16.
+
+    Returns:
+        dict: Events sent, achieved rate, status counts and response latency percentiles
+    """
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+
+    def post(event):
+        started = time.perf_counter()
+        try:
+            status = session.post(url, json=event, timeout=10).status_code
+        except requests.exceptions.RequestException:
+            status = 0
+        return status, (time.perf_counter() - started) * 1000
+
+    futures = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i in range(count):
+            wait = started + i / rate - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            event = {
+                "object_type": "activity",
+                "object_id": owner_id * ACTIVITY_ID_FACTOR + i,
+                "aspect_type": aspect_types[i % len(aspect_types)],
+                "updates": {},
+                "owner_id": owner_id,
+                "subscription_id": subscription_id,
+                "event_time": int(time.time()),
+            }
+            futures.append(executor.submit(post, event))
+        results = [future.result() for future in futures]
+    seconds = time.perf_counter() - started
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = [latency for _, latency in results]
+    return {
+        "events": count,
+        "target_rate": rate,
+        "seconds": seconds,
+        "events_per_sec": count / seconds if seconds else 0,
+        "statuses": statuses,
+        "p50_ms": percentile(latencies, 50) if latencies else 0,
+        "p99_ms": percentile(latencies, 99) if latencies else 0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="Run the simulated Strava API")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8081)
+    serve.add_argument("--latency-ms", type=float, default=0)
+    serve.add_argument("--latency-jitter-ms", type=float, default=0)
+    serve.add_argument("--error-rate", type=float, default=0)
+    serve.add_argument("--rate-limit-rate", type=float, default=0)
+    serve.add_argument("--short-limit", type=int, default=200)
+    serve.add_argument("--long-limit", type=int, default=2000)
+    serve.add_argument("--activities", type=int, default=500, help="Activities per athlete")
+    serve.add_argument("--athlete-id", type=int, default=SimulatorSettings.default_athlete_id)
+    serve.add_argument("--seed", type=int, default=None)
+    emit = commands.add_parser("emit", help="POST webhook events to the app")
+    emit.add_argument("--url", default="http://127.0.0.1:8080/strava/webhook")
+    emit.add_argument("--rate", type=float, default=10, help="Events per second")
+    emit.add_argument("--count", type=int, default=100)
+    emit.add_argument("--owner-id", type=int, default=SimulatorSettings.default_athlete_id)
+    emit.add_argument("--aspect-types", default="create", help="Comma separated")
+    emit.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        settings = SimulatorSettings(
+            latency_ms=args.latency_ms,
+            latency_jitter_ms=args.latency_jitter_ms,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            short_limit=args.short_limit,
+            long_limit=args.long_limit,
+            activities_per_athlete=args.activities,
+            default_athlete_id=args.athlete_id,
+            seed=args.seed,
+        )
+        create_simulator(settings).run(host=args.host, port=args.port, threaded=True)
+    else:
+        result = emit_webhooks(
+            args.url,
+            args.rate,
+            args.count,
+            owner_id=args.owner_id,
+            aspect_types=tuple(args.aspect_types.split(",")),
+            workers=args.workers,
+        )
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
 from app import create_app
 
 app = create_app()
+celery_app = app.extensions.get("celery")
@@ -0,0 +1,43 @@
+from datetime import datetime
+from app.db_queries.activity_schema import (
+    HOT_FIELDS,
+    SCHEMA_VERSION,
+    archive_operation,
+    compact_activity,
+    compress_payload,
+    decompress_payload,
+)
+from app.db_queries.dates import normalize_activity_dates
+
+
+class TestCompactActivity:
+    def test_keeps_only_hot_fields(self, activity):
+        compact = compact_activity(activity)
+        assert set(compact) <= set(HOT_FIELDS) | {"athlete", "map", "schema_version"}
+        assert compact["athlete"] == {"id": 8587070}
+        assert compact["map"] == {"summary_polyline": activity["map"]["summary_polyline"]}
+        assert compact["distance"] == activity["distance"]
+        assert compact["commute"] is True
+        assert compact["schema_version"] == SCHEMA_VERSION
+        assert "laps" not in compact
+        assert "segment_efforts" not in compact
+
+    def test_compact_is_smaller(self, activity):
+        assert len(str(compact_activity(activity))) < len(str(activity)) / 2
+
+
+class TestArchive:
+    def test_payload_round_trip(self, activity):
+        activity = normalize_activity_dates(activity)
+        codec, payload = compress_payload(activity)
+        assert codec in ("zstd", "zlib")
+        assert decompress_payload(codec, bytes(payload)) == activity
+
+    def test_payload_keeps_dates(self):
+        activity = {"id": 1, "start_date": datetime(2024, 1, 8, 12, 0)}
+        codec, payload = compress_payload(activity)
+        assert decompress_payload(codec, bytes(payload))["start_date"] == activity["start_date"]
+
+    def test_summary_payload_doesnt_overwrite(self, activity):
+        assert "$setOnInsert" in archive_operation(activity)._doc  # pylint: disable=protected-access
+        assert "$set" in archive_operation(activity, overwrite=True)._doc  # pylint: disable=protected-access
@@ -0,0 +1,95 @@
+from datetime import datetime
+import json
+import pytest
+from app import analytics
+from app.activity_store import ActivityStore
+from app.analytics import ActivityColumns, type_code
+
+ATHLETE_ID = 42
+
+
+def make_activity(activity_id, day, distance=1000.0, activity_type="Ride"):
+    return {
+        "id": activity_id,
+        "athlete": {"id": ATHLETE_ID},
+        "type": activity_type,
+        "start_date": datetime(2024, 1, day, 8),
+        "distance": distance,
+        "moving_time": 600,
+        "commute": True,
+    }
+
+
+@pytest.fixture
+def mongo_activities(monkeypatch):
+    """Activities the store is rebuilt from, counting rebuilds"""
+    activities = [make_activity(1, 1), make_activity(2, 2)]
+    rebuilds = []
+
+    def load_activity_columns(athlete_id):
+        rebuilds.append(athlete_id)
+        return ActivityColumns.from_activities(activities)
+
+    monkeypatch.setattr(analytics, "load_activity_columns", load_activity_columns)
+    return rebuilds
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ActivityStore(directory=str(tmp_path), initial_capacity=2)
+
+
+class TestActivityStore:
+    def test_rebuilds_once_then_reads_files(self, store, mongo_activities):
+        assert store.columns(ATHLETE_ID).ids.tolist() == [1, 2]
+        assert store.columns(ATHLETE_ID).ids.tolist() == [1, 2]
+        assert mongo_activities == [ATHLETE_ID]
+
+    def test_record_appends_and_patches(self, store, mongo_activities):
+        store.columns(ATHLETE_ID)
+        # Activity 2 is edited, 3 is new and beyond the initial capacity
+        store.record(
+            [make_activity(3, 3, 3000.0), make_activity(2, 2, 2500.0), make_activity(3, 3, 3000.0)]
+        )
+        columns = store.columns(ATHLETE_ID)
+        assert columns.ids.tolist() == [1, 2, 3]
+        assert columns.distance.tolist() == [1000.0, 2500.0, 3000.0]
+        assert columns.start[2] == datetime(2024, 1, 3, 8)
+        assert mongo_activities == [ATHLETE_ID]
+
+    def test_record_accepts_strava_dates(self, store, mongo_activities):
+        store.columns(ATHLETE_ID)
+        activity = make_activity(3, 3)
+        activity["start_date"] = "2024-01-03T08:00:00Z"
+        store.record([activity])
+        assert store.columns(ATHLETE_ID).start[-1] == datetime(2024, 1, 3, 8)
+
+    def test_forget(self, store, mongo_activities):
+        store.columns(ATHLETE_ID)
+        store.forget(ATHLETE_ID, [1])
+        assert store.columns(ATHLETE_ID).ids.tolist() == [2]
+
+    def test_patch(self, store, mongo_activities):
+        store.columns(ATHLETE_ID)
+        store.patch(ATHLETE_ID, 2, {"type_code": type_code("Run")})
+        assert store.columns(ATHLETE_ID).type_code.tolist() == [type_code("Ride"), type_code("Run")]
+
+    def test_writes_without_a_store_wait_for_the_rebuild(self, store, mongo_activities):
+        store.record([make_activity(3, 3)])
+        assert mongo_activities == []
+        # The rebuild reads Mongo, which already has every write
+        assert store.columns(ATHLETE_ID).ids.tolist() == [1, 2]
+
+    def test_version_mismatch_rebuilds(self, store, mongo_activities, tmp_path):
+        store.columns(ATHLETE_ID)
+        meta_path = tmp_path / str(ATHLETE_ID) / "meta.json"
+        meta = json.loads(meta_path.read_text())
+        meta_path.write_text(json.dumps(dict(meta, version=0)))
+        store.columns(ATHLETE_ID)
+        assert mongo_activities == [ATHLETE_ID, ATHLETE_ID]
+
+    def test_disabled_store_ignores_writes(self, tmp_path, mongo_activities):
+        store = ActivityStore(directory=str(tmp_path))
+        store.enabled = False
+        store.record([make_activity(3, 3)])
+        assert not (tmp_path / str(ATHLETE_ID)).exists()
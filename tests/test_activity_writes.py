@@ -0,0 +1,45 @@
+from datetime import datetime
+from app.db_queries.activity_writes import change_writes, insert_writes, upsert_writes
+
+
+def make_activity(activity_id, athlete_id=42, commute=True):
+    return {
+        "id": activity_id,
+        "athlete": {"id": athlete_id},
+        "start_date": "2024-01-17T08:00:00Z",
+        "distance": 1000.0,
+        "commute": commute,
+    }
+
+
+class TestWrites:
+    def test_insert_writes_normalize_dates(self):
+        activities, archive, operations = insert_writes([make_activity(1), make_activity(2)])
+        assert [activity["start_date"] for activity in activities] == [
+            datetime(2024, 1, 17, 8)
+        ] * 2
+        assert len(archive) == len(operations) == 2
+
+    def test_upsert_writes_set_compact_fields(self):
+        activity, _, update = upsert_writes(make_activity(1))
+        assert activity["start_date"] == datetime(2024, 1, 17, 8)
+        assert update["$set"]["id"] == 1
+
+
+class TestChangeWrites:
+    def test_scores_and_rollups_then_data_versions(self):
+        writes = change_writes([(None, make_activity(1)), (make_activity(2, athlete_id=7), None)])
+        assert [collection for collection, _ in writes] == [
+            "leaderboard_scores",
+            "weekly_rollups",
+            "users",
+        ]
+        (update,) = writes[2][1]
+        assert update._filter == {"strava_id": {"$in": [7, 42]}}
+
+    def test_non_commutes_dont_score(self):
+        writes = change_writes([(None, make_activity(1, commute=False))])
+        assert [collection for collection, _ in writes] == ["weekly_rollups", "users"]
+
+    def test_no_changes(self):
+        assert change_writes([]) == []
@@ -0,0 +1,149 @@
+from datetime import datetime
+import numpy as np
+import pytest
+from app import analytics
+from app.analytics import ActivityColumns
+
+
+def make_activity(activity_id, start_date, distance, commute=True, moving_time=600, elevation=10):
+    return {
+        "id": activity_id,
+        "start_date": start_date,
+        "distance": distance,
+        "moving_time": moving_time,
+        "total_elevation_gain": elevation,
+        "commute": commute,
+    }
+
+
+@pytest.fixture
+def columns():
+    return ActivityColumns.from_activities(
+        [
+            # Out of order on purpose, columns are sorted by start date
+            make_activity(3, datetime(2024, 1, 22, 8), 2000),
+            make_activity(1, datetime(2024, 1, 15, 8), 1000),
+            make_activity(2, datetime(2024, 1, 16, 18), 1000, commute=False),
+            make_activity(4, datetime(2024, 2, 1, 8), 5000),
+        ]
+    )
+
+
+class TestPeriods:
+    def test_week_starts_on_monday(self):
+        dates = np.array(["2024-01-15T08:00", "2024-01-21T23:59", "2024-01-22"], "datetime64[s]")
+        starts = analytics.period_start(dates, "week")
+        assert starts.astype(str).tolist() == ["2024-01-15", "2024-01-15", "2024-01-22"]
+
+    def test_last_periods(self):
+        end = datetime(2024, 3, 13)
+        assert analytics.last_periods("week", 3, end).astype(str).tolist() == [
+            "2024-02-26",
+            "2024-03-04",
+            "2024-03-11",
+        ]
+        assert analytics.last_periods("month", 2, end).astype(str).tolist() == [
+            "2024-02-01",
+            "2024-03-01",
+        ]
+        assert analytics.last_periods("year", 1, end).astype(str).tolist() == ["2024-01-01"]
+
+    def test_period_range(self):
+        start, end = datetime(2024, 1, 31), datetime(2024, 3, 4)
+        assert analytics.period_range("month", start, end).astype(str).tolist() == [
+            "2024-01-01",
+            "2024-02-01",
+            "2024-03-01",
+        ]
+        assert analytics.period_range("week", start, end).astype(str).tolist()[::5] == [
+            "2024-01-29",
+            "2024-03-04",
+        ]
+        assert len(analytics.period_range("day", start, end)) == 34
+        assert len(analytics.period_range("day", end, start)) == 0
+
+    def test_unknown_units(self, columns):
+        with pytest.raises(ValueError):
+            analytics.period_totals(columns, units="furlongs")
+
+
+class TestPeriodTotals:
+    def test_weekly_totals(self, columns):
+        totals = analytics.last_period_totals(
+            columns, "week", count=4, units="km", end=datetime(2024, 2, 1)
+        )
+        assert totals.labels() == ["2024-01-08", "2024-01-15", "2024-01-22", "2024-01-29"]
+        assert totals.distance.tolist() == [0, 2, 2, 5]
+        assert totals.commute_distance.tolist() == [0, 1, 2, 5]
+        assert totals.activities.tolist() == [0, 2, 1, 1]
+        assert totals.commutes.tolist() == [0, 1, 1, 1]
+        assert totals.moving_time.tolist() == [0, 1200, 600, 600]
+        assert totals.co2_saved_kg[-1] == pytest.approx(5 * analytics.CO2_KG_PER_KM)
+
+    def test_activities_outside_periods_are_left_out(self, columns):
+        totals = analytics.last_period_totals(
+            columns, "week", count=1, units="m", end=datetime(2024, 1, 16)
+        )
+        assert totals.distance.tolist() == [2000]
+
+    def test_monthly_totals_in_miles(self, columns):
+        totals = analytics.period_totals(columns, "month")
+        assert totals.labels() == ["2024-01-01", "2024-02-01"]
+        assert totals.distance[0] == pytest.approx(4000 / 1609.34)
+        # Elevation is in feet alongside miles
+        assert totals.elevation[0] == pytest.approx(30 / 0.3048)
+
+    def test_to_dict_is_newest_first(self, columns):
+        totals = analytics.period_totals(columns, "year", units="km").to_dict()
+        assert totals == {
+            "2024-01-01": {
+                "distance": 9.0,
+                "commute_distance": 8.0,
+                "moving_time": 2400,
+                "elevation": 40.0,
+                "activities": 4,
+                "commutes": 3,
+                "co2_saved_kg": 1.36,
+            }
+        }
+
+    def test_no_activities(self):
+        columns = ActivityColumns.from_activities([])
+        totals = analytics.last_period_totals(columns, "week", count=2)
+        assert totals.distance.tolist() == [0, 0]
+        assert analytics.commute_streaks(columns) == {"current": 0, "longest": 0}
+
+
+class TestStreaks:
+    def test_daily_streaks(self):
+        columns = ActivityColumns.from_activities(
+            [
+                make_activity(1, datetime(2024, 1, 1, 8), 1000),
+                make_activity(2, datetime(2024, 1, 2, 8), 1000),
+                make_activity(3, datetime(2024, 1, 2, 18), 1000),
+                make_activity(4, datetime(2024, 1, 3, 8), 1000),
+                make_activity(5, datetime(2024, 1, 5, 8), 1000),
+                make_activity(6, datetime(2024, 1, 6, 8), 1000),
+                make_activity(7, datetime(2024, 1, 7, 8), 1000, commute=False),
+            ]
+        )
+        assert analytics.commute_streaks(columns, end=datetime(2024, 1, 7)) == {
+            "current": 2,
+            "longest": 3,
+        }
+        # Nothing yesterday or today, the streak is over
+        assert analytics.commute_streaks(columns, end=datetime(2024, 1, 9))["current"] == 0
+
+    def test_weekly_streaks(self, columns):
+        assert analytics.commute_streaks(columns, "week", end=datetime(2024, 2, 1)) == {
+            "current": 3,
+            "longest": 3,
+        }
+
+
+class TestSummary:
+    def test_summary(self, columns):
+        totals = analytics.summary(columns, units="km")
+        assert totals["distance"] == 9
+        assert totals["commutes"] == 3
+        assert totals["co2_saved_kg"] == pytest.approx(8 * analytics.CO2_KG_PER_KM)
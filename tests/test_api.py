@@ -0,0 +1,79 @@
+import gzip
+import json
+import numpy as np
+import pytest
+from app import analytics
+from app.analytics import ActivityColumns
+from app.api.totals import TOTALS_COLUMNS, gzip_chunks, iter_totals_json
+
+
+@pytest.fixture
+def totals():
+    columns = ActivityColumns.from_activities(
+        [
+            {"id": day, "start_date": np.datetime64("2024-01-01") + day, "distance": 1000.0}
+            for day in range(0, 60, 3)
+        ]
+    )
+    starts = analytics.period_range("day", np.datetime64("2024-01-01"), np.datetime64("2024-02-29"))
+    return analytics.period_totals(columns, "day", starts, units="km")
+
+
+class TestTotalsJson:
+    def test_compact_columns(self, totals):
+        document = "".join(iter_totals_json(totals, {"period": "day"}))
+        assert " " not in document
+        data = json.loads(document)
+        assert list(data) == ["period", "labels", *TOTALS_COLUMNS]
+        assert data["labels"][:2] == ["2024-01-01", "2024-01-02"]
+        assert data["distance"][:4] == [1.0, 0.0, 0.0, 1.0]
+        assert sum(data["activities"]) == 20
+
+    def test_chunks_join_to_the_same_document(self, totals):
+        whole = "".join(iter_totals_json(totals, {"period": "day"}))
+        chunks = list(iter_totals_json(totals, {"period": "day"}, chunk_size=7))
+        assert len(chunks) > len(TOTALS_COLUMNS) * 3
+        assert "".join(chunks) == whole
+
+    def test_gzip(self, totals):
+        chunks = list(iter_totals_json(totals, {}))
+        assert gzip.decompress(b"".join(gzip_chunks(chunks))).decode() == "".join(chunks)
+
+
+@pytest.fixture
+def client(get_app, admin):
+    client = get_app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = admin.username
+    return client
+
+
+class TestUserTotals:
+    def test_default_is_ten_weeks(self, client, admin):
+        response = client.get(f"/api/users/{admin.username}/totals")
+        assert response.status_code == 200
+        assert response.json["period"] == "week"
+        assert len(response.json["labels"]) == 10
+        assert response.headers["Cache-Control"] == "private, no-cache"
+
+    def test_gzip_and_not_modified(self, client, admin):
+        url = f"/api/users/{admin.username}/totals?period=month&start=2023-01-01&end=2023-12-31"
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        data = json.loads(gzip.decompress(response.data))
+        assert len(data["labels"]) == 12
+        headers = {"Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]}
+        assert client.get(url, headers=headers).status_code == 304
+
+    def test_long_ranges_are_streamed(self, client, admin):
+        response = client.get(f"/api/users/{admin.username}/totals?period=day&start=2015-01-01")
+        assert response.is_streamed
+        assert json.loads(response.data)["labels"][0] == "2015-01-01"
+
+    def test_bad_arguments(self, client, admin):
+        url = f"/api/users/{admin.username}/totals"
+        assert client.get(f"{url}?period=hour").status_code == 400
+        assert client.get(f"{url}?units=furlongs").status_code == 400
+        assert client.get(f"{url}?start=2024-02-30").status_code == 400
+        assert client.get(f"{url}?start=2024-02-01&end=2024-01-01").status_code == 400
+        assert client.get("/api/users/no_such_user_123/totals").status_code == 404
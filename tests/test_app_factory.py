@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+import pytest
+from app import create_app
+from tests.conftest import TestConfig
+
+
+class TestRoles:
+    def test_web(self):
+        app = create_app(TestConfig, role="web")
+        assert {"auth", "main", "api", "strava", "errors"} <= set(app.blueprints)
+        assert "celery" in app.extensions
+        assert "ingest" in app.cli.commands
+
+    def test_worker_skips_the_web_app(self):
+        app = create_app(TestConfig, role="worker")
+        assert app.blueprints == {}
+        assert "celery" in app.extensions
+        assert "ingest" not in app.cli.commands
+
+    def test_cli_skips_celery(self):
+        app = create_app(TestConfig, role="cli")
+        assert app.blueprints == {}
+        assert "celery" not in app.extensions
+        assert "ingest" in app.cli.commands
+
+    def test_role_from_config(self):
+        config = type("Config", (TestConfig,), {"APP_ROLE": "cli"})
+        assert create_app(config).config["APP_ROLE"] == "cli"
+
+    def test_unknown_role(self):
+        with pytest.raises(ValueError):
+            create_app(TestConfig, role="scheduler")
+
+
+def test_hasher_and_encryptor_are_built_on_first_use():
+    app = create_app(TestConfig, role="worker")
+    assert "PH" not in vars(app)
+    assert "ENCRYPTOR" not in vars(app)
+    token = app.ENCRYPTOR.encrypt(b"secret")
+    assert app.ENCRYPTOR.decrypt(token) == b"secret"
+    assert app.PH.verify(app.PH.hash("password"), "password")
+
+
+def test_no_tunnel_unless_asked():
+    app = create_app(TestConfig, role="web")
+    assert app.host_url == "127.0.0.1:8080"
+
+
+def test_models_and_commands_load_their_dependencies_when_used():
+    script = (
+        "import sys, app.models, app.commands; "
+        "print(sorted(name for name in sys.argv[1:] if name in sys.modules))"
+    )
+    modules = ["numpy", "app.analytics", "app.activity_store", "app.db_queries.migrations"]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", script, *modules],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "[]"
+
+
+@pytest.mark.parametrize("role", ["worker", "cli"])
+def test_roles_without_stats_skip_numpy(role):
+    script = (
+        "import sys; from app import create_app; from tests.conftest import TestConfig; "
+        f"create_app(TestConfig, role={role!r}); print('numpy' in sys.modules)"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=root, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip().splitlines()[-1] == "False"
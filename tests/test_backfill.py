@@ -0,0 +1,124 @@
+import threading
+import time
+import pytest
+from app.strava_api.backfill import ConcurrentBackfill
+from app.strava_api.rate_limit import RateLimitExceeded
+
+
+class FakeStrava:
+    """Serves pages of fake activities for an athlete with total activities"""
+
+    def __init__(self, total, per_page, delay=0.0, rate_limit_page=None):
+        self.total = total
+        self.per_page = per_page
+        self.delay = delay
+        self.rate_limit_page = rate_limit_page
+        self.requested = []
+        self.written = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def fetch_page(self, page):
+        with self.lock:
+            self.requested.append(page)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if page == self.rate_limit_page:
+            raise RateLimitExceeded(30, page=page)
+        first = (page - 1) * self.per_page
+        last = min(first + self.per_page, self.total)
+        return [{"id": activity_id} for activity_id in range(first, max(first, last))]
+
+    def write_page(self, page, activities):
+        self.written.append(page)
+        return True
+
+
+class TestConcurrentBackfill:
+    def test_fetches_all_pages_in_order(self):
+        strava = FakeStrava(total=230, per_page=50, delay=0.01)
+        backfill = ConcurrentBackfill(
+            strava.fetch_page, strava.write_page, per_page=50, concurrency=4
+        )
+        stats = backfill.run()
+        assert strava.written == [1, 2, 3, 4, 5]
+        assert stats.activities == 230
+        assert stats.last_page == 5
+        assert stats.complete
+        assert stats.activities_per_sec > 0
+
+    def test_respects_concurrency(self):
+        strava = FakeStrava(total=1000, per_page=50, delay=0.01)
+        ConcurrentBackfill(
+            strava.fetch_page, strava.write_page, per_page=50, concurrency=3
+        ).run()
+        assert strava.max_active <= 3
+
+    def test_stops_at_first_short_page(self):
+        strava = FakeStrava(total=100, per_page=50, delay=0.01)
+        ConcurrentBackfill(
+            strava.fetch_page, strava.write_page, per_page=50, concurrency=4
+        ).run()
+        # Page 3 is empty. Pages requested past it are dropped, never written
+        assert strava.written == [1, 2, 3]
+        assert max(strava.requested) <= 3 + 4
+
+    def test_stops_at_last_page(self):
+        strava = FakeStrava(total=1000, per_page=50)
+        stats = ConcurrentBackfill(
+            strava.fetch_page, strava.write_page, per_page=50, concurrency=4, last_page=2
+        ).run()
+        assert strava.written == [1, 2]
+        assert stats.activities == 100
+
+    def test_rate_limit_resumes_from_first_unwritten_page(self):
+        strava = FakeStrava(total=1000, per_page=50, rate_limit_page=3)
+        with pytest.raises(RateLimitExceeded) as e:
+            ConcurrentBackfill(
+                strava.fetch_page, strava.write_page, per_page=50, concurrency=2
+            ).run()
+        assert e.value.page == 3
+        assert e.value.retry_after == 30
+        assert strava.written == [1, 2]
+
+    def test_failed_page_stops_backfill(self):
+        strava = FakeStrava(total=1000, per_page=50)
+
+        def fetch_page(page):
+            return None if page == 2 else strava.fetch_page(page)
+
+        stats = ConcurrentBackfill(
+            fetch_page, strava.write_page, per_page=50, concurrency=2
+        ).run()
+        assert strava.written == [1]
+        assert not stats.complete
+
+    def test_write_error_is_raised(self):
+        strava = FakeStrava(total=5000, per_page=50, delay=0.001)
+
+        def write_page(page, activities):
+            if page == 2:
+                raise RuntimeError("write failed")
+            return strava.write_page(page, activities)
+
+        backfill = ConcurrentBackfill(strava.fetch_page, write_page, per_page=50, concurrency=2)
+        errors = []
+
+        def run():
+            try:
+                backfill.run()
+            except RuntimeError as e:
+                errors.append(e)
+
+        # run must not hang on the write queue once the writer fails
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+        assert [str(e) for e in errors] == ["write failed"]
+        assert strava.written == [1]
+        assert max(strava.requested) < 100
@@ -0,0 +1,30 @@
+from benchmarks import startup
+from benchmarks.run import percentile, run
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 99) == 3.0
+
+
+def test_benchmarks_run_on_mongomock():
+    report = run(activities=60, events=5, runs=5, concurrency=2)
+    results = report["results"]
+    assert report["mongo"] == "mongomock"
+    assert results["insert_activities_to_mongo"]["activities"] == 60
+    assert results["fetch_previous_events"]["activities"] == 60
+    assert results["webhook"]["statuses"] == {200: 5}
+    assert results["webhook"]["stored"] == 5
+    assert results["get_user_commute_totals"]["p99_ms"] >= 0
+    assert results["profile_page"]["not_modified"] == 5
+
+
+def test_startup_benchmark():
+    report = startup.run(runs=1, roles=["cli"])
+    result = report["results"]["cli"]
+    assert result["process_p50_ms"] > result["create_p50_ms"] > 0
+    # The cli role never loads Celery or the web app's models
+    assert "celery" not in result["modules"]
+    assert "app.models" not in result["modules"]
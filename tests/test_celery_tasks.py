@@ -0,0 +1,88 @@
+import pytest
+import responses
+from app import db_client
+from app.celery_tasks import process_object_events
+from app.db_queries.webhook_events import add_pending
+
+
+@pytest.fixture
+def client(get_app):
+    return get_app.test_client()
+
+
+@pytest.fixture
+def create_payload():
+    return {
+        "aspect_type": "create",
+        "event_time": 1703865498,
+        "object_id": 10,
+        "object_type": "activity",
+        "owner_id": 8587070,
+        "subscription_id": 253500,
+        "updates": {},
+    }
+
+
+@pytest.fixture
+def clean_webhook_state(get_app):
+    db_client.db.webhook_deliveries.delete_many({"_id": {"$regex": "^activity:10:"}})
+    db_client.db.webhook_objects.delete_many({"_id": "activity:10"})
+    yield
+    db_client.db.webhook_deliveries.delete_many({"_id": {"$regex": "^activity:10:"}})
+    db_client.db.webhook_objects.delete_many({"_id": "activity:10"})
+
+
+class TestWebhook:
+    def test_invalid_event_is_rejected(self, client):
+        response = client.post("/strava/webhook", json={"object_type": "route"})
+        assert response.status_code == 400
+
+    def test_non_json_event_is_rejected(self, client):
+        response = client.post("/strava/webhook", data="not json")
+        assert response.status_code == 400
+
+    @responses.activate
+    def test_create_event_is_processed(
+        self, client, admin, activity, access_token_mock, create_payload, clean_webhook_state
+    ):
+        responses.add(access_token_mock)
+        responses.add(
+            method="GET",
+            url="https://www.strava.com/api/v3/activities/10",
+            json=activity,
+            status=200,
+        )
+        response = client.post("/strava/webhook", json=create_payload)
+        assert response.status_code == 200
+        assert response.text == "EVENT_RECEIVED"
+        mongo_result = db_client.db.activities.find_one({"id": 10})
+        assert mongo_result.get("name") == "Barley Flats and Dissapointment"
+        db_client.db.activities.delete_one({"id": 10})
+
+
+class TestProcessObjectEvents:
+    @responses.activate
+    def test_failed_fetch_is_retried(
+        self, get_app, admin, access_token_mock, create_payload, clean_webhook_state
+    ):
+        responses.add(access_token_mock)
+        responses.add(
+            method="GET",
+            url="https://www.strava.com/api/v3/activities/10",
+            status=500,
+        )
+        add_pending(create_payload)
+        result = process_object_events.apply(args=("activity", 10))
+        assert result.get() is False
+        activity_calls = [
+            call for call in responses.calls if "/activities/" in call.request.url
+        ]
+        # First attempt plus the retries
+        assert len(activity_calls) == get_app.config["WEBHOOK_MAX_RETRIES"] + 1
+
+    def test_failed_delete_is_not_retried(self, get_app, create_payload, clean_webhook_state):
+        create_payload["aspect_type"] = "delete"
+        add_pending(create_payload)
+        result = process_object_events.apply(args=("activity", 10))
+        assert result.successful()
+        assert result.get() is False
@@ -0,0 +1,218 @@
+import asyncio
+from datetime import datetime, timedelta
+import httpx
+import pytest
+import responses
+from app import db_client
+from app.db_queries.sync_state import COMPLETE, FAILED, get_sync_state
+from app.ingest import IngestWorker
+from app.strava_api.async_client import AsyncStravaClient
+
+ACTIVITIES_URL = "https://www.strava.com/api/v3/athlete/activities"
+
+
+def make_activities(athlete_id, first_id, count, first_date):
+    return [
+        {
+            "id": first_id + i,
+            "athlete": {"id": athlete_id},
+            "start_date": (first_date - timedelta(days=i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "distance": 1000.0,
+        }
+        for i in range(count)
+    ]
+
+
+class FakeStrava:
+    """httpx transport serving pages of activities and counting calls in flight"""
+
+    def __init__(self, activities, delay=0.0):
+        self.activities = activities
+        self.delay = delay
+        self.pages = []
+        self.active = 0
+        self.max_active = 0
+
+    async def handle(self, request):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.delay)
+        self.active -= 1
+        if request.url.path.startswith("/api/v3/activities/"):
+            activity_id = int(request.url.path.rsplit("/", 1)[-1])
+            for activity in self.activities:
+                if activity["id"] == activity_id:
+                    return httpx.Response(200, json=activity)
+            return httpx.Response(404, json={"message": "Record Not Found"})
+        page = int(request.url.params["page"])
+        per_page = int(request.url.params["per_page"])
+        self.pages.append(page)
+        return httpx.Response(
+            200, json=self.activities[(page - 1) * per_page : page * per_page]
+        )
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+
+class TestAsyncStravaClient:
+    def test_successful_request(self):
+        async def handle(request):
+            assert request.url.params["page"] == "1"
+            # None params are dropped like requests does
+            assert "before" not in request.url.params
+            return httpx.Response(200, json=[{"id": 1}])
+
+        async def main():
+            async with AsyncStravaClient(transport=httpx.MockTransport(handle)) as client:
+                return await client.request(ACTIVITIES_URL, params={"page": 1, "before": None})
+
+        result = asyncio.run(main())
+        assert result.ok
+        assert result.data == [{"id": 1}]
+
+    def test_error_status(self):
+        async def handle(request):
+            return httpx.Response(401, json={"message": "Bad"})
+
+        async def main():
+            async with AsyncStravaClient(transport=httpx.MockTransport(handle)) as client:
+                return await client.request(ACTIVITIES_URL)
+
+        result = asyncio.run(main())
+        assert not result.ok
+        assert result.status_code == 401
+        assert result.error.startswith("401")
+
+    def test_connection_error(self):
+        async def handle(request):
+            raise httpx.ConnectError("refused")
+
+        async def main():
+            async with AsyncStravaClient(transport=httpx.MockTransport(handle)) as client:
+                return await client.request(ACTIVITIES_URL)
+
+        result = asyncio.run(main())
+        assert not result.ok
+        assert result.status_code == 0
+
+    def test_rate_limited(self):
+        async def handle(request):
+            return httpx.Response(429, json={"message": "Rate Limit Exceeded"})
+
+        async def main():
+            async with AsyncStravaClient(transport=httpx.MockTransport(handle)) as client:
+                return await client.request(ACTIVITIES_URL)
+
+        result = asyncio.run(main())
+        assert result.rate_limited
+        assert result.retry_after > 0
+
+
+@pytest.fixture
+def clean_ingest(admin):
+    db_client.db.sync_state.delete_one({"athlete_id": admin.strava_id})
+    yield
+    db_client.db.sync_state.delete_one({"athlete_id": admin.strava_id})
+    db_client.db.activities.delete_many({"id": {"$gte": 910000, "$lt": 910200}})
+    db_client.db.activity_archive.delete_many({"_id": {"$gte": 910000, "$lt": 910200}})
+    db_client.db.webhook_deliveries.delete_many({"_id": {"$regex": "^activity:910"}})
+    db_client.db.webhook_objects.delete_many({"_id": {"$regex": "^activity:910"}})
+
+
+class TestIngestWorker:
+    @responses.activate
+    def test_sync_athlete(self, get_app, admin, access_token_mock, clean_ingest):
+        responses.add(access_token_mock)
+        strava = FakeStrava(
+            make_activities(admin.strava_id, 910000, 120, datetime(2024, 3, 1, 8)), delay=0.01
+        )
+
+        async def main():
+            worker = IngestWorker(
+                get_app, max_concurrency=4, per_athlete=2, transport=strava.transport()
+            )
+            async with worker:
+                return await worker.sync_athlete(admin.username)
+
+        stats = asyncio.run(main())
+        assert stats.complete
+        assert stats.activities == 120
+        assert strava.max_active <= 2
+        assert db_client.db.activities.count_documents({"id": {"$gte": 910000, "$lt": 910200}}) == 120
+        state = get_sync_state(admin.strava_id)
+        assert state["status"] == COMPLETE
+        assert state["last_page"] == 3
+
+    @responses.activate
+    def test_failed_sync_is_recorded(self, get_app, admin, access_token_mock, clean_ingest):
+        responses.add(access_token_mock)
+        strava = FakeStrava(make_activities(admin.strava_id, 910000, 10, datetime(2024, 3, 1, 8)))
+
+        async def main():
+            async with IngestWorker(get_app, transport=strava.transport()) as worker:
+
+                async def broken_insert(activities):
+                    raise RuntimeError("Mongo went away")
+
+                worker.insert_activities = broken_insert
+                with pytest.raises(RuntimeError):
+                    await worker.sync_athlete(admin.username)
+
+        asyncio.run(main())
+        assert get_sync_state(admin.strava_id)["status"] == FAILED
+
+    @responses.activate
+    def test_process_create_event(self, get_app, admin, access_token_mock, clean_ingest):
+        responses.add(access_token_mock)
+        activity = make_activities(admin.strava_id, 910150, 1, datetime(2024, 3, 1, 8))[0]
+        strava = FakeStrava([activity])
+        event = {
+            "object_type": "activity",
+            "object_id": activity["id"],
+            "aspect_type": "create",
+            "updates": {},
+            "owner_id": admin.strava_id,
+            "subscription_id": 1,
+            "event_time": 1709280000,
+        }
+
+        async def main():
+            async with IngestWorker(get_app, transport=strava.transport()) as worker:
+                return await worker.run(events=[event])
+
+        _, results = asyncio.run(main())
+        assert results == [True]
+        stored = db_client.db.activities.find_one({"id": activity["id"]})
+        assert stored["start_date"] == datetime(2024, 3, 1, 8)
+
+    @responses.activate
+    def test_duplicate_and_stale_events_are_dropped(
+        self, get_app, admin, access_token_mock, clean_ingest
+    ):
+        responses.add(access_token_mock)
+        activity = make_activities(admin.strava_id, 910160, 1, datetime(2024, 3, 1, 8))[0]
+        strava = FakeStrava([activity])
+        create = {
+            "object_type": "activity",
+            "object_id": activity["id"],
+            "aspect_type": "create",
+            "updates": {},
+            "owner_id": admin.strava_id,
+            "subscription_id": 1,
+            "event_time": 1709280000,
+        }
+        stale = dict(create, aspect_type="update", event_time=1709279000)
+
+        async def main():
+            async with IngestWorker(get_app, transport=strava.transport()) as worker:
+                results = [await worker.process_event(event) for event in (create, create, stale)]
+                # Locks are dropped with their last event
+                assert not worker._object_locks
+                return results
+
+        # The redelivered create is dropped, the older update is skipped
+        assert asyncio.run(main()) == [True, False, True]
+        assert db_client.db.activities.count_documents({"id": activity["id"]}) == 1
+        applied = db_client.db.webhook_objects.find_one({"_id": f"activity:{activity['id']}"})
+        assert applied["event_time"] == 1709280000
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+import pytest
+from app import db_client
+from app.db_queries.last_seen import LastSeenBuffer
+from app.models import User
+
+
+@pytest.fixture
+def buffer():
+    return LastSeenBuffer(granularity=300, flush_interval=3600, flush_size=1000)
+
+
+class TestLastSeenBuffer:
+    def test_recent_last_seen_is_skipped(self, buffer):
+        now = datetime(2024, 1, 8, 12, 0)
+        user = User(username="bob", email="bob@example.com", last_seen=now)
+        assert buffer.touch(user, now=now + timedelta(minutes=4)) is False
+        assert buffer.touch(user, now=now + timedelta(minutes=6)) is True
+        assert user.last_seen == now + timedelta(minutes=6)
+
+    def test_touches_are_coalesced(self, buffer):
+        now = datetime(2024, 1, 8, 12, 0)
+        user = User(username="bob", email="bob@example.com", last_seen=None)
+        buffer.touch(user, now=now)
+        user.last_seen = None
+        buffer.touch(user, now=now + timedelta(seconds=1))
+        assert buffer._pending == {"bob": now + timedelta(seconds=1)}  # pylint: disable=protected-access
+
+    def test_flush_at_size_threshold(self, get_app, alice):
+        buffer = LastSeenBuffer(granularity=0, flush_interval=3600, flush_size=1)
+        seen = datetime.utcnow().replace(microsecond=0) + timedelta(days=1)
+        alice.last_seen = None
+        buffer.touch(alice, now=seen)
+        stored = db_client.db.users.find_one({"username": "alice"})
+        assert stored["last_seen"] == seen
+        # An older time never overwrites a newer one
+        alice.last_seen = None
+        buffer.touch(alice, now=seen - timedelta(days=2))
+        stored = db_client.db.users.find_one({"username": "alice"})
+        assert stored["last_seen"] == seen
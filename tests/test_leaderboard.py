@@ -0,0 +1,101 @@
+from datetime import datetime
+import pytest
+from app import db_client
+from app.db_queries.activity_writes import apply_activity_changes
+from app.db_queries.leaderboard import PageCursor, leaderboard, leaderboard_deltas, ranked
+
+
+def make_activity(start_date, distance, athlete_id=42, commute=True):
+    return {
+        "athlete": {"id": athlete_id},
+        "start_date": start_date,
+        "distance": distance,
+        "commute": commute,
+    }
+
+
+class TestLeaderboardDeltas:
+    def test_commute_scores_week_and_month(self):
+        deltas = leaderboard_deltas([(None, make_activity("2024-01-31T08:00:00Z", 1000))])
+        assert deltas == {
+            ("week", datetime(2024, 1, 29), 42): [1000, 1],
+            ("month", datetime(2024, 1, 1), 42): [1000, 1],
+        }
+
+    def test_non_commutes_dont_score(self):
+        activity = make_activity("2024-01-31T08:00:00Z", 1000, commute=False)
+        assert leaderboard_deltas([(None, activity)]) == {}
+
+    def test_unmarking_a_commute_removes_its_score(self):
+        old = make_activity("2024-01-31T08:00:00Z", 1000)
+        new = make_activity("2024-01-31T08:00:00Z", 1000, commute=False)
+        deltas = leaderboard_deltas([(old, new)])
+        assert deltas[("week", datetime(2024, 1, 29), 42)] == [-1000, -1]
+
+    def test_unchanged_edit_is_skipped(self):
+        activity = make_activity("2024-01-31T08:00:00Z", 1000)
+        assert leaderboard_deltas([(activity, dict(activity))]) == {}
+
+
+class TestRanked:
+    def test_ties_share_a_rank(self):
+        scores = [
+            {"athlete_id": 1, "distance": 5000.0},
+            {"athlete_id": 2, "distance": 3000.0},
+            {"athlete_id": 3, "distance": 3000.0},
+            {"athlete_id": 4, "distance": 1000.0},
+        ]
+        assert [entry["rank"] for entry in ranked(scores)] == [1, 2, 2, 4]
+
+    def test_page_starting_in_a_tie(self):
+        scores = [{"athlete_id": 3, "distance": 3000.0}, {"athlete_id": 4, "distance": 1000.0}]
+        after = PageCursor(3000.0, 2, 2, 2)
+        assert ranked(scores, after) == [
+            {"rank": 2, "athlete_id": 3, "distance": 3000.0},
+            {"rank": 4, "athlete_id": 4, "distance": 1000.0},
+        ]
+        assert ranked([], after) == []
+
+    def test_cursor_round_trip(self):
+        cursor = PageCursor(1234.5, 42, 3, 7)
+        assert PageCursor.decode(cursor.encode()) == cursor
+        with pytest.raises(ValueError):
+            PageCursor.decode("1234.5:42")
+
+
+@pytest.fixture
+def clean_leaderboard(get_app):
+    query = {"athlete_id": {"$in": [990001, 990002]}}
+    db_client.db.leaderboard_scores.delete_many(query)
+    yield
+    db_client.db.leaderboard_scores.delete_many(query)
+
+
+class TestLeaderboard:
+    def test_changes_update_ranking(self, clean_leaderboard):
+        week = datetime(2020, 1, 6)
+        first = dict(make_activity("2020-01-07T08:00:00Z", 2000, athlete_id=990001), id=990011)
+        second = dict(make_activity("2020-01-08T08:00:00Z", 3000, athlete_id=990002), id=990012)
+        apply_activity_changes([(None, first), (None, second)])
+        assert leaderboard.rank("week", week, 990002)["rank"] == 1
+        assert leaderboard.page("week", week)[0][0]["athlete_id"] == 990002
+        # The cached pages are dropped when their scores change
+        apply_activity_changes([(None, dict(first, distance=5000))])
+        assert leaderboard.page("week", week)[0][0] == {
+            "rank": 1,
+            "athlete_id": 990001,
+            "distance": 7000.0,
+        }
+        apply_activity_changes([(second, None)])
+        assert leaderboard.rank("week", week, 990002) is None
+
+    def test_pages_follow_the_cursor(self, clean_leaderboard):
+        week = datetime(2020, 1, 6)
+        first = dict(make_activity("2020-01-07T08:00:00Z", 2000, athlete_id=990001), id=990011)
+        second = dict(make_activity("2020-01-08T08:00:00Z", 2000, athlete_id=990002), id=990012)
+        apply_activity_changes([(None, first), (None, second)])
+        _, cursor = leaderboard.page("week", week, limit=1)
+        assert cursor == PageCursor(2000.0, 990001, 1, 1)
+        entries, cursor = leaderboard.page("week", week, after=cursor, limit=1)
+        assert entries == [{"rank": 1, "athlete_id": 990002, "distance": 2000.0}]
+        assert cursor is None
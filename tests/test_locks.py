@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import pytest
+import responses
+from app import db_client
+from app.db_queries.locks import acquire_lease, release_lease
+
+
+@pytest.fixture
+def clean_locks(get_app):
+    db_client.db.locks.delete_many({"_id": {"$regex": "^test_"}})
+    yield
+    db_client.db.locks.delete_many({"_id": {"$regex": "^test_"}})
+
+
+def test_lease_is_exclusive(clean_locks):
+    owner = acquire_lease("test_lease", 10)
+    assert owner is not None
+    assert acquire_lease("test_lease", 10) is None
+    release_lease("test_lease", owner)
+    assert acquire_lease("test_lease", 10) is not None
+
+
+def test_expired_lease_can_be_taken(clean_locks):
+    assert acquire_lease("test_expired", 0.1) is not None
+    time.sleep(0.2)
+    assert acquire_lease("test_expired", 10) is not None
+
+
+def test_release_only_by_owner(clean_locks):
+    owner = acquire_lease("test_owner", 10)
+    release_lease("test_owner", "someone-else")
+    assert acquire_lease("test_owner", 10) is None
+    release_lease("test_owner", owner)
+
+
+@responses.activate
+def test_concurrent_refreshes_hit_strava_once(get_app, alice, reset_alice):
+    responses.add(
+        method="POST",
+        url="https://www.strava.com/oauth/token",
+        json={
+            "access_token": "c7d901",
+            "expires_at": int(time.time()) + 3600,
+            "refresh_token": "f1e234",
+        },
+        status=200,
+    )
+    alice.update_user_in_mongo(
+        {
+            "access_token_exp": int(time.time()) - 90,
+            "refresh_token": alice.string_crypto("test", encrypt=True),
+        }
+    )
+
+    def refresh():
+        with get_app.app_context():
+            return alice.refresh_access_token()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: refresh(), range(4)))
+    assert all(results)
+    assert len(responses.calls) == 1
+    assert alice.access_token == "c7d901"
+    alice.update_user_in_mongo(reset_alice)
+
+
+@responses.activate
+def test_waiter_refreshes_when_the_lease_is_freed(get_app, alice, reset_alice):
+    responses.add(
+        method="POST",
+        url="https://www.strava.com/oauth/token",
+        json={
+            "access_token": "a8b302",
+            "expires_at": int(time.time()) + 3600,
+            "refresh_token": "f1e234",
+        },
+        status=200,
+    )
+    alice.update_user_in_mongo(
+        {
+            "access_token_exp": int(time.time()) - 90,
+            "refresh_token": alice.string_crypto("test", encrypt=True),
+        }
+    )
+    # Another process holds the lease and gives up without a new token
+    name = f"token_refresh:{alice.username}"
+    owner = acquire_lease(name, 10)
+    timer = threading.Timer(0.5, release_lease, args=(name, owner))
+    timer.start()
+    started = time.monotonic()
+    assert alice.refresh_access_token()
+    timer.join()
+    assert time.monotonic() - started < 5
+    assert len(responses.calls) == 1
+    assert alice.access_token == "a8b302"
+    alice.update_user_in_mongo(reset_alice)
@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+import responses
+from prometheus_client import REGISTRY
+from app.metrics import MongoCommandMetrics, strava_endpoint
+from app.strava_api import get_strava_client, strava_url
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_strava_endpoint():
+    assert strava_endpoint("https://www.strava.com/api/v3/activities/123") == "/api/v3/activities/{id}"
+    assert strava_endpoint("https://www.strava.com/api/v3/push_subscriptions/9/x") == (
+        "/api/v3/push_subscriptions/{id}/x"
+    )
+    assert strava_endpoint("https://www.strava.com/api/v3/athlete/activities?page=2") == (
+        "/api/v3/athlete/activities"
+    )
+
+
+def test_metrics_endpoint_times_requests(get_app):
+    client = get_app.test_client()
+    client.get("/metrics")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert b'commutr_http_request_seconds_count{method="GET",route="/metrics",status="200"}' in (
+        response.data
+    )
+
+
+@responses.activate
+def test_strava_calls_are_counted(get_app):
+    url = strava_url("/api/v3/activities/42")
+    responses.add(method="GET", url=url, json={}, status=404)
+    labels = {"method": "GET", "endpoint": "/api/v3/activities/{id}", "status": "404"}
+    before = sample("commutr_strava_responses_total", **labels)
+    get_strava_client().request(url)
+    assert sample("commutr_strava_responses_total", **labels) == before + 1
+
+
+def test_mongo_command_listener():
+    listener = MongoCommandMetrics()
+    labels = {"collection": "activities", "command": "find"}
+    before = sample("commutr_mongo_command_seconds_count", **labels)
+    failures = sample("commutr_mongo_command_failures_total", **labels)
+    for outcome in (listener.succeeded, listener.failed):
+        listener.started(
+            SimpleNamespace(
+                command={"find": "activities"}, command_name="find", connection_id=1, request_id=7
+            )
+        )
+        outcome(
+            SimpleNamespace(command_name="find", connection_id=1, request_id=7, duration_micros=1500)
+        )
+    assert sample("commutr_mongo_command_seconds_count", **labels) == before + 2
+    assert sample("commutr_mongo_command_failures_total", **labels) == failures + 1
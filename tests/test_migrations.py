@@ -0,0 +1,29 @@
+from datetime import datetime
+import pytest
+from app import db_client
+from app.db_queries.migrations import migrate_activity_dates
+
+IDS = [930000, 930001]
+
+
+@pytest.fixture
+def string_dates(get_app):
+    db_client.db.activities.delete_many({"id": {"$in": IDS}})
+    db_client.db.activities.insert_many(
+        [
+            {"id": IDS[0], "start_date": "2024-03-01T08:00:00Z"},
+            {"id": IDS[1], "start_date": "not a date"},
+        ]
+    )
+    yield
+    db_client.db.activities.delete_many({"id": {"$in": IDS}})
+
+
+def test_migrate_activity_dates_counts_invalid_dates(string_dates, caplog):
+    summary = migrate_activity_dates()
+    assert summary["converted"] >= 1
+    assert summary["skipped"] >= 1
+    converted, invalid = (db_client.db.activities.find_one({"id": i}) for i in IDS)
+    assert converted["start_date"] == datetime(2024, 3, 1, 8)
+    assert invalid["start_date"] == "not a date"
+    assert "Invalid start_date" in caplog.text
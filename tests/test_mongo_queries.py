@@ -0,0 +1,74 @@
+from datetime import datetime
+from app import db_client
+from app.analytics import ANALYTICS_FIELDS
+from app.db_queries.dates import normalize_activity_dates
+from app.db_queries.indexes import (
+    collection_scans,
+    ensure_activity_indexes,
+    ensure_indexes,
+    explain_stages,
+)
+from app.db_queries.mongo_queries import weekly_aggregator
+
+
+class TestActivityDates:
+    def test_normalize_activity_dates(self, activity):
+        activity["start_date"] = "2018-02-16T14:52:54Z"
+        activity["start_date_local"] = "2018-02-16T06:52:54Z"
+        normalized = normalize_activity_dates(activity)
+        assert normalized["start_date"] == datetime(2018, 2, 16, 14, 52, 54)
+        assert normalized["start_date_local"] == datetime(2018, 2, 16, 6, 52, 54)
+        # The original activity isn't modified
+        assert activity["start_date"] == "2018-02-16T14:52:54Z"
+
+    def test_normalize_is_idempotent(self):
+        activity = {"start_date": datetime(2018, 2, 16, 14, 52, 54)}
+        assert normalize_activity_dates(activity) == activity
+
+
+class TestWeeklyAggregator:
+    def test_weekly_aggregator_uses_covering_index(self, admin):
+        ensure_activity_indexes()
+        explain = db_client.db.command(
+            "aggregate",
+            "activities",
+            pipeline=weekly_aggregator(admin.strava_id, datetime(2023, 1, 1)),
+            explain=True,
+        )
+        stages = explain_stages(explain)
+        assert "IXSCAN" in stages
+        assert "COLLSCAN" not in stages
+        # No FETCH means the documents were never loaded
+        assert "FETCH" not in stages
+
+
+class TestActivityColumnsQuery:
+    def test_activity_columns_use_athlete_start_date_index(self, admin):
+        ensure_activity_indexes()
+        explain = db_client.db.command(
+            "explain",
+            {
+                "find": "activities",
+                "filter": {
+                    "athlete.id": admin.strava_id,
+                    "start_date": {"$gte": datetime(2023, 1, 1)},
+                },
+                "projection": ANALYTICS_FIELDS,
+            },
+            verbosity="queryPlanner",
+        )
+        stages = explain_stages(explain)
+        assert "IXSCAN" in stages
+        assert "COLLSCAN" not in stages
+
+
+class TestIndexes:
+    def test_no_query_scans_a_collection(self, get_app):
+        ensure_indexes()
+        assert collection_scans() == []
+
+    def test_ensure_indexes_is_idempotent(self, get_app):
+        first = ensure_indexes()
+        assert ensure_indexes() == first
+        names = db_client.db.users.index_information()
+        assert names["username_unique"]["unique"]
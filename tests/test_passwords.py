@@ -0,0 +1,37 @@
+import threading
+import pytest
+from argon2 import PasswordHasher
+from app.passwords import PasswordVerifier, VerifierBusy, calibrate
+
+
+def test_calibrate_fits_target():
+    settings = calibrate(1000, memory_cost=8192, parallelism=1, max_time_cost=3, rounds=1)
+    assert 1 <= settings["time_cost"] <= 3
+    assert settings["memory_cost"] == 8192
+    assert settings["parallelism"] == 1
+
+
+def test_verifier_runs_checks():
+    hasher = PasswordHasher(time_cost=1, memory_cost=8192, parallelism=1)
+    verifier = PasswordVerifier(max_workers=1)
+    password_hash = verifier.run(hasher.hash, "cat")
+    assert verifier.run(hasher.verify, password_hash, "cat")
+
+
+def test_verifier_rejects_when_full():
+    verifier = PasswordVerifier(max_workers=1, max_pending=0)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+
+    thread = threading.Thread(target=verifier.run, args=(slow,))
+    thread.start()
+    started.wait(5)
+    with pytest.raises(VerifierBusy):
+        verifier.run(lambda: None)
+    release.set()
+    thread.join()
+    assert verifier.run(lambda: True)
@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+import pytest
+from app import db_client
+from app.conditional import data_validators
+from app.db_queries.data_versions import bump_data_versions, get_data_version
+from app.main.profile import ProfileCache
+
+WEEK_START = datetime(2024, 3, 4)
+
+
+def validators(data_version=1, viewer="alice", updated=datetime(2024, 3, 5, 8)):
+    version = {"data_version": data_version, "data_updated_at": updated}
+    return data_validators(("alice", 10, "miles", viewer), version, not_before=WEEK_START)
+
+
+class TestDataValidators:
+    def test_etag_changes_with_version_and_key(self):
+        etag, _ = validators()
+        assert etag == validators()[0]
+        assert etag != validators(data_version=2)[0]
+        assert etag != validators(viewer="admin")[0]
+
+    def test_last_modified_is_at_least_not_before(self):
+        _, last_modified = validators(updated=datetime(2024, 3, 5, 8, 0, 0, 500))
+        assert last_modified == datetime(2024, 3, 5, 8, tzinfo=timezone.utc)
+        _, last_modified = validators(updated=datetime(2024, 2, 1))
+        assert last_modified == WEEK_START.replace(tzinfo=timezone.utc)
+
+    def test_no_last_modified_without_times(self):
+        _, last_modified = data_validators(("alice",), {})
+        assert last_modified is None
+
+
+def test_fragments_render_once_per_key():
+    cache = ProfileCache()
+    renders = []
+
+    def render():
+        renders.append(1)
+        return "<p>totals</p>"
+
+    key = ("alice", 1, 10, "miles")
+    assert cache.fragment(key, render) == "<p>totals</p>"
+    assert cache.fragment(key, render) == "<p>totals</p>"
+    cache.fragment(("alice", 2, 10, "miles"), render)
+    assert len(renders) == 2
+
+
+@pytest.fixture
+def client(get_app, admin):
+    client = get_app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = admin.username
+    return client
+
+
+class TestProfilePage:
+    def test_not_modified_until_data_changes(self, client, admin):
+        url = f"/user/{admin.username}"
+        response = client.get(url)
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+        version = get_data_version(admin.username).get("data_version", 0)
+        bump_data_versions([admin.strava_id])
+        assert get_data_version(admin.username)["data_version"] == version + 1
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+    def test_bad_arguments(self, client, admin):
+        assert client.get(f"/user/{admin.username}?weeks=0").status_code == 400
+        assert client.get(f"/user/{admin.username}?units=furlongs").status_code == 400
+        assert client.get("/user/no_such_user_123").status_code == 404
+
+    def test_profile_writes_bump_the_version(self, alice):
+        version = get_data_version(alice.username).get("data_version", 0)
+        alice.update_user_in_mongo({"scope": alice.scope}, profile=True)
+        assert db_client.db.users.find_one({"username": alice.username})["data_version"] == (
+            version + 1
+        )
@@ -0,0 +1,69 @@
+from datetime import datetime
+import pytest
+from app import db_client
+from app.strava_api.rate_limit import (
+    PRIORITY_BACKFILL,
+    PRIORITY_LIVE,
+    RateLimitGovernor,
+    parse_rate_limit_headers,
+    seconds_until_reset,
+    short_window_start,
+)
+
+
+class TestRateLimitHelpers:
+    def test_short_window_start(self):
+        now = datetime(2024, 1, 8, 10, 44, 59, 100)
+        assert short_window_start(now) == datetime(2024, 1, 8, 10, 30)
+
+    def test_seconds_until_reset(self):
+        assert seconds_until_reset(datetime(2024, 1, 8, 10, 44)) == 60
+
+    def test_parse_headers(self):
+        headers = {"X-RateLimit-Limit": "200,2000", "X-RateLimit-Usage": "12,150"}
+        assert parse_rate_limit_headers(headers) == (200, 2000, 12, 150)
+
+    def test_parse_headers_uses_tightest_limit(self):
+        headers = {
+            "X-RateLimit-Limit": "200,2000",
+            "X-RateLimit-Usage": "12,150",
+            "X-ReadRateLimit-Limit": "100,1000",
+            "X-ReadRateLimit-Usage": "12,150",
+        }
+        assert parse_rate_limit_headers(headers) == (100, 1000, 12, 150)
+
+    def test_parse_missing_headers(self):
+        assert parse_rate_limit_headers({}) is None
+        assert parse_rate_limit_headers({"X-RateLimit-Limit": "200"}) is None
+
+
+@pytest.fixture
+def governor(get_app):
+    governor = RateLimitGovernor(
+        short_limit=4, long_limit=100, backfill_reserve=0.5, key="test_bucket"
+    )
+    db_client.db.strava_rate_limits.delete_one({"_id": governor.key})
+    yield governor
+    db_client.db.strava_rate_limits.delete_one({"_id": governor.key})
+
+
+class TestRateLimitGovernor:
+    def test_backfill_leaves_reserve_for_live(self, governor):
+        now = datetime(2024, 1, 8, 10, 44)
+        assert governor.acquire(PRIORITY_BACKFILL, now=now) == 0
+        assert governor.acquire(PRIORITY_BACKFILL, now=now) == 0
+        assert governor.acquire(PRIORITY_BACKFILL, now=now) == 60
+        assert governor.acquire(PRIORITY_LIVE, now=now) == 0
+        assert governor.acquire(PRIORITY_LIVE, now=now) == 0
+        assert governor.acquire(PRIORITY_LIVE, now=now) == 60
+
+    def test_window_resets(self, governor):
+        for _ in range(4):
+            governor.acquire(PRIORITY_LIVE, now=datetime(2024, 1, 8, 10, 44))
+        assert governor.acquire(PRIORITY_LIVE, now=datetime(2024, 1, 8, 10, 45)) == 0
+
+    def test_headers_update_usage(self, governor):
+        now = datetime(2024, 1, 8, 10, 44)
+        headers = {"X-RateLimit-Limit": "10,100", "X-RateLimit-Usage": "10,20"}
+        governor.update_from_response(headers, 200, now=now)
+        assert governor.acquire(PRIORITY_LIVE, now=now) == 60
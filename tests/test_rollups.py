@@ -0,0 +1,82 @@
+from datetime import datetime
+import pytest
+from app import db_client
+from app.db_queries.rollups import rollup_operations, rebuild_weekly_rollups
+
+
+def make_activity(start_date, distance, athlete_id=42):
+    return {"athlete": {"id": athlete_id}, "start_date": start_date, "distance": distance}
+
+
+def operations_by_week(operations):
+    return {
+        op._filter["week_start"]: op._doc["$inc"] for op in operations  # pylint: disable=protected-access
+    }
+
+
+class TestRollupOperations:
+    def test_insert_increments_week(self):
+        operations = rollup_operations([(None, make_activity("2024-01-17T08:00:00Z", 1000))])
+        assert operations_by_week(operations) == {
+            datetime(2024, 1, 15): {"total": 1000, "count": 1}
+        }
+
+    def test_inserts_in_same_week_are_merged(self):
+        changes = [
+            (None, make_activity("2024-01-15T08:00:00Z", 1000)),
+            (None, make_activity("2024-01-21T18:00:00Z", 500)),
+        ]
+        operations = rollup_operations(changes)
+        assert len(operations) == 1
+        assert operations[0]._doc["$inc"] == {"total": 1500, "count": 2}
+
+    def test_edit_applies_distance_delta(self):
+        old = make_activity("2024-01-17T08:00:00Z", 1000)
+        new = make_activity("2024-01-17T08:00:00Z", 1200)
+        operations = rollup_operations([(old, new)])
+        assert operations_by_week(operations) == {
+            datetime(2024, 1, 15): {"total": 200, "count": 0}
+        }
+
+    def test_edit_without_distance_change_is_skipped(self):
+        old = make_activity("2024-01-17T08:00:00Z", 1000)
+        assert rollup_operations([(old, dict(old))]) == []
+
+    def test_edit_moving_week(self):
+        old = make_activity("2024-01-17T08:00:00Z", 1000)
+        new = make_activity("2024-01-24T08:00:00Z", 1000)
+        operations = rollup_operations([(old, new)])
+        assert operations_by_week(operations) == {
+            datetime(2024, 1, 15): {"total": -1000, "count": -1},
+            datetime(2024, 1, 22): {"total": 1000, "count": 1},
+        }
+
+    def test_delete_decrements_week(self):
+        old = make_activity(datetime(2024, 1, 1, 23, 0), 300)
+        operations = rollup_operations([(old, None)])
+        assert operations_by_week(operations) == {
+            datetime(2024, 1, 1): {"total": -300, "count": -1}
+        }
+
+
+class TestRebuild:
+    def test_rebuild_matches_activities(self, admin):
+        rebuild_weekly_rollups(admin.strava_id)
+        rollups = list(db_client.db.weekly_rollups.find({"athlete_id": admin.strava_id}))
+        activities = list(db_client.db.activities.find({"athlete.id": admin.strava_id}))
+        assert sum(rollup["count"] for rollup in rollups) == len(activities)
+        assert round(sum(rollup["total"] for rollup in rollups), 1) == round(
+            sum(activity["distance"] for activity in activities), 1
+        )
+
+    def test_weekly_totals_read_the_rollups(self, admin):
+        rebuild_weekly_rollups(admin.strava_id)
+        totals = admin.get_user_commute_totals(weeks=520, units="m")
+        since = datetime.strptime(list(totals)[-1], "%Y-%m-%d")
+        rollups = db_client.db.weekly_rollups.find(
+            {"athlete_id": admin.strava_id, "week_start": {"$gte": since}}
+        )
+        # Each week is rounded to 2 decimals
+        assert sum(totals.values()) == pytest.approx(
+            sum(rollup["total"] for rollup in rollups), abs=0.005 * len(totals)
+        )
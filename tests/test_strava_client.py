@@ -0,0 +1,55 @@
+import pytest
+import requests
+import responses
+from app.strava_api.client import StravaClient, get_strava_client
+
+URL = "https://www.strava.com/api/v3/athlete/activities"
+
+
+@pytest.fixture
+def client():
+    return StravaClient(pool_maxsize=2)
+
+
+class TestStravaClient:
+    @responses.activate
+    def test_successful_request(self, client):
+        responses.add(method="GET", url=URL, json=[{"id": 1}], status=200)
+        result = client.request(URL, params={"page": 1})
+        assert result.ok
+        assert result.status_code == 200
+        assert result.data == [{"id": 1}]
+        assert responses.calls[0].request.url == f"{URL}?page=1"
+
+    @responses.activate
+    def test_error_status(self, client):
+        responses.add(method="GET", url=URL, json={"message": "Bad"}, status=401)
+        result = client.request(URL)
+        assert not result.ok
+        assert result.status_code == 401
+        assert result.data == {"message": "Bad"}
+        assert result.error.startswith("401")
+
+    @responses.activate
+    def test_connection_error(self, client):
+        responses.add(
+            method="GET", url=URL, body=requests.exceptions.ConnectionError("refused")
+        )
+        result = client.request(URL)
+        assert not result.ok
+        assert result.status_code == 0
+        assert "refused" in result.error
+
+    @responses.activate
+    def test_empty_body(self, client):
+        responses.add(method="DELETE", url=URL, status=204)
+        result = client.request(URL, method="DELETE")
+        assert result.ok
+        assert result.data is None
+
+    def test_session_is_pooled(self, client):
+        adapter = client.session.get_adapter("https://www.strava.com")
+        assert adapter._pool_maxsize == 2  # pylint: disable=protected-access
+
+    def test_client_is_shared(self, get_app):
+        assert get_strava_client() is get_strava_client()
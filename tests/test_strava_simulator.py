@@ -0,0 +1,94 @@
+from datetime import timedelta
+import pytest
+from benchmarks.strava_simulator import (
+    ACTIVITY_ID_FACTOR,
+    SimulatorSettings,
+    athlete_from_token,
+    create_simulator,
+)
+from app.db_queries.dates import parse_strava_date
+
+ATHLETE_ID = 990000001
+
+
+@pytest.fixture
+def simulator():
+    return create_simulator(SimulatorSettings(activities_per_athlete=120)).test_client()
+
+
+def auth(athlete_id=ATHLETE_ID):
+    return {"Authorization": f"Bearer sim.{athlete_id}.abc"}
+
+
+def test_token_exchange_and_refresh(simulator):
+    response = simulator.post(
+        "/oauth/token", data={"grant_type": "authorization_code", "code": "anything"}
+    )
+    data = response.get_json()
+    assert data["athlete"]["id"] == ATHLETE_ID
+    assert athlete_from_token(data["access_token"], 0) == ATHLETE_ID
+    response = simulator.post(
+        "/oauth/token",
+        data={"grant_type": "refresh_token", "refresh_token": data["refresh_token"]},
+    )
+    assert "athlete" not in response.get_json()
+    assert response.headers["X-RateLimit-Limit"] == "200,2000"
+
+
+def test_activities_are_paged(simulator):
+    pages = []
+    for page in range(1, 5):
+        response = simulator.get(
+            "/api/v3/athlete/activities", query_string={"page": page, "per_page": 50}, headers=auth()
+        )
+        pages.append(response.get_json())
+    assert [len(page) for page in pages] == [50, 50, 20, 0]
+    ids = [activity["id"] for page in pages for activity in page]
+    assert ids == [ATHLETE_ID * ACTIVITY_ID_FACTOR + n for n in range(120)]
+    assert pages[0][0]["athlete"]["id"] == ATHLETE_ID
+
+
+def test_activities_before_and_after(simulator):
+    newest = simulator.get("/api/v3/athlete/activities", headers=auth()).get_json()
+    start = parse_strava_date(newest[2]["start_date"])
+    epoch = int((start - parse_strava_date("1970-01-01T00:00:00Z")).total_seconds())
+    before = simulator.get(
+        "/api/v3/athlete/activities", query_string={"before": epoch}, headers=auth()
+    ).get_json()
+    assert before[0]["id"] == newest[3]["id"]
+    after = simulator.get(
+        "/api/v3/athlete/activities", query_string={"after": epoch}, headers=auth()
+    ).get_json()
+    assert [activity["id"] for activity in after] == [newest[0]["id"], newest[1]["id"]]
+    assert parse_strava_date(after[-1]["start_date"]) - start == timedelta(hours=8)
+
+
+def test_activity_detail(simulator):
+    activity_id = ATHLETE_ID * ACTIVITY_ID_FACTOR + 7
+    response = simulator.get(f"/api/v3/activities/{activity_id}", headers=auth())
+    assert response.get_json()["id"] == activity_id
+    missing = ATHLETE_ID * ACTIVITY_ID_FACTOR + 500
+    assert simulator.get(f"/api/v3/activities/{missing}").status_code == 404
+
+
+def test_rate_limit(simulator):
+    client = create_simulator(SimulatorSettings(short_limit=2)).test_client()
+    statuses = [client.get("/api/v3/athlete/activities").status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+
+
+def test_error_rate():
+    client = create_simulator(SimulatorSettings(error_rate=1)).test_client()
+    assert client.get("/api/v3/athlete/activities").status_code == 500
+
+
+def test_push_subscriptions(simulator):
+    created = simulator.post(
+        "/api/v3/push_subscriptions", data={"callback_url": "http://localhost/strava/webhook"}
+    )
+    assert created.status_code == 201
+    subscription_id = created.get_json()["id"]
+    assert simulator.get("/api/v3/push_subscriptions").get_json()[0]["id"] == subscription_id
+    assert simulator.post("/api/v3/push_subscriptions").status_code == 400
+    assert simulator.delete(f"/api/v3/push_subscriptions/{subscription_id}").status_code == 204
+    assert simulator.get("/api/v3/push_subscriptions").get_json() == []
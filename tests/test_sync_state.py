@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+import pytest
+import responses
+from responses import matchers
+from app import db_client
+from app.db_queries.sync_state import COMPLETE, PAUSED, get_sync_state
+from app.strava_api import RateLimitExceeded
+
+ACTIVITIES_URL = "https://www.strava.com/api/v3/athlete/activities"
+
+
+def make_activities(admin, first_id, count, first_date):
+    return [
+        {
+            "id": first_id + i,
+            "athlete": {"id": admin.strava_id},
+            "start_date": (first_date - timedelta(days=i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "distance": 1000.0,
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def clean_sync(admin):
+    db_client.db.sync_state.delete_one({"athlete_id": admin.strava_id})
+    yield
+    db_client.db.sync_state.delete_one({"athlete_id": admin.strava_id})
+    db_client.db.activities.delete_many({"id": {"$gte": 900000, "$lt": 900100}})
+
+
+def page_matcher(page):
+    return matchers.query_param_matcher({"page": str(page)}, strict_match=False)
+
+
+class TestSyncActivities:
+    @responses.activate
+    def test_sync_resumes_from_checkpoint(self, admin, access_token_mock, clean_sync):
+        responses.add(access_token_mock)
+        newest = datetime(2024, 3, 1, 8, 0, 0)
+        first_page = make_activities(admin, 900000, 50, newest)
+        second_page = make_activities(admin, 900050, 10, newest - timedelta(days=50))
+        responses.add(
+            method="GET", url=ACTIVITIES_URL, json=first_page, match=[page_matcher(1)]
+        )
+        rate_limited = responses.add(
+            method="GET", url=ACTIVITIES_URL, status=429, match=[page_matcher(2)]
+        )
+
+        with pytest.raises(RateLimitExceeded):
+            admin.sync_activities()
+        state = get_sync_state(admin.strava_id)
+        assert state["status"] == PAUSED
+        assert state["last_page"] == 1
+        assert state["newest_start_date"] == newest
+
+        responses.remove(rate_limited)
+        responses.add(
+            method="GET", url=ACTIVITIES_URL, json=second_page, match=[page_matcher(2)]
+        )
+        stats = admin.sync_activities()
+        assert stats.activities == 10
+        state = get_sync_state(admin.strava_id)
+        assert state["status"] == COMPLETE
+        assert state["last_page"] == 2
+        assert state["oldest_start_date"] == newest - timedelta(days=59)
+        # Page 1 was only fetched by the first sync
+        pages = [
+            call.request.params["page"]
+            for call in responses.calls
+            if "page" in call.request.params
+        ]
+        assert pages.count("1") == 1
+
+    @responses.activate
+    def test_incremental_sync_uses_high_water_mark(self, admin, access_token_mock, clean_sync):
+        responses.add(access_token_mock)
+        newest = datetime(2024, 3, 1, 8, 0, 0)
+        responses.add(
+            method="GET", url=ACTIVITIES_URL, json=make_activities(admin, 900000, 3, newest)
+        )
+        admin.sync_activities()
+        admin.sync_activities()
+        last_request = responses.calls[-1].request
+        high_water_mark = int((newest - datetime(1970, 1, 1)).total_seconds())
+        assert last_request.params["after"] == str(high_water_mark)
+        assert "before" not in last_request.params
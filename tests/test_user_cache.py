@@ -0,0 +1,38 @@
+import pytest
+from app import db_client
+from app.db_queries.user_cache import UserCache
+
+
+@pytest.fixture
+def cache(get_app):
+    return UserCache(maxsize=10, ttl=60)
+
+
+class TestUserCache:
+    def test_find_caches_user(self, cache):
+        assert cache.find("username", "alice")["username"] == "alice"
+        assert cache.find("username", "alice")["username"] == "alice"
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_cached_document_is_a_copy(self, cache):
+        cache.find("username", "alice")["access_token"] = "changed"
+        assert cache.find("username", "alice").get("access_token") != "changed"
+
+    def test_invalidate_by_strava_id(self, cache):
+        admin = cache.find("username", "admin")
+        cache.find("strava_id", admin["strava_id"])
+        cache.invalidate(strava_id=admin["strava_id"])
+        assert len(cache.cache) == 0
+
+    def test_missing_user(self, cache):
+        assert cache.find("username", "nobody-has-this-name") is None
+
+    def test_update_user_in_mongo_invalidates(self, alice):
+        from app.db_queries.user_cache import user_cache
+
+        user_cache.find("username", "alice")
+        alice.update_user_in_mongo({"access_token": "ABCDEF"})
+        assert user_cache.find("username", "alice")["access_token"] == "ABCDEF"
+        alice.update_user_in_mongo({"access_token": ""})
+        assert db_client.db.users.find_one({"username": "alice"})["access_token"] == ""
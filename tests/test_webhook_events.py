@@ -0,0 +1,121 @@
+import pytest
+import responses
+from app import db_client
+from app.celery_tasks import enqueue_event
+from app.db_queries.webhook_events import coalesce_events, get_pending
+from app.models import Event
+
+
+def event(aspect_type, event_time, updates=None, object_id=11):
+    return {
+        "object_type": "activity",
+        "object_id": object_id,
+        "aspect_type": aspect_type,
+        "updates": updates or {},
+        "owner_id": 8587070,
+        "subscription_id": 253500,
+        "event_time": event_time,
+        "collection": "activities",
+    }
+
+
+class TestCoalesceEvents:
+    def test_updates_are_merged_in_event_time_order(self):
+        merged = coalesce_events(
+            [
+                event("update", 3, {"type": "Ride"}),
+                event("update", 1, {"title": "Old"}),
+                event("update", 2, {"title": "New"}),
+            ]
+        )
+        assert merged["aspect_type"] == "update"
+        assert merged["updates"] == {"title": "New", "type": "Ride"}
+        assert merged["event_time"] == 3
+
+    def test_create_then_update_is_a_create(self):
+        merged = coalesce_events([event("create", 1), event("update", 2, {"title": "A"})])
+        assert merged["aspect_type"] == "create"
+
+    def test_newest_delete_wins(self):
+        merged = coalesce_events([event("create", 1), event("delete", 2)])
+        assert merged["aspect_type"] == "delete"
+        assert merged["event_time"] == 2
+
+    def test_stale_events_are_dropped(self):
+        assert coalesce_events([event("update", 4, {"title": "Old"})], applied_time=5) is None
+        merged = coalesce_events(
+            [event("update", 4, {"title": "Old"}), event("update", 6, {"type": "Run"})],
+            applied_time=5,
+        )
+        assert merged["updates"] == {"type": "Run"}
+
+    def test_events_at_the_applied_time_are_kept(self):
+        # The create at 5 was applied in an earlier batch
+        merged = coalesce_events([event("update", 5, {"title": "New"})], applied_time=5)
+        assert merged["aspect_type"] == "update"
+        assert merged["updates"] == {"title": "New"}
+
+
+@pytest.fixture
+def clean_webhook_state(get_app):
+    def clean():
+        db_client.db.webhook_deliveries.delete_many({"_id": {"$regex": "^activity:11:"}})
+        db_client.db.webhook_pending.delete_many({"_id": "activity:11"})
+        db_client.db.webhook_objects.delete_many({"_id": "activity:11"})
+        db_client.db.activities.delete_many({"id": 11})
+
+    clean()
+    yield
+    clean()
+
+
+class TestEnqueueEvent:
+    @responses.activate
+    def test_duplicates_are_dropped(
+        self, admin, activity, access_token_mock, clean_webhook_state
+    ):
+        responses.add(access_token_mock)
+        activity["id"] = 11
+        responses.add(
+            method="GET",
+            url="https://www.strava.com/api/v3/activities/11",
+            json=activity,
+            status=200,
+        )
+        assert enqueue_event(Event(**event("create", 100)))
+        assert not enqueue_event(Event(**event("create", 100)))
+        assert get_pending("activity", 11) == []
+        activity_calls = [call for call in responses.calls if "/activities/11" in call.request.url]
+        assert len(activity_calls) == 1
+
+    @responses.activate
+    def test_older_events_are_ignored(
+        self, admin, activity, access_token_mock, clean_webhook_state
+    ):
+        responses.add(access_token_mock)
+        activity["id"] = 11
+        responses.add(
+            method="GET",
+            url="https://www.strava.com/api/v3/activities/11",
+            json=activity,
+            status=200,
+        )
+        enqueue_event(Event(**event("delete", 200)))
+        enqueue_event(Event(**event("create", 100)))
+        assert db_client.db.activities.find_one({"id": 11}) is None
+
+    @responses.activate
+    def test_same_second_update_in_a_later_batch_is_applied(
+        self, admin, activity, access_token_mock, clean_webhook_state
+    ):
+        responses.add(access_token_mock)
+        activity["id"] = 11
+        responses.add(
+            method="GET",
+            url="https://www.strava.com/api/v3/activities/11",
+            json=activity,
+            status=200,
+        )
+        enqueue_event(Event(**event("create", 300)))
+        enqueue_event(Event(**event("update", 300, {"title": "Renamed"})))
+        assert db_client.db.activities.find_one({"id": 11})["name"] == "Renamed"
@@ -0,0 +1,4 @@
+from app import create_app
+
+app = create_app(role="worker")
+celery_app = app.extensions["celery"]